@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 """
 Controller script that runs both text processing and embedding creation/upload.
-This script simply calls the two existing scripts in sequence.
+By default both run in this process as one streaming pipeline (see pipeline.py), so titling,
+embedding, and uploading overlap. Pass --sequential to call the two existing scripts in turn instead,
+or --batch to send the titles and embeddings through the Batch API (see batch_mode.py).
+--watch keeps running after the first pass and ingests corpus changes as they happen (see watch_corpus.py).
 """
 
 import subprocess
 import sys
 import os
+import argparse
 
 def run_script(script_name, description):
     """Run a Python script and handle any errors."""
@@ -25,10 +29,8 @@ def run_script(script_name, description):
         print(f"✗ Script {script_name} not found!")
         return False
 
-def main():
+def run_sequential():
     """Run the complete pipeline by calling both scripts."""
-    print("Starting complete pipeline...")
-    
     # Step 1: Run text processing
     if not run_script("run_processing.py", "Text Processing"):
         print("Pipeline failed at text processing step.")
@@ -38,6 +40,39 @@ def main():
     if not run_script("create_embeddings_and_upload.py", "Embedding Creation & Upload"):
         print("Pipeline failed at embedding creation step.")
         sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Process, embed, and upload the corpus.")
+    parser.add_argument('--sequential', action='store_true',
+                        help="Run run_processing.py and create_embeddings_and_upload.py one after the other")
+    parser.add_argument('--batch', action='store_true',
+                        help="Use the Batch API: cheaper for large loads, but may take hours (resumable)")
+    parser.add_argument('--watch', action='store_true',
+                        help="After the first pass, keep watching corpus/ and ingest changes as they happen")
+    args = parser.parse_args()
+
+    print("Starting complete pipeline...")
+    if args.sequential:
+        run_sequential()
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        if not os.getenv('OPENAI_API_KEY'):
+            print("Error: OPENAI_API_KEY environment variable is not set.")
+            sys.exit(1)
+        if args.watch:
+            from watch_corpus import run_watch
+            run_watch()
+            return
+        if args.batch:
+            from batch_mode import run_batch
+            succeeded = run_batch()
+        else:
+            from pipeline import run_pipeline
+            succeeded = run_pipeline()
+        if not succeeded:
+            print("Pipeline finished with errors; rerun to retry the failed documents.")
+            sys.exit(1)
     
     print(f"\n{'='*60}")
     print("Pipeline completed successfully! 🎉")
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+batch_mode.py: Bulk ingest through the OpenAI Batch API, for initial loads of large corpora.
+Batch requests cost half as much as synchronous ones, have their own quota, and finish within 24 hours.
+- prepare: find new or changed corpus files (as the pipeline does) and write their title and
+  embedding requests as JSONL files under BATCH_DIR. With DEDUP on, the dedup plan (dedup.py) is
+  built first, so near-duplicate documents and chunks get no embedding request.
+- submit: upload the files and create one batch per file
+- poll: wait for the batches to finish
+- merge: store titles in the corpus store, save each document's embeddings under BATCH_DIR/vectors
+  (and in the embedding cache, when it's on), and upload a document's chunks to the vector store once
+  its title and all of its embeddings have come back
+
+Progress is saved to BATCH_DIR/state.json after every step, so rerunning picks up where the last
+run stopped. With --no-wait the script submits (or checks on) the batches and exits; run it again
+later to merge. Requests that fail are left for the next run, which prepares a new batch for them.
+
+Usage: python batch_mode.py [--no-wait] [--status] [--cancel]
+
+Requires: numpy
+"""
+import os
+import sys
+import json
+import time
+import array
+import base64
+import shutil
+import argparse
+import numpy as np
+import tracing
+import dedup
+from embedder import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, cache_model, dimensions_params, iter_batches
+from embedding_cache import get_cache
+from openai_client import get_client
+from create_embeddings_and_upload import UPLOAD_BATCH_ROWS, get_source_hash, iter_chunk_rows
+from vector_store import get_store
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from manifest import Manifest, read_and_hash
+from corpus_store import doc_id_for, get_corpus_store
+from text_to_json import clean_title, title_request
+
+CORPUS_DIR = 'corpus'
+BATCH_DIR = os.getenv('BATCH_DIR', 'batch_work')
+STATE_PATH = os.path.join(BATCH_DIR, 'state.json')
+# Merged embeddings, one .npy file per request, so the upload never depends on the size-capped cache
+VECTORS_DIR = os.path.join(BATCH_DIR, 'vectors')
+BATCH_POLL_SECONDS = float(os.getenv('BATCH_POLL_SECONDS', '30'))
+# Per-file API limits: 50,000 requests, 200 MB, and 50,000 embedding inputs across the file
+MAX_BATCH_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '50000'))
+MAX_BATCH_BYTES = int(os.getenv('BATCH_MAX_BYTES', str(190 * 1024 * 1024)))
+MAX_BATCH_INPUTS = int(os.getenv('BATCH_MAX_INPUTS', '50000'))
+ENDPOINTS = {'titles': '/v1/chat/completions', 'embeddings': '/v1/embeddings'}
+TERMINAL = ('completed', 'failed', 'expired', 'cancelled')
+
+def decode_embedding(data):
+    """
+    Decode a base64 embedding (little-endian float32) into a list of floats.
+    """
+    vector = array.array('f')
+    vector.frombytes(base64.b64decode(data))
+    if sys.byteorder == 'big':
+        vector.byteswap()
+    return vector.tolist()
+
+def vectors_path(doc_id, part):
+    return os.path.join(VECTORS_DIR, f"{doc_id}.{part}.npy")
+
+def save_vectors(doc_id, part, vectors):
+    os.makedirs(VECTORS_DIR, exist_ok=True)
+    path = vectors_path(doc_id, part)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.asarray(vectors, dtype=np.float32))
+    os.replace(path + '.tmp', path)
+
+def load_vectors(doc_id, parts):
+    """
+    A document's embeddings, in chunk order, from its saved request outputs.
+    """
+    return [vector for part in range(parts) for vector in np.load(vectors_path(doc_id, part))]
+
+def load_state():
+    try:
+        with open(STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_state(state):
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    tmp_path = STATE_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, STATE_PATH)
+
+class BatchWriter:
+    """
+    Writes requests of one kind to JSONL files, starting a new file whenever one would exceed the API limits.
+    """
+
+    def __init__(self, kind, batches):
+        self.kind = kind
+        self.batches = batches
+        self.batch = None
+        self.file = None
+
+    def write(self, custom_id, body, inputs=0):
+        line = json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': ENDPOINTS[self.kind],
+                           'body': body}) + '\n'
+        size = len(line.encode('utf-8'))
+        batch = self.batch
+        if batch is None or batch['requests'] + 1 > MAX_BATCH_REQUESTS or batch['bytes'] + size > MAX_BATCH_BYTES \
+                or (inputs and batch['inputs'] + inputs > MAX_BATCH_INPUTS):
+            self.close()
+            path = os.path.join(BATCH_DIR, f"{self.kind}-{len(self.batches):04d}.jsonl")
+            self.file = open(path, 'w', encoding='utf-8')
+            batch = {'kind': self.kind, 'path': path, 'requests': 0, 'bytes': 0, 'inputs': 0,
+                     'input_file_id': None, 'batch_id': None, 'status': None, 'merged': False}
+            self.batches.append(batch)
+            self.batch = batch
+        self.file.write(line)
+        batch['requests'] += 1
+        batch['bytes'] += size
+        batch['inputs'] += inputs
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.batch = None
+
+def prepare(corpus_dir=CORPUS_DIR):
+    """
+    Write title and embedding requests for every new or changed document and return the new state.
+    """
+    manifest = Manifest()
+    corpus = get_corpus_store()
+    store = get_store()
+    store.ensure_schema()
+    cache = get_cache()
+    corpus_hashes = {doc['id']: doc['source_hash'] for doc in corpus.iter_documents(fields=('source_hash',))}
+    stored_hashes = store.source_hashes()
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    shutil.rmtree(VECTORS_DIR, ignore_errors=True)  # Left by a run that was never finished
+    state = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'model': EMBEDDING_MODEL,
+             'dimensions': EMBEDDING_DIMENSIONS, 'docs': {}, 'batches': []}
+    writers = {kind: BatchWriter(kind, state['batches']) for kind in ENDPOINTS}
+    cached_as = cache_model(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    applied = dedup.get_signature_cache().applied_plans()
+    plan = None
+
+    def add(doc_id, filename, path, text, source_hash):
+        needs_title = path is not None and corpus_hashes.get(doc_id) != source_hash
+        needs_embed = not (plan and plan.is_duplicate(filename)) \
+            and not dedup.is_current(stored_hashes, applied, plan, filename, source_hash)
+        if not needs_title and not needs_embed:
+            return False
+        doc = {'filename': filename, 'path': path, 'source_hash': source_hash,
+               'needs_title': needs_title, 'title': None, 'needs_embed': needs_embed, 'parts': 0, 'received': [],
+               'dropped': plan.dropped_chunks(filename) if plan else [], 'digest': plan.digest(filename) if plan else ''}
+        if needs_title:
+            writers['titles'].write(f"title:{doc_id}", title_request(filename, text))
+        if needs_embed:
+            rows = dedup.drop_chunks(list(iter_chunk_rows(filename, source_hash, text)), doc['dropped'])
+            texts = [row[0] for row in rows]
+            # Fully cached documents need no request, but their vectors are saved now, before merging
+            # later batches can evict them from the cache; the rest are sent whole
+            cached = cache.get_many(texts, cached_as) if cache else [None] * len(texts)
+            if texts and all(vector is not None for vector in cached):
+                save_vectors(doc_id, 0, cached)
+                doc['parts'], doc['received'] = 1, [0]
+            elif texts:
+                for part, (batch, _) in enumerate(iter_batches(texts, EMBEDDING_MODEL)):
+                    writers['embeddings'].write(f"emb:{part}:{doc_id}", {
+                        'model': EMBEDDING_MODEL, 'input': [texts[i] for i in batch], 'encoding_format': 'base64',
+                        **dimensions_params(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+                    }, len(batch))
+                    doc['parts'] += 1
+        state['docs'][doc_id] = doc
+        return True
+
+    # Files whose text differs from the corpus store; the rest are embedded from the corpus store below
+    changed = {}
+    present = set()
+    with os.scandir(corpus_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.txt') or not entry.is_file():
+                continue
+            present.add(entry.name)
+            doc_id = doc_id_for(entry.name)
+            stored_hash = corpus_hashes.get(doc_id)
+            if manifest.is_unchanged(entry.name, entry.stat()) and stored_hash:
+                continue
+            _, source_hash, stat = read_and_hash(entry.path)
+            if source_hash == stored_hash:
+                manifest.update(entry.name, stat, source_hash)
+                continue
+            changed[doc_id] = {'filename': entry.name, 'path': entry.path, 'source_hash': source_hash,
+                               'mtime_ns': stat.st_mtime_ns}
+    # Files deleted since they were processed; finish() removes their rows
+    for filename in set(manifest.entries) - present:
+        manifest.remove(filename)
+        corpus.delete(doc_id_for(filename))
+    if dedup.DEDUP:
+        with tracing.span('batch.dedup'):
+            plan = dedup.plan_corpus(corpus, get_source_hash, changed)
+        state['duplicates'] = sorted(plan.duplicates)
+    for doc_id, doc in changed.items():
+        text, source_hash, stat = read_and_hash(doc['path'])
+        if source_hash != doc['source_hash']:
+            continue  # Edited while preparing; left out of the manifest, so the next run picks it up
+        if not add(doc_id, doc['filename'], doc['path'], text, source_hash):
+            manifest.update(doc['filename'], stat, source_hash)
+    manifest.save()
+    # Stored documents not yet uploaded as planned, including ones never seen in corpus/,
+    # as create_embeddings_and_upload.py does
+    for doc in corpus.iter_documents(fields=('filename', 'source_hash')):
+        if doc['id'] in changed:
+            continue
+        if not doc['source_hash']:
+            doc = corpus.get(doc['id'])
+            doc['source_hash'] = get_source_hash(doc)
+        if not (plan and plan.is_duplicate(doc['filename'])) \
+                and not dedup.is_current(stored_hashes, applied, plan, doc['filename'], doc['source_hash']):
+            text = doc.get('text') or corpus.get(doc['id'])['text'] or ''
+            add(doc['id'], doc['filename'], None, text, doc['source_hash'])
+    for writer in writers.values():
+        writer.close()
+    requests = sum(batch['requests'] for batch in state['batches'])
+    print(f"Prepared {requests} requests in {len(state['batches'])} batch files for {len(state['docs'])} documents")
+    tracing.count('batch_requests', requests)
+    save_state(state)
+    return state
+
+def submit(state, client):
+    """
+    Upload and create every batch that hasn't been created yet.
+    """
+    for batch in state['batches']:
+        if batch['batch_id']:
+            continue
+        if not batch['input_file_id']:
+            with open(batch['path'], 'rb') as f:
+                batch['input_file_id'] = client.files.create(file=f, purpose='batch').id
+            save_state(state)
+        created = client.batches.create(input_file_id=batch['input_file_id'], endpoint=ENDPOINTS[batch['kind']],
+                                        completion_window='24h', metadata={'source': 'batch_mode.py'})
+        batch['batch_id'], batch['status'] = created.id, created.status
+        save_state(state)
+        print(f"Submitted {batch['kind']} batch {created.id} ({batch['requests']} requests)")
+
+def poll(state, client, wait=True):
+    """
+    Refresh batch statuses, waiting until every batch has finished unless wait is False.
+    Returns True once all of them have.
+    """
+    while True:
+        for batch in state['batches']:
+            if batch['status'] in TERMINAL:
+                continue
+            info = client.batches.retrieve(batch['batch_id'])
+            batch['status'] = info.status
+            batch['output_file_id'] = info.output_file_id
+            batch['error_file_id'] = info.error_file_id
+            counts = info.request_counts
+            if counts:
+                print(f"{batch['kind']} batch {info.id}: {info.status}, "
+                      f"{counts.completed}/{counts.total} done, {counts.failed} failed")
+        save_state(state)
+        if all(batch['status'] in TERMINAL for batch in state['batches']):
+            return True
+        if not wait:
+            return False
+        time.sleep(BATCH_POLL_SECONDS)
+
+def iter_results(client, batch):
+    """
+    Yield (custom_id, status code, response body) for every request in a finished batch,
+    downloading its output and error files once.
+    """
+    for key in ('output_file_id', 'error_file_id'):
+        if not batch.get(key):
+            continue
+        path = os.path.join(BATCH_DIR, f"{batch['batch_id']}-{key[:-len('_file_id')]}.jsonl")
+        if not os.path.exists(path):
+            client.files.content(batch[key]).write_to_file(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    response = result.get('response') or {}
+                    yield result['custom_id'], response.get('status_code'), response.get('body')
+
+def merge_batch(state, batch, client, cache):
+    """
+    Record a finished batch's titles in the state and save its embeddings under VECTORS_DIR (and in the
+    cache, if it's on). Returns the number of failed requests.
+    """
+    inputs = {}
+    if batch['kind'] == 'embeddings':
+        # Outputs don't echo their inputs, so read them back from the request file
+        with open(batch['path'], 'r', encoding='utf-8') as f:
+            for line in f:
+                request = json.loads(line)
+                inputs[request['custom_id']] = request['body']['input']
+    failed = 0
+    for custom_id, status, body in iter_results(client, batch):
+        kind, _, rest = custom_id.partition(':')
+        if kind == 'title':
+            doc = state['docs'].get(rest)
+            if doc is None:
+                continue
+            if status == 200:
+                doc['title'] = clean_title(body['choices'][0]['message']['content'], doc['filename'])
+            elif status and 400 <= status < 500 and status != 429:
+                # Rejected outright; fall back to the filename, as generate_title does
+                doc['title'] = clean_title(None, doc['filename'])
+            else:
+                failed += 1
+        else:
+            part, _, doc_id = rest.partition(':')
+            doc = state['docs'].get(doc_id)
+            if doc is None or custom_id not in inputs:
+                continue
+            if status != 200:
+                failed += 1
+                continue
+            vectors = [None] * len(body['data'])
+            for item in body['data']:
+                embedding = item['embedding']
+                vectors[item['index']] = decode_embedding(embedding) if isinstance(embedding, str) else embedding
+            save_vectors(doc_id, part, vectors)
+            if cache:
+                cache.put_many(inputs[custom_id], cache_model(state['model'], state.get('dimensions')), vectors)
+            doc['received'].append(int(part))
+    batch['merged'] = True
+    batch['failed'] = failed
+    save_state(state)
+    return failed
+
+def apply_results(state):
+    """
+    Write out every document whose requests have come back: titles to the corpus store, and chunks
+    (with their saved embeddings) to the vector store. A document's chunks wait for its title, since
+    rows for a document missing from the corpus store are removed as gone. Documents that still need
+    something are left in the state. Returns how many there are.
+    """
+    manifest = Manifest()
+    corpus = get_corpus_store()
+    store = get_store()
+    rows = []
+    vectors = []
+    ready = []  # (doc, stat) uploaded with the next flush
+
+    def record_done(doc, stat):
+        if stat is not None and not doc['needs_title'] and not doc['needs_embed']:
+            manifest.update(doc['filename'], stat, doc['source_hash'])
+
+    def flush():
+        if rows:
+            with tracing.span('vector_store.upsert', backend=store.name):
+                store.upsert(rows, vectors)
+            print(f"Upserted {len(rows)} chunks from {len(ready)} documents")
+        # Documents left with no chunks (empty, or every chunk a near-duplicate) keep no stale rows
+        uploaded = {row[1] for row in rows}
+        empty = [doc['filename'] for doc, _ in ready if doc['filename'] not in uploaded]
+        if empty:
+            store.delete_sources(empty)
+        for doc, stat in ready:
+            doc['needs_embed'] = False
+            dedup.get_signature_cache().set_applied(doc['filename'], doc.get('digest', ''))
+            record_done(doc, stat)
+        rows.clear()
+        vectors.clear()
+        ready.clear()
+        manifest.save()
+        save_state(state)
+
+    for doc_id, doc in state['docs'].items():
+        title_ready = doc['needs_title'] and doc['title'] is not None
+        embed_ready = doc['needs_embed'] and (title_ready or not doc['needs_title']) \
+            and len(set(doc['received'])) == doc['parts']
+        if not title_ready and not embed_ready:
+            continue
+        if doc['path']:
+            try:
+                text, source_hash, stat = read_and_hash(doc['path'])
+            except FileNotFoundError:
+                source_hash = None
+            if source_hash != doc['source_hash']:
+                # Edited or deleted since it was prepared; the next run starts over from its current contents
+                doc['needs_title'] = doc['needs_embed'] = False
+                continue
+        else:
+            text, stat = corpus.get(doc_id)['text'] or '', None
+        if title_ready:
+            with tracing.span('corpus_store.put'):
+                corpus.put({'id': doc_id, 'title': doc['title'], 'text': text,
+                            'filename': doc['filename'], 'source_hash': doc['source_hash']})
+            doc['needs_title'] = False
+            print(f"Processed {doc['filename']} -> {doc['title']}")
+        if embed_ready:
+            doc_rows = dedup.drop_chunks(list(iter_chunk_rows(doc['filename'], doc['source_hash'], text)),
+                                         doc.get('dropped'))
+            doc_vectors = load_vectors(doc_id, doc['parts'])
+            if len(doc_vectors) != len(doc_rows):
+                raise RuntimeError(f"{doc['filename']}: {len(doc_vectors)} embeddings saved for {len(doc_rows)} "
+                                   f"chunks; chunking settings changed during the run. Run --cancel and start over.")
+            rows.extend(doc_rows)
+            vectors.extend(doc_vectors)
+            ready.append((doc, stat))
+            if len(rows) >= UPLOAD_BATCH_ROWS:
+                flush()
+        else:
+            record_done(doc, stat)
+    flush()
+    return sum(1 for doc in state['docs'].values() if doc['needs_title'] or doc['needs_embed'])
+
+def finish(state):
+    """
+    Remove vector store rows for documents that are gone or near-duplicates of another,
+    then archive the state and delete the batch files.
+    """
+    store = get_store()
+    present = {doc['filename'] for doc in get_corpus_store().iter_documents(fields=('filename',))}
+    present -= set(state.get('duplicates', ()))
+    removed = set(store.source_hashes()) - present
+    if removed:
+        store.delete_sources(removed)
+        print(f"Removed {len(removed)} documents from the vector store")
+    for filename in state.get('duplicates', ()):
+        dedup.get_signature_cache().set_applied(filename, '')
+    store.close()
+    for name in os.listdir(BATCH_DIR):
+        if name.endswith('.jsonl'):
+            os.remove(os.path.join(BATCH_DIR, name))
+    shutil.rmtree(VECTORS_DIR, ignore_errors=True)
+    os.replace(STATE_PATH, os.path.join(BATCH_DIR, 'last_run.json'))
+
+def print_status(state):
+    if state is None:
+        print("No batch run in progress.")
+        return
+    print(f"Batch run prepared {state['created']}: {len(state['docs'])} documents")
+    for batch in state['batches']:
+        print(f"  {batch['kind']:10} {batch['batch_id'] or '(not submitted)':32} {batch['status'] or '':12} "
+              f"{batch['requests']} requests{'  merged' if batch['merged'] else ''}")
+
+def cancel(state, client):
+    for batch in state['batches']:
+        if batch['batch_id'] and batch['status'] not in TERMINAL:
+            client.batches.cancel(batch['batch_id'])
+            print(f"Cancelled {batch['kind']} batch {batch['batch_id']}")
+    for name in os.listdir(BATCH_DIR):
+        if name.endswith('.jsonl'):
+            os.remove(os.path.join(BATCH_DIR, name))
+    shutil.rmtree(VECTORS_DIR, ignore_errors=True)
+    os.remove(STATE_PATH)
+
+def run_batch(wait=True):
+    """
+    Prepare, submit, poll, and merge, resuming a saved run if there is one.
+    Returns False if the run finished with documents left undone.
+    """
+    cache = get_cache()
+    # Batch management calls are few and cheap to retry, so let the SDK do it
+    client = get_client().with_options(max_retries=5)
+    state = load_state()
+    if state is None:
+        with tracing.span('batch.prepare'):
+            state = prepare()
+    else:
+        print(f"Resuming the batch run prepared {state['created']}")
+    submit(state, client)
+    done = poll(state, client, wait)
+    failed = 0
+    for batch in state['batches']:
+        if batch['status'] in TERMINAL and not batch['merged']:
+            with tracing.span('batch.merge', kind=batch['kind']):
+                failed += merge_batch(state, batch, client, cache)
+        elif batch['merged']:
+            failed += batch.get('failed', 0)
+    waiting = apply_results(state)
+    if not done:
+        print(f"Batches still running; {waiting} documents waiting. Run again to merge the rest.")
+        return True
+    finish(state)
+    if waiting:
+        print(f"{failed} requests failed; {waiting} documents were not finished. Rerun to retry them.")
+        return False
+    print("Batch run complete.")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Title and embed the corpus through the OpenAI Batch API.")
+    parser.add_argument('--no-wait', action='store_true', help="Submit or check on the batches, then exit")
+    parser.add_argument('--status', action='store_true', help="Show the saved run and exit")
+    parser.add_argument('--cancel', action='store_true', help="Cancel the saved run's batches and discard it")
+    args = parser.parse_args()
+
+    if args.status:
+        print_status(load_state())
+        return
+    if args.cancel:
+        state = load_state()
+        if state is None:
+            print("No batch run in progress.")
+        else:
+            cancel(state, get_client().with_options(max_retries=5))
+        return
+    if not run_batch(wait=not args.no_wait):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
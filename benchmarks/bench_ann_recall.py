@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Recall-versus-latency report for the blog_style vector index.
+- Samples query vectors from the table itself.
+- Computes exact top-k with index scans disabled, then re-runs each query through the
+  index at every ef_search (HNSW) or probes (IVFFlat) setting.
+- Reports recall@k and p50/p95 latency per setting, so you can pick the cheapest
+  setting that meets your recall target.
+
+Run from the project root after `python schema.py migrate`:
+
+    python benchmarks/bench_ann_recall.py [--queries 50] [--top-k 5] [--values 10,20,40,80,160] [--json out.json]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from schema import DISTANCE_OPERATOR, TABLE_NAME, get_db_connection, index_name, set_search_params
+
+DEFAULT_VALUES = {'hnsw': '10,20,40,80,160,320', 'ivfflat': '1,2,4,8,16,32'}
+
+def detect_index_method(cur):
+    cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", (TABLE_NAME,))
+    names = {row[0] for row in cur.fetchall()}
+    for method in ('hnsw', 'ivfflat'):
+        if index_name(method) in names:
+            return method
+    return None
+
+def search(cur, query, top_k, exact=False, ef_search=None, probes=None):
+    """
+    Return the (source_file, chunk_index) keys of the top_k rows and the query time in ms.
+    """
+    if exact:
+        cur.execute("SET LOCAL enable_indexscan = off")
+    set_search_params(cur, ef_search, probes)
+    start = time.perf_counter()
+    cur.execute(
+        f"SELECT source_file, chunk_index FROM {TABLE_NAME} ORDER BY emb {DISTANCE_OPERATOR} %s::vector LIMIT %s",
+        (query, top_k)
+    )
+    keys = [tuple(row) for row in cur.fetchall()]
+    elapsed = (time.perf_counter() - start) * 1000
+    cur.connection.rollback()  # End the transaction so SET LOCAL doesn't leak into the next query
+    return keys, elapsed
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall-versus-latency report for the blog_style index.")
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--values', help="Comma-separated ef_search (HNSW) or probes (IVFFlat) values")
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    method = detect_index_method(cur)
+    if method is None:
+        print("No vector index on blog_style; run `python schema.py migrate` first.")
+        sys.exit(1)
+    cur.execute(f"SELECT count(*) FROM {TABLE_NAME}")
+    row_count = cur.fetchone()[0]
+    cur.execute(f"SELECT emb::text FROM {TABLE_NAME} ORDER BY random() LIMIT %s", (args.queries,))
+    queries = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+
+    print(f"{method} index, {row_count} rows, {len(queries)} queries, k={args.top_k}")
+    exact_results = []
+    exact_times = []
+    for query in queries:
+        keys, elapsed = search(cur, query, args.top_k, exact=True)
+        exact_results.append(set(keys))
+        exact_times.append(elapsed)
+    report = {
+        'index': method,
+        'rows': row_count,
+        'queries': len(queries),
+        'top_k': args.top_k,
+        'exact': {'p50_ms': statistics.median(exact_times), 'p95_ms': percentile(exact_times, 95)},
+        'settings': [],
+    }
+    print(f"{'exact':>12s}  recall 1.000  p50 {report['exact']['p50_ms']:8.2f} ms  p95 {report['exact']['p95_ms']:8.2f} ms")
+
+    knob = 'ef_search' if method == 'hnsw' else 'probes'
+    for value in [int(v) for v in (args.values or DEFAULT_VALUES[method]).split(',')]:
+        recalls = []
+        times = []
+        for query, expected in zip(queries, exact_results):
+            keys, elapsed = search(cur, query, args.top_k, **{knob: value})
+            recalls.append(len(expected & set(keys)) / max(1, len(expected)))
+            times.append(elapsed)
+        result = {
+            knob: value,
+            'recall': statistics.mean(recalls),
+            'p50_ms': statistics.median(times),
+            'p95_ms': percentile(times, 95),
+        }
+        report['settings'].append(result)
+        print(f"{knob}={value:<6d}  recall {result['recall']:.3f}  "
+              f"p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms")
+    conn.close()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Benchmark compose.py startup.
+- "import compose" is what every invocation pays before the prompt appears.
+- "legacy import work" is what compose.py used to do at import time before
+  asking for a prompt: import openai and psycopg2, create the client, and scan
+  processed_corpus for random snippets.
+
+Run from the project root:
+
+    python benchmarks/bench_compose_startup.py [--runs 10]
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_COMPOSE = "import compose"
+LEGACY_IMPORT_WORK = (
+    "import openai, psycopg2, compose\n"
+    "compose.get_client()\n"
+    "compose.sample_style_snippets()\n"
+)
+
+def time_snippet(code, runs):
+    """
+    Run code in a fresh interpreter runs times and return the wall times in milliseconds.
+    """
+    env = dict(os.environ, OPENAI_API_KEY=os.getenv('OPENAI_API_KEY', 'sk-benchmark'))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    for label, code in [("import compose", IMPORT_COMPOSE), ("legacy import work", LEGACY_IMPORT_WORK)]:
+        times = time_snippet(code, args.runs)
+        print(f"{label:20s} median {statistics.median(times):8.1f} ms  "
+              f"min {min(times):8.1f} ms  max {max(times):8.1f} ms  ({args.runs} runs)")
+
+if __name__ == '__main__':
+    main()
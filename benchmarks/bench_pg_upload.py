@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Compare the ways PgVectorStore can load chunk rows into blog_style:
+- values: INSERT ... VALUES through execute_values (vectors rendered as list literals)
+- copy-binary: binary COPY into a staging table, then merged (the default)
+- copy-text: text COPY into a staging table, then merged
+
+Each method upserts the same synthetic rows under bench-upload/ source names, which are deleted
+afterwards, and reports rows/s and peak Python memory. With --encode-only, no database is
+needed: only the client-side encoding of each payload is timed and sized.
+
+Run from the project root:
+
+    python benchmarks/bench_pg_upload.py [--rows 5000] [--chunks-per-doc 10] [--batch-rows 5000] [--encode-only]
+"""
+import os
+import sys
+import json
+import argparse
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pg_copy import binary_payload, text_payload
+from schema import EMBEDDING_DIMENSIONS
+from vector_store import PgVectorStore
+
+SOURCE_PREFIX = 'bench-upload/'
+METHODS = {
+    'values': {'upload_method': 'values'},
+    'copy-binary': {'upload_method': 'copy', 'copy_format': 'binary'},
+    'copy-text': {'upload_method': 'copy', 'copy_format': 'text'},
+}
+
+def synthetic_rows(count, chunks_per_doc, dim, rng):
+    vectors = rng.standard_normal((count, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    rows = [(f"Synthetic passage {i}\twith a tab and a\nnewline. " * 20,
+             f"{SOURCE_PREFIX}doc{i // chunks_per_doc}.txt", 'bench', i % chunks_per_doc, 0, 0)
+            for i in range(count)]
+    return rows, vectors.tolist()
+
+def encode_only(rows, embeddings):
+    """
+    Time building each payload without sending it anywhere.
+    """
+    from psycopg2.extensions import adapt
+    encoders = {
+        # Approximates execute_values, which adapts each row's values into the statement text
+        'values': lambda: sum(len(adapt(embedding).getquoted()) + len(row[0]) for row, embedding in zip(rows, embeddings)),
+        'copy-binary': lambda: len(binary_payload(rows, embeddings).getvalue()),
+        'copy-text': lambda: len(text_payload(rows, embeddings).getvalue().encode('utf-8')),
+    }
+    report = {}
+    for method, encode in encoders.items():
+        start = time.perf_counter()
+        size = encode()
+        elapsed = time.perf_counter() - start
+        report[method] = {'rows_per_s': len(rows) / elapsed, 'payload_mb': size / 1e6}
+        print(f"{method:12s} {len(rows) / elapsed:12,.0f} rows/s encoded  {size / 1e6:8.1f} MB payload")
+    return report
+
+def load(rows, embeddings, batch_rows):
+    report = {}
+    for method, options in METHODS.items():
+        store = PgVectorStore(batch_rows=batch_rows, **options)
+        store.ensure_schema()
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            store.upsert(rows, embeddings)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            store.delete_sources({row[1] for row in rows})
+            store.close()
+        report[method] = {'rows_per_s': len(rows) / elapsed, 'seconds': elapsed, 'peak_mb': peak / 1e6}
+        print(f"{method:12s} {len(rows) / elapsed:12,.0f} rows/s  {elapsed:8.2f} s  {peak / 1e6:8.1f} MB peak")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare COPY and execute_values uploads into blog_style.")
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--chunks-per-doc', type=int, default=10)
+    parser.add_argument('--batch-rows', type=int, default=5000, help="Rows per committed batch")
+    parser.add_argument('--encode-only', action='store_true', help="Only time client-side encoding; no database")
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args()
+
+    rows, embeddings = synthetic_rows(args.rows, args.chunks_per_doc, EMBEDDING_DIMENSIONS, np.random.default_rng(0))
+    if args.encode_only:
+        report = encode_only(rows, embeddings)
+    else:
+        report = load(rows, embeddings, args.batch_rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': args.rows, 'batch_rows': args.batch_rows, 'methods': report}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Recall, latency and memory report for embedding dimensions and storage tiers in the local store.
+- Embeds synthetic passages and queries with the fake API's deterministic embeddings (no network).
+- Shortened embeddings are the full ones cut to their first N components and renormalised,
+  which is how text-embedding-3 models shorten them.
+- Ground truth is exact search over the full-size float32 vectors; every (dimensions, tier)
+  pair is searched through LocalVectorStore with exact re-ranking of top_k * --rerank-factor candidates.
+- Reports recall@k, p50/p95 latency, bytes scanned per vector, and the memory that scan would
+  take at 1M and 10M rows, so you can pick the smallest setting that meets your recall target.
+
+Run from the project root:
+
+    python benchmarks/bench_storage_tiers.py [--rows 20000] [--queries 50] [--top-k 5] [--dims 1536,768,512,256]
+                                             [--tiers float32,halfvec,int8,binary] [--rerank-factor 4] [--json out.json]
+"""
+import os
+import sys
+import json
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_openai import DEFAULT_DIMENSIONS, WORDS, FakeOpenAI
+from bench_ann_recall import percentile
+from local_vector_store import LocalVectorStore
+from quantization import STORAGE_TIERS, code_size
+from vector_store import RERANK_FACTOR
+
+EMBED_BLOCK_ROWS = 2000
+TOPICS = 50  # Passages share vocabulary with others on the same topic, so neighbours are meaningful
+PROJECTED_ROWS = (1_000_000, 10_000_000)
+
+def synthetic_texts(count, rng, topics):
+    texts = []
+    for _ in range(count):
+        topic = topics[rng.integers(len(topics))]
+        words = rng.choice(topic, 40).tolist() + rng.choice(WORDS, 20).tolist()
+        texts.append(' '.join(words))
+    return texts
+
+def embed(fake, texts):
+    return np.concatenate([fake.embed(texts[start:start + EMBED_BLOCK_ROWS])
+                           for start in range(0, len(texts), EMBED_BLOCK_ROWS)])
+
+def shorten(vectors, dimensions):
+    vectors = np.ascontiguousarray(vectors[:, :dimensions])
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+
+def exact_top_k(vectors, queries, top_k):
+    scores = queries @ vectors.T
+    return [set(row) for row in np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k].tolist()]
+
+def run_tier(path, storage, vectors, queries, top_k, rerank_factor, expected):
+    store = LocalVectorStore(path, storage, rerank_factor, vectors.shape[1])
+    store.ensure_schema()
+    rows = [(str(i), f"doc{i}.txt", 'synthetic', 0, 0, 0) for i in range(len(vectors))]
+    store.upsert(rows, vectors)
+    store.search(queries[:1], top_k)  # Map the files before timing
+    recalls, times = [], []
+    for query, truth in zip(queries, expected):
+        start = time.perf_counter()
+        matches = store.search([query], top_k)[0]
+        times.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(truth & {int(m['txt']) for m in matches}) / top_k)
+    store.close()
+    shutil.rmtree(path)
+    scanned = code_size(storage, vectors.shape[1])
+    return {
+        'dimensions': vectors.shape[1],
+        'storage': storage,
+        'recall': statistics.mean(recalls),
+        'p50_ms': statistics.median(times),
+        'p95_ms': percentile(times, 95),
+        'scanned_bytes_per_vector': scanned,
+        # Full vectors stay on disk for re-ranking; only the candidates' are read
+        'disk_bytes_per_vector': scanned + (4 * vectors.shape[1] if storage != 'float32' else 0),
+        'scanned_gb': {str(rows): rows * scanned / 1e9 for rows in PROJECTED_ROWS},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall, latency and memory per embedding size and storage tier.")
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--dims', default='1536,768,512,256', help="Comma-separated embedding sizes")
+    parser.add_argument('--tiers', default=','.join(STORAGE_TIERS), help="Comma-separated storage tiers")
+    parser.add_argument('--rerank-factor', type=int, default=RERANK_FACTOR)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    topics = [rng.choice(WORDS, 12) for _ in range(TOPICS)]
+    fake = FakeOpenAI(seed=args.seed)
+    start = time.perf_counter()
+    vectors = embed(fake, synthetic_texts(args.rows, rng, topics))
+    queries = embed(fake, synthetic_texts(args.queries, rng, topics))
+    print(f"Embedded {args.rows} passages and {args.queries} queries in {time.perf_counter() - start:.1f} s")
+    expected = exact_top_k(vectors, queries, args.top_k)
+
+    report = {'rows': args.rows, 'queries': args.queries, 'top_k': args.top_k,
+              'rerank_factor': args.rerank_factor, 'results': []}
+    print(f"{'dims':>5s} {'storage':8s} {'recall':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'B/vec':>6s} "
+          + ' '.join(f"{f'GB@{rows // 1_000_000}M':>8s}" for rows in PROJECTED_ROWS))
+    tmpdir = tempfile.mkdtemp(prefix='bench_storage_tiers_')
+    try:
+        for dimensions in [int(d) for d in args.dims.split(',')]:
+            if dimensions > DEFAULT_DIMENSIONS:
+                raise SystemExit(f"--dims {dimensions} is larger than the embeddings ({DEFAULT_DIMENSIONS})")
+            short_vectors, short_queries = shorten(vectors, dimensions), shorten(queries, dimensions)
+            for storage in args.tiers.split(','):
+                result = run_tier(os.path.join(tmpdir, f"{dimensions}-{storage}"), storage, short_vectors,
+                                  short_queries, args.top_k, args.rerank_factor, expected)
+                report['results'].append(result)
+                print(f"{dimensions:5d} {storage:8s} {result['recall']:7.3f} {result['p50_ms']:8.2f} "
+                      f"{result['p95_ms']:8.2f} {result['scanned_bytes_per_vector']:6d} "
+                      + ' '.join(f"{result['scanned_gb'][str(rows)]:8.2f}" for rows in PROJECTED_ROWS))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark the local NumPy vector store against the pgvector path.
+- Synthetic mode (default): fills a temporary local store with random unit vectors and
+  times appends, single-query search, and batched search.
+- With --compare-pg: copies up to --rows rows out of blog_style into a temporary local
+  store, then runs the same queries through both backends and reports latency and
+  how often the two agree on the top k.
+
+Run from the project root:
+
+    python benchmarks/bench_vector_store.py [--rows 100000] [--dim 1536] [--queries 50] [--top-k 5] [--compare-pg]
+"""
+import os
+import sys
+import json
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from local_vector_store import LocalVectorStore
+from vector_store import PgVectorStore
+from schema import TABLE_NAME
+
+APPEND_BATCH_ROWS = 10000
+
+def time_queries(store, queries, top_k):
+    """
+    Return per-query latencies in ms and the (source_file, chunk_index) keys found for each query.
+    """
+    times = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        matches = store.search([query], top_k)[0]
+        times.append((time.perf_counter() - start) * 1000)
+        found.append({(m['source_file'], m['chunk_index']) for m in matches})
+    return times, found
+
+def summarize(label, times):
+    print(f"{label:32s} p50 {statistics.median(times):8.2f} ms  max {max(times):8.2f} ms")
+
+def fill_synthetic(store, rows, dim, rng):
+    start = time.perf_counter()
+    for offset in range(0, rows, APPEND_BATCH_ROWS):
+        count = min(APPEND_BATCH_ROWS, rows - offset)
+        vectors = rng.standard_normal((count, dim), dtype=np.float32)
+        batch = [(f"passage {i}", f"doc{i // 10}.txt", 'synthetic', i % 10, 0, 0)
+                 for i in range(offset, offset + count)]
+        store.upsert(batch, vectors)
+    elapsed = time.perf_counter() - start
+    print(f"Appended {rows} rows in {elapsed:.2f} s ({rows / elapsed:,.0f} rows/s)")
+
+def fill_from_pg(store, pg, rows):
+    with pg.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT txt, source_file, source_hash, chunk_index, char_start, char_end, emb::text "
+                f"FROM {TABLE_NAME} LIMIT %s",
+                (rows,)
+            )
+            fetched = cur.fetchall()
+    embeddings = [json.loads(row[6]) for row in fetched]
+    store.upsert([row[:6] for row in fetched], embeddings)
+    print(f"Copied {len(fetched)} rows from {TABLE_NAME}")
+    return np.asarray(embeddings, dtype=np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local vector store against pgvector.")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--compare-pg', action='store_true', help="Use blog_style's rows and compare with pgvector")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tmpdir = tempfile.mkdtemp(prefix='bench_vector_store_')
+    try:
+        local = LocalVectorStore(os.path.join(tmpdir, 'store'))
+        pg = None
+        if args.compare_pg:
+            pg = PgVectorStore()
+            vectors = fill_from_pg(local, pg, args.rows)
+            queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+            queries = queries + rng.normal(0, 0.01, queries.shape).astype(np.float32)
+        else:
+            fill_synthetic(local, args.rows, args.dim, rng)
+            queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+        local_times, local_found = time_queries(local, queries, args.top_k)
+        summarize("local, one query at a time", local_times)
+        start = time.perf_counter()
+        local.search(queries, args.top_k)
+        batched_ms = (time.perf_counter() - start) * 1000
+        print(f"{'local, batched':32s} {batched_ms / len(queries):8.2f} ms per query "
+              f"({len(queries)} queries in one call)")
+
+        if pg is not None:
+            pg_times, pg_found = time_queries(pg, [q.tolist() for q in queries], args.top_k)
+            summarize("pgvector, one query at a time", pg_times)
+            agreement = statistics.mean(len(a & b) / args.top_k for a, b in zip(local_found, pg_found))
+            print(f"Top-{args.top_k} agreement (local exact vs pgvector): {agreement:.3f}")
+            pg.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
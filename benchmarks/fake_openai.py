@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI API, for benchmarks and offline runs.
+- POST /v1/embeddings returns deterministic embeddings: a fixed random projection of each text's
+  hashed bag of words, so texts that share words land near each other and retrieval behaves sensibly.
+- POST /v1/chat/completions returns deterministic text built from a hash of the messages,
+  as one JSON response or as a server-sent event stream (stream=true; with stream_options.include_usage,
+  a final chunk carries token usage).
+- POST /v1/files, GET /v1/files/<id>/content, POST /v1/batches, GET /v1/batches/<id> and
+  POST /v1/batches/<id>/cancel run Batch API jobs over the same two endpoints; a job completes
+  --batch-latency seconds after it is created, and --batch-failure fails that fraction of its requests.
+- --latency / --token-latency add a delay per request and per generated token; --rate-429 rejects a
+  fraction of requests with 429 and Retry-After; --rpm / --tpm enforce per-minute limits. Every response
+  carries x-ratelimit-* headers like the real API.
+
+Point the scripts at it with OPENAI_BASE_URL:
+
+    python benchmarks/fake_openai.py [--port 8089] [--latency 20] [--token-latency 0] [--rate-429 0.0]
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python compose.py
+
+Or start it in-process with start_server(), as run_benchmarks.py does.
+
+Requires: numpy
+"""
+import re
+import sys
+import json
+import time
+import base64
+import itertools
+import random
+import hashlib
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+DEFAULT_PORT = 8089
+DEFAULT_DIMENSIONS = 1536
+HASH_BUCKETS = 1024  # Hashed vocabulary size for the bag-of-words embeddings
+WORDS = ('the a of and to in is it you that was for on are with as his they be at one have this from '
+         'or had by word but what some we can out other were all there when up use your how said an each '
+         'she which do their time if will way about many then them write would like so these her long make '
+         'thing see him two has look more day could go come did number sound no most people my over know '
+         'water than call first who may down side been now find garden river light morning letter story').split()
+_WORD_RE = re.compile(r"\w+")
+
+_buckets = {}
+
+def _seed(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def _bucket(word):
+    bucket = _buckets.get(word)
+    if bucket is None:
+        bucket = _buckets[word] = _seed(word) % HASH_BUCKETS
+    return bucket
+
+class FakeOpenAI:
+    """
+    Response generation and limits, shared by every request handler thread.
+    """
+
+    def __init__(self, latency=0.0, token_latency=0.0, rate_429=0.0, rpm=0, tpm=0, completion_tokens=200, seed=0,
+                 batch_latency=0.0, batch_failure=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.rate_429 = rate_429
+        self.rpm = rpm
+        self.tpm = tpm
+        self.completion_tokens = completion_tokens
+        self.batch_latency = batch_latency
+        self.batch_failure = batch_failure
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.projections = {}
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.window_tokens = 0
+        self.counts = {'requests': 0, 'rejected': 0, 'embedded_inputs': 0, 'completion_tokens': 0,
+                       'batches': 0, 'batch_requests': 0}
+        self.files = {}  # id -> (file object, bytes)
+        self.batches = {}  # id -> batch object
+        self.ids = itertools.count(1)
+
+    def projection(self, dimensions):
+        with self.lock:
+            if dimensions not in self.projections:
+                rng = np.random.default_rng(dimensions)
+                self.projections[dimensions] = rng.standard_normal((HASH_BUCKETS, dimensions)).astype(np.float32)
+            return self.projections[dimensions]
+
+    def embed(self, texts, dimensions=DEFAULT_DIMENSIONS):
+        """
+        Unit-length embeddings: counts of hashed words, times a fixed random projection.
+        """
+        counts = np.zeros((len(texts), HASH_BUCKETS), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in _WORD_RE.findall(text.lower()):
+                counts[i, _bucket(word)] += 1
+            counts[i, _seed(text) % HASH_BUCKETS] += 0.5  # Keeps empty and identical-word texts distinct
+        vectors = counts @ self.projection(dimensions)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+        return vectors
+
+    def complete(self, messages, max_tokens=None):
+        """
+        Deterministic words for the given messages, at most max_tokens of them.
+        """
+        rng = random.Random(_seed(json.dumps(messages, sort_keys=True)))
+        count = min(max_tokens or self.completion_tokens, self.completion_tokens)
+        return [rng.choice(WORDS) for _ in range(count)]
+
+    def admit(self, tokens):
+        """
+        Count a request against the limits. Returns (allowed, headers).
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start, self.window_requests, self.window_tokens = now, 0, 0
+            self.counts['requests'] += 1
+            reset = 60 - (now - self.window_start)
+            over = (self.rpm and self.window_requests + 1 > self.rpm) or \
+                (self.tpm and self.window_tokens + tokens > self.tpm) or \
+                self.random.random() < self.rate_429
+            if over:
+                self.counts['rejected'] += 1
+            else:
+                self.window_requests += 1
+                self.window_tokens += tokens
+            headers = {
+                'x-ratelimit-limit-requests': str(self.rpm or 1_000_000),
+                'x-ratelimit-remaining-requests': str(max(0, (self.rpm or 1_000_000) - self.window_requests)),
+                'x-ratelimit-reset-requests': f"{reset:.3f}s",
+                'x-ratelimit-limit-tokens': str(self.tpm or 100_000_000),
+                'x-ratelimit-remaining-tokens': str(max(0, (self.tpm or 100_000_000) - self.window_tokens)),
+                'x-ratelimit-reset-tokens': f"{reset:.3f}s",
+            }
+            if over:
+                headers['retry-after'] = '1' if (self.rpm or self.tpm) and reset > 1 else '0'
+            return not over, headers
+
+    def embeddings_response(self, body):
+        """
+        Return (payload, tokens) for an embeddings request body.
+        """
+        texts = body.get('input', [])
+        if isinstance(texts, str):
+            texts = [texts]
+        tokens = sum(estimate_tokens(text) for text in texts)
+        vectors = self.embed(texts, int(body.get('dimensions') or DEFAULT_DIMENSIONS))
+        with self.lock:
+            self.counts['embedded_inputs'] += len(texts)
+        if body.get('encoding_format') == 'base64':
+            encoded = [base64.b64encode(vector.astype('<f4').tobytes()).decode('ascii') for vector in vectors]
+        else:
+            encoded = vectors.tolist()
+        return {
+            'object': 'list',
+            'data': [{'object': 'embedding', 'index': i, 'embedding': e} for i, e in enumerate(encoded)],
+            'model': body.get('model'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        }, tokens
+
+    def chat_response(self, body, words, prompt_tokens):
+        with self.lock:
+            self.counts['completion_tokens'] += len(words)
+        return {
+            'id': completion_id(body.get('messages', [])), 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': ' '.join(words).capitalize()}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(words),
+                      'total_tokens': prompt_tokens + len(words)},
+        }
+
+    def add_file(self, content, purpose, filename='upload.jsonl'):
+        file_id = f"file-fake{next(self.ids)}"
+        info = {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed'}
+        with self.lock:
+            self.files[file_id] = (info, content)
+        return info
+
+    def create_batch(self, body):
+        """
+        Queue a batch job over an uploaded JSONL file. Returns the batch object, or None if the file is unknown.
+        """
+        entry = self.files.get(body.get('input_file_id'))
+        if entry is None:
+            return None
+        batch = {
+            'id': f"batch_fake{next(self.ids)}", 'object': 'batch', 'endpoint': body.get('endpoint'),
+            'input_file_id': body['input_file_id'], 'completion_window': body.get('completion_window', '24h'),
+            'status': 'in_progress', 'created_at': int(time.time()), 'output_file_id': None, 'error_file_id': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0}, 'metadata': body.get('metadata'),
+        }
+        with self.lock:
+            self.batches[batch['id']] = batch
+            self.counts['batches'] += 1
+        threading.Thread(target=self.run_batch, args=(batch, entry[1]), daemon=True).start()
+        return batch
+
+    def run_batch(self, batch, content):
+        lines = [json.loads(line) for line in content.decode('utf-8').splitlines() if line.strip()]
+        batch['request_counts']['total'] = len(lines)
+        time.sleep(self.batch_latency)
+        outputs, errors = [], []
+        for line in lines:
+            if batch['status'] == 'cancelling':
+                break
+            request_id = f"req_fake{next(self.ids)}"
+            if self.random.random() < self.batch_failure:
+                errors.append({'id': f"batch_req_{request_id}", 'custom_id': line.get('custom_id'), 'response': None,
+                               'error': {'code': 'server_error', 'message': 'Injected failure (fake)'}})
+                batch['request_counts']['failed'] += 1
+                continue
+            body = line.get('body', {})
+            if line.get('url', '').endswith('/embeddings'):
+                payload, _ = self.embeddings_response(body)
+            else:
+                messages = body.get('messages', [])
+                prompt_tokens = sum(estimate_tokens(str(m.get('content', ''))) for m in messages)
+                words = self.complete(messages, body.get('max_tokens') or body.get('max_completion_tokens'))
+                payload = self.chat_response(body, words, prompt_tokens)
+            outputs.append({'id': f"batch_req_{request_id}", 'custom_id': line.get('custom_id'),
+                            'response': {'status_code': 200, 'request_id': request_id, 'body': payload},
+                            'error': None})
+            batch['request_counts']['completed'] += 1
+        with self.lock:
+            self.counts['batch_requests'] += len(lines)
+        if outputs:
+            batch['output_file_id'] = self.add_file(
+                ''.join(json.dumps(o) + '\n' for o in outputs).encode('utf-8'), 'batch_output')['id']
+        if errors:
+            batch['error_file_id'] = self.add_file(
+                ''.join(json.dumps(e) + '\n' for e in errors).encode('utf-8'), 'batch_output')['id']
+        batch['status'] = 'cancelled' if batch['status'] == 'cancelling' else 'completed'
+        batch['completed_at'] = int(time.time())
+
+def completion_id(messages):
+    return f"chatcmpl-fake{_seed(json.dumps(messages)) % 10**12}"
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    api = None  # Set by start_server
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_bytes(self, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def not_found(self):
+        self.send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        parts = path.split('/')
+        if path.endswith('/stats'):
+            self.send_json(200, self.api.counts)
+        elif len(parts) >= 3 and parts[-3] == 'files' and parts[-1] == 'content' and parts[-2] in self.api.files:
+            self.send_bytes(self.api.files[parts[-2]][1])
+        elif len(parts) >= 2 and parts[-2] == 'files' and parts[-1] in self.api.files:
+            self.send_json(200, self.api.files[parts[-1]][0])
+        elif len(parts) >= 2 and parts[-2] == 'batches' and parts[-1] in self.api.batches:
+            self.send_json(200, self.api.batches[parts[-1]])
+        else:
+            self.not_found()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith('/files'):
+            self.handle_upload(data)
+            return
+        try:
+            body = json.loads(data or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+            return
+        parts = path.split('/')
+        if path.endswith('/embeddings'):
+            self.handle_embeddings(body)
+        elif path.endswith('/chat/completions'):
+            self.handle_chat(body)
+        elif path.endswith('/batches'):
+            batch = self.api.create_batch(body)
+            if batch is None:
+                self.send_json(400, {'error': {'message': 'Unknown input_file_id', 'type': 'invalid_request_error'}})
+            else:
+                self.send_json(200, batch)
+        elif len(parts) >= 3 and parts[-3] == 'batches' and parts[-1] == 'cancel' and parts[-2] in self.api.batches:
+            batch = self.api.batches[parts[-2]]
+            if batch['status'] == 'in_progress':
+                batch['status'] = 'cancelling'
+            self.send_json(200, batch)
+        else:
+            self.not_found()
+
+    def handle_upload(self, data):
+        # multipart/form-data with 'purpose' and 'file' fields
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + self.headers.get('Content-Type', '').encode('latin-1') + b'\r\n\r\n' + data)
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            fields[name] = (part.get_filename(), part.get_payload(decode=True))
+        if 'file' not in fields:
+            self.send_json(400, {'error': {'message': 'Missing file', 'type': 'invalid_request_error'}})
+            return
+        purpose = fields.get('purpose', (None, b'batch'))[1].decode('utf-8')
+        self.send_json(200, self.api.add_file(fields['file'][1], purpose, fields['file'][0] or 'upload.jsonl'))
+
+    def reject(self, headers):
+        self.send_json(429, {'error': {'message': 'Rate limit reached (fake)', 'type': 'requests',
+                                       'code': 'rate_limit_exceeded'}}, headers)
+
+    def handle_embeddings(self, body):
+        texts = body.get('input', [])
+        if isinstance(texts, str):
+            texts = [texts]
+        allowed, headers = self.api.admit(sum(estimate_tokens(text) for text in texts))
+        if not allowed:
+            self.reject(headers)
+            return
+        time.sleep(self.api.latency)
+        self.send_json(200, self.api.embeddings_response(body)[0], headers)
+
+    def handle_chat(self, body):
+        messages = body.get('messages', [])
+        prompt_tokens = sum(estimate_tokens(str(m.get('content', ''))) for m in messages)
+        words = self.api.complete(messages, body.get('max_tokens') or body.get('max_completion_tokens'))
+        allowed, headers = self.api.admit(prompt_tokens + len(words))
+        if not allowed:
+            self.reject(headers)
+            return
+        time.sleep(self.api.latency)
+        if not body.get('stream'):
+            time.sleep(self.api.token_latency * len(words))
+            self.send_json(200, self.api.chat_response(body, words, prompt_tokens), headers)
+            return
+        with self.api.lock:
+            self.api.counts['completion_tokens'] += len(words)
+        chat_id = completion_id(messages)
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(words),
+                 'total_tokens': prompt_tokens + len(words)}
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def event(choices, **extra):
+            payload = {'id': chat_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                       'model': body.get('model'), 'choices': choices, **extra}
+            data = f"data: {json.dumps(payload)}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+        def choice(delta, finish_reason=None):
+            return [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+
+        try:
+            event(choice({'role': 'assistant', 'content': ''}))
+            for i, word in enumerate(words):
+                time.sleep(self.api.token_latency)
+                event(choice({'content': (' ' if i else '') + word}))
+            event(choice({}, 'stop'))
+            if (body.get('stream_options') or {}).get('include_usage'):
+                event([], usage=usage)
+            done = b"data: [DONE]\n\n"
+            self.wfile.write(f"{len(done):x}\r\n".encode('ascii') + done + b"\r\n0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(host='127.0.0.1', port=0, **options):
+    """
+    Serve the fake API on a background thread. Returns (server, base_url); call server.shutdown() to stop.
+    port=0 picks a free port.
+    """
+    handler = type('Handler', (FakeOpenAIHandler,), {'api': FakeOpenAI(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a deterministic stand-in for the OpenAI API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=20, help="Milliseconds added to every request")
+    parser.add_argument('--token-latency', type=float, default=0, help="Milliseconds per generated token")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of requests rejected with 429")
+    parser.add_argument('--rpm', type=int, default=0, help="Requests per minute before 429s (0 = unlimited)")
+    parser.add_argument('--tpm', type=int, default=0, help="Tokens per minute before 429s (0 = unlimited)")
+    parser.add_argument('--completion-tokens', type=int, default=200, help="Words per chat completion")
+    parser.add_argument('--batch-latency', type=float, default=5, help="Seconds before a batch job completes")
+    parser.add_argument('--batch-failure', type=float, default=0.0, help="Fraction of batch requests that fail")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.host, args.port, latency=args.latency / 1000,
+                                    token_latency=args.token_latency / 1000, rate_429=args.rate_429,
+                                    rpm=args.rpm, tpm=args.tpm, completion_tokens=args.completion_tokens,
+                                    batch_latency=args.batch_latency, batch_failure=args.batch_failure)
+    print(f"Fake OpenAI API at {base_url} (set OPENAI_BASE_URL to this)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
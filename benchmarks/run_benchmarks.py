@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end benchmarks: no OpenAI key or Postgres needed.
+- Starts the fake OpenAI API (fake_openai.py) and points the scripts at it with OPENAI_BASE_URL.
+- For each corpus size, generates a synthetic corpus in a scratch directory and, in a fresh
+  interpreter, times the stages:
+    preprocess  text_to_json.process_txt_files()        (titles)
+    ingest      create_embeddings_and_upload.process_and_upload()
+    retrieval   compose.get_top_style_snippets()         (first pass, then repeated prompts)
+    compose     compose.compose_piece()                  (retrieval + streamed generation)
+    compose_batch  compose_batch.compose_all()           (every prompt at once, generated concurrently)
+- Uses the local vector store by default (VECTOR_BACKEND=local); pass --backend pgvector to
+  measure Postgres instead, with the usual PG* settings.
+- Writes every measurement to a JSON file, so runs can be compared across commits with --baseline.
+
+Run from the project root:
+
+    python benchmarks/run_benchmarks.py [--chunks 100,1000,10000] [--stages preprocess,ingest,retrieval,compose,compose_batch]
+                                        [--latency 20] [--token-latency 0] [--rate-429 0.0]
+                                        [--json benchmarks/results.json] [--baseline old.json]
+
+Sizes up to 1M chunks work, but skip preprocess above ~100k (one title request per document).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import platform
+import argparse
+import resource
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+STAGES = ('preprocess', 'ingest', 'retrieval', 'compose', 'compose_batch')
+CHUNKS_PER_DOC = 8
+TOPICS = ('garden', 'river', 'letter', 'morning', 'kitchen', 'travel', 'music', 'winter', 'city', 'family',
+          'work', 'books', 'sleep', 'friends', 'ocean', 'money', 'school', 'memory', 'light', 'food')
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def latency_summary(times_ms):
+    return {'count': len(times_ms), 'p50_ms': statistics.median(times_ms), 'p95_ms': percentile(times_ms, 95),
+            'mean_ms': statistics.mean(times_ms)}
+
+def synthetic_document(rng, chars, words):
+    """
+    Paragraphs of random sentences that lean towards one topic, so retrieval has something to find.
+    """
+    topic = rng.choice(TOPICS)
+    vocabulary = words + [topic] * 20
+    paragraphs = []
+    length = 0
+    while length < chars:
+        sentences = [' '.join(rng.choices(vocabulary, k=rng.randint(8, 20))).capitalize() + '.'
+                     for _ in range(rng.randint(3, 7))]
+        paragraph = ' '.join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)
+
+def make_corpus(chunks, seed=0):
+    """
+    Write corpus/*.txt holding roughly `chunks` passages. Returns (documents, corpus bytes).
+    """
+    from fake_openai import WORDS
+    from chunker import CHUNK_OVERLAP, CHUNK_SIZE
+    rng = random.Random(seed)
+    os.makedirs('corpus', exist_ok=True)
+    documents = max(1, round(chunks / CHUNKS_PER_DOC))
+    chars = min(chunks, CHUNKS_PER_DOC) * (CHUNK_SIZE - CHUNK_OVERLAP)
+    total = 0
+    for i in range(documents):
+        text = synthetic_document(rng, chars, list(WORDS))
+        with open(os.path.join('corpus', f'post{i:07d}.txt'), 'w', encoding='utf-8') as f:
+            f.write(text)
+        total += len(text)
+    return documents, total
+
+def load_corpus_store_directly():
+    """
+    Fill the corpus store without titles, for runs that skip the preprocess stage.
+    """
+    from corpus_store import doc_id_for, get_corpus_store
+    store = get_corpus_store()
+    batch = []
+    for filename in sorted(os.listdir('corpus')):
+        with open(os.path.join('corpus', filename), 'rb') as f:
+            data = f.read()
+        batch.append({'id': doc_id_for(filename), 'filename': filename, 'title': None,
+                      'text': data.decode('utf-8'), 'source_hash': hashlib.sha256(data).hexdigest()})
+        if len(batch) >= 500:
+            store.put_many(batch)
+            batch = []
+    store.put_many(batch)
+
+def fake_stats(base_url):
+    from urllib.request import urlopen
+    with urlopen(base_url + '/stats') as response:
+        return json.load(response)
+
+def worker(args):
+    """
+    Run the selected stages for one corpus size in the current (scratch) directory.
+    """
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'utils'))
+    sys.path.insert(0, BENCH_DIR)
+    stages = set(args.stages.split(','))
+    base_url = os.environ['OPENAI_BASE_URL']
+    result = {'chunks_requested': args.worker_chunks, 'stages': {}}
+
+    start = time.perf_counter()
+    result['documents'], result['corpus_bytes'] = make_corpus(args.worker_chunks, args.seed)
+    result['corpus_generation_s'] = time.perf_counter() - start
+
+    if 'preprocess' in stages:
+        import text_to_json
+        before = fake_stats(base_url)
+        start = time.perf_counter()
+        text_to_json.process_txt_files()
+        elapsed = time.perf_counter() - start
+        after = fake_stats(base_url)
+        result['stages']['preprocess'] = {
+            'seconds': elapsed, 'docs_per_s': result['documents'] / elapsed,
+            'requests': after['requests'] - before['requests'], 'rejected': after['rejected'] - before['rejected'],
+        }
+    else:
+        load_corpus_store_directly()
+
+    if stages & {'ingest', 'retrieval', 'compose', 'compose_batch'}:
+        import create_embeddings_and_upload
+        from vector_store import get_store
+        before = fake_stats(base_url)
+        start = time.perf_counter()
+        create_embeddings_and_upload.process_and_upload()
+        elapsed = time.perf_counter() - start
+        after = fake_stats(base_url)
+        chunks = after['embedded_inputs'] - before['embedded_inputs']
+        result['chunks'] = chunks
+        if 'ingest' in stages:
+            result['stages']['ingest'] = {
+                'seconds': elapsed, 'chunks_per_s': chunks / elapsed,
+                'requests': after['requests'] - before['requests'], 'rejected': after['rejected'] - before['rejected'],
+            }
+        get_store().warm_up()
+
+    rng = random.Random(args.seed + 1)
+    from fake_openai import WORDS
+    prompts = [f"A short piece about {rng.choice(TOPICS)}: " + ' '.join(rng.choices(WORDS, k=12))
+               for _ in range(args.queries)]
+
+    if 'retrieval' in stages:
+        import compose
+        passes = {}
+        for label in ('first', 'repeat'):
+            times = []
+            for prompt in prompts:
+                start = time.perf_counter()
+                compose.get_top_style_snippets(prompt)
+                times.append((time.perf_counter() - start) * 1000)
+            passes[label] = latency_summary(times)
+        if compose.get_retrieval_cache():
+            compose.get_retrieval_cache().clear()
+        start = time.perf_counter()
+        compose.get_top_style_snippets_batch(prompts)
+        passes['batched_ms_per_prompt'] = (time.perf_counter() - start) * 1000 / len(prompts)
+        result['stages']['retrieval'] = passes
+
+    if 'compose' in stages:
+        import compose
+        runs = []
+        for prompt in prompts[:args.compose_runs]:
+            start = time.perf_counter()
+            timings = compose.compose_piece(prompt + ' (draft)')['timings']
+            timings['total'] = time.perf_counter() - start
+            runs.append(timings)
+        result['stages']['compose'] = {
+            stage: statistics.mean(run[stage] for run in runs if stage in run)
+            for stage in ('retrieval', 'first_token', 'generation', 'total')
+        }
+        result['stages']['compose']['runs'] = len(runs)
+
+    if 'compose_batch' in stages:
+        import compose_batch
+        report = compose_batch.compose_all([(f"{i:04d}", prompt + ' (batch draft)') for i, prompt in enumerate(prompts)],
+                                           'composed', overwrite=True)
+        result['stages']['compose_batch'] = {
+            'pieces': len(report['items']), 'failed': report['failed'], 'seconds': report['seconds'],
+            'retrieval': report['retrieval_seconds'], 'slowest_generation': report['slowest_generation_seconds'],
+            'total_generation': report['total_generation_seconds'],
+        }
+
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with open(args.worker_output, 'w') as f:
+        json.dump(result, f)
+
+def run_size(chunks, args, base_url):
+    """
+    Run one corpus size in a scratch directory and a fresh interpreter, so module state and caches start cold.
+    """
+    workdir = tempfile.mkdtemp(prefix=f'bench_{chunks}_')
+    output = os.path.join(workdir, 'result.json')
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY='fake', VECTOR_BACKEND=args.backend)
+    try:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker-chunks', str(chunks), '--worker-output', output,
+             '--stages', args.stages, '--queries', str(args.queries), '--compose-runs', str(args.compose_runs),
+             '--seed', str(args.seed)],
+            cwd=workdir, env=env, check=True,
+            stdout=None if args.verbose else subprocess.DEVNULL
+        )
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(f"{prefix}.{key}" if prefix else key, item, out)
+    elif isinstance(value, (int, float)):
+        out[prefix] = value
+    return out
+
+def compare(report, baseline_path):
+    """
+    Print each metric next to the baseline run's value for the same corpus size.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    base_runs = {run['chunks_requested']: run for run in baseline['runs']}
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit', 'unknown commit')}):")
+    for run in report['runs']:
+        old = base_runs.get(run['chunks_requested'])
+        if not old:
+            continue
+        new_metrics = flatten('', run['stages'], {})
+        old_metrics = flatten('', old['stages'], {})
+        for name, value in new_metrics.items():
+            if name in old_metrics and old_metrics[name]:
+                print(f"  {run['chunks_requested']:>8} chunks  {name:40s} {old_metrics[name]:12.3f} -> "
+                      f"{value:12.3f}  ({value / old_metrics[name]:5.2f}x)")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmarks against a fake OpenAI API.")
+    parser.add_argument('--chunks', default='100,1000,10000', help="Comma-separated corpus sizes, in passages")
+    parser.add_argument('--stages', default=','.join(STAGES), help="Comma-separated subset of " + ','.join(STAGES))
+    parser.add_argument('--backend', default='local', choices=('local', 'pgvector'))
+    parser.add_argument('--queries', type=int, default=20, help="Prompts for the retrieval stage")
+    parser.add_argument('--compose-runs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=20, help="Fake API milliseconds per request")
+    parser.add_argument('--token-latency', type=float, default=0, help="Fake API milliseconds per generated token")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of fake API requests rejected with 429")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default='benchmark_results.json', help="Where to write the report")
+    parser.add_argument('--baseline', help="Earlier report to compare against")
+    parser.add_argument('--verbose', action='store_true', help="Show the scripts' own output")
+    parser.add_argument('--worker-chunks', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    unknown = set(args.stages.split(',')) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+    if args.worker_chunks is not None:
+        worker(args)
+        return
+
+    sys.path.insert(0, BENCH_DIR)
+    from fake_openai import start_server
+    server, base_url = start_server(latency=args.latency / 1000, token_latency=args.token_latency / 1000,
+                                    rate_429=args.rate_429, seed=args.seed)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if not key.startswith('worker')},
+        'runs': [],
+    }
+    try:
+        for chunks in [int(value) for value in args.chunks.split(',')]:
+            print(f"Benchmarking {chunks} chunks...")
+            run = run_size(chunks, args, base_url)
+            report['runs'].append(run)
+            for stage, metrics in run['stages'].items():
+                print(f"  {stage:10s} " + '  '.join(
+                    f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in flatten('', metrics, {}).items()))
+    finally:
+        server.shutdown()
+    with open(args.json, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.json}")
+    if args.baseline:
+        compare(report, args.baseline)
+
+if __name__ == '__main__':
+    main()
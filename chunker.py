@@ -0,0 +1,90 @@
+"""
+chunker.py: Splits documents into overlapping passages for embedding.
+- Breaks on paragraph boundaries first, then sentence boundaries, then whitespace.
+- Packs consecutive pieces into chunks of at most CHUNK_SIZE characters.
+- Repeats up to CHUNK_OVERLAP characters of trailing pieces at the start of the next chunk.
+- Works lazily, so chunks can be consumed while the rest of the text is still being split.
+"""
+import os
+import re
+from collections import namedtuple
+
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '1500'))  # Max characters per chunk
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '200'))  # Characters repeated between chunks
+
+PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n\s*')
+SENTENCE_END = re.compile(r'[.!?]+["\'”’)\]]*\s+')
+
+# start/end are character offsets into the source text; text == source[start:end]
+Chunk = namedtuple('Chunk', ['index', 'start', 'end', 'text'])
+
+def _trim(text, start, end):
+    """
+    Shrink a span so it doesn't begin or end with whitespace. Returns None if nothing is left.
+    """
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if start < end else None
+
+def _split_span(text, start, end, pattern):
+    """
+    Yield the pieces of text[start:end] separated by pattern matches.
+    """
+    for match in pattern.finditer(text, start, end):
+        yield start, match.end()
+        start = match.end()
+    if start < end:
+        yield start, end
+
+def _hard_split(text, start, end, max_chars):
+    """
+    Split a span with no sentence breaks, preferring whitespace near the size limit.
+    """
+    while end - start > max_chars:
+        cut = text.rfind(' ', start + max_chars // 2, start + max_chars)
+        if cut == -1:
+            cut = start + max_chars
+        yield start, cut
+        start = cut
+    yield start, end
+
+def iter_segments(text, max_chars=CHUNK_SIZE):
+    """
+    Yield (start, end) spans of paragraphs, further split into sentences or
+    whitespace-separated pieces when a paragraph is longer than max_chars.
+    """
+    for p_start, p_end in _split_span(text, 0, len(text), PARAGRAPH_BREAK):
+        spans = [(p_start, p_end)]
+        if p_end - p_start > max_chars:
+            spans = _split_span(text, p_start, p_end, SENTENCE_END)
+        for s_start, s_end in spans:
+            pieces = [(s_start, s_end)]
+            if s_end - s_start > max_chars:
+                pieces = _hard_split(text, s_start, s_end, max_chars)
+            for piece_start, piece_end in pieces:
+                span = _trim(text, piece_start, piece_end)
+                if span:
+                    yield span
+
+def iter_chunks(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Yield Chunk tuples covering text, each at most size characters long
+    (a single piece is never longer than size, so this always holds).
+    """
+    window = []  # Segments in the chunk being built
+    index = 0
+    for segment in iter_segments(text, size):
+        if window and segment[1] - window[0][0] > size:
+            start, end = window[0][0], window[-1][1]
+            yield Chunk(index, start, end, text[start:end])
+            index += 1
+            # Carry trailing segments into the next chunk, as long as they still leave room
+            window = [s for s in window[1:] if s[0] >= end - overlap]
+            while window and segment[1] - window[0][0] > size:
+                window.pop(0)
+        window.append(segment)
+    if window:
+        start, end = window[0][0], window[-1][1]
+        yield Chunk(index, start, end, text[start:end])
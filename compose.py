@@ -2,30 +2,33 @@
 """
 compose.py: A writing tool that generates a piece in your style using GPT-4o.
 - Prompts you for a description of what you want to write.
-- Samples your writing from processed_corpus/*.json for style context.
+- Retrieves the most similar passages of your writing from the vector store (see vector_store.py)
+  for style context, falling back to random samples from the processed corpus store if it is unavailable.
 - Calls GPT-4o with your prompt and style context.
-- Prints the generated piece.
+- Prints the generated piece as it streams in; Ctrl-C stops generation.
 
-Requires: openai>=1.0.0, python-dotenv (optional for .env support)
+Importing this module is cheap: openai and the vector store backend are imported, and
+connected, on first use (or in the background while you type, when run as a script).
+
+Requires: openai>=1.0.0, psycopg2 or numpy (per VECTOR_BACKEND), python-dotenv (optional for .env support)
 """
 import os
 import sys
-import json
-import glob
 import random
 import logging
-from openai import OpenAI
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+import threading
+import time
+import tracing
+from embedder import EMBEDDING_MODEL, count_tokens, embed_texts
+from openai_client import create, get_client
+from embedding_cache import get_cache
+from context_packing import MMR_LAMBDA, SNIPPET_SEPARATOR, mmr_order, pack_snippets
+from retrieval_cache import cache_key, get_retrieval_cache
+from vector_store import get_store
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from corpus_store import get_corpus_store
+
 logger = logging.getLogger(__name__)
 
 # Load environment variables from .env if present
@@ -35,132 +38,281 @@ try:
 except ImportError:
     pass
 
-CORPUS_DIR = 'processed_corpus'
-STYLE_SNIPPET_CHAR_LIMIT = 100000  # Total chars of style context to pass in
+STYLE_SNIPPET_CHAR_LIMIT = 100000  # Total chars of random samples to draw when the vector store is unavailable
 SNIPPET_MIN_LEN = 200  # Minimum chars per snippet
+TOP_K = 5  # Most snippets to use for style context
+STYLE_CANDIDATES = int(os.getenv('STYLE_CANDIDATES', '40'))  # Passages fetched per prompt for MMR re-ranking
+STYLE_TOKEN_BUDGET = int(os.getenv('STYLE_TOKEN_BUDGET', '2000'))  # Max tokens of style context in the system prompt
+COMPOSE_MODEL = 'gpt-4o'
+
+def configure_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
 
-# DB connection settings (reuse from create_embeddings_and_upload.py)
-DB_NAME = os.getenv('PGDATABASE', 'henry-pg')
-DB_USER = os.getenv('PGUSER', 'postgres')
-DB_PASSWORD = os.getenv('PGPASSWORD', 'supersecret')
-DB_HOST = os.getenv('PGHOST', 'localhost')
-DB_PORT = os.getenv('PGPORT', '5432')
-EMBEDDING_MODEL = 'text-embedding-3-small'
-TABLE_NAME = 'blog_style'
-TOP_K = 5  # Number of most similar snippets to use for style context
-
-# Call GPT-4o
-client = OpenAI()
-
-# Collect style snippets from user's writing
-style_snippets = []
-for json_path in glob.glob(os.path.join(CORPUS_DIR, '*.json')):
+def warm_up():
+    """
+    Create the OpenAI client and connect to the vector store.
+    Run in a background thread so this overlaps with the user typing their prompt.
+    """
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            text = data.get('text', '')
-            if len(text) >= SNIPPET_MIN_LEN:
-                # Take a random chunk from the text
-                start = random.randint(0, max(0, len(text) - SNIPPET_MIN_LEN))
-                snippet = text[start:start+SNIPPET_MIN_LEN]
-                style_snippets.append(snippet)
+        get_client()
+        get_store().warm_up()
     except Exception as e:
-        continue
-
-# Shuffle and combine snippets up to STYLE_SNIPPET_CHAR_LIMIT
-random.shuffle(style_snippets)
-style_context = ''
-for snippet in style_snippets:
-    if len(style_context) + len(snippet) > STYLE_SNIPPET_CHAR_LIMIT:
-        break
-    style_context += snippet + '\n---\n'
-
-if not style_context:
-    print("Error: No style context found in processed_corpus. Please process your writing samples first.")
-    sys.exit(1)
-
-# Prompt user for what they want to write
-description = input("Describe what you want to write: ").strip()
-if not description:
-    print("No prompt provided. Exiting.")
-    sys.exit(1)
-
-logger.info(f"User prompt: {description}")
-
-def get_db_connection():
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
+        # Surfaced again, with context, when the real call happens
+        logger.debug(f"Warm-up failed: {e}")
 
 def get_embedding(text, model=EMBEDDING_MODEL):
     logger.info(f"Generating embedding for text (first 100 chars): {text[:100]}...")
-    response = client.embeddings.create(
-        input=[text],
-        model=model
-    )
+    with tracing.span('get_embedding', caller='compose'):
+        embedding = embed_texts([text], model)[0]
+    cache = get_cache()
+    if cache:
+        logger.info(f"Embedding cache stats: {cache.stats()}")
     logger.info(f"Embedding generated successfully using model: {model}")
-    return response.data[0].embedding
+    return embedding
+
+def get_top_style_snippets_batch(prompts, top_k=TOP_K, token_budget=STYLE_TOKEN_BUDGET):
+    """
+    Return up to top_k style snippets for each prompt, within token_budget tokens.
+    STYLE_CANDIDATES passages are fetched per prompt, re-ranked by maximal marginal relevance,
+    and packed greedily into the budget, so the context covers more of your style in fewer tokens.
+    Prompts found in the retrieval cache, for the store's current version, skip embedding and search;
+    the rest are embedded together and searched in a single round trip.
+    """
+    store = get_store()
+    cache = get_retrieval_cache()
+    with tracing.span('vector_store.version', backend=store.name):
+        version = store.version() if cache else None
+    keys = [cache_key(prompt, top_k, token_budget, MMR_LAMBDA, store.name) for prompt in prompts]
+    results = [cache.get(key, version) if cache else None for key in keys]
+    missing = [i for i, snippets in enumerate(results) if snippets is None]
+    if cache:
+        tracing.count('retrieval_cache', len(prompts) - len(missing), result='hit')
+        tracing.count('retrieval_cache', len(missing), result='miss')
+    if missing:
+        candidates = max(top_k, STYLE_CANDIDATES)
+        logger.info(f"Retrieving {candidates} candidate snippets for {len(missing)} prompt(s) from {store.name} vector store...")
+        with tracing.span('compose.embed'):
+            embeddings = embed_texts([prompts[i] for i in missing])
+        embedding_cache = get_cache()
+        if embedding_cache:
+            logger.info(f"Embedding cache stats: {embedding_cache.stats()}")
+        with tracing.span('vector_store.search', backend=store.name):
+            found = store.search(embeddings, candidates, with_vectors=True)
+        for i, rows in zip(missing, found):
+            with tracing.span('compose.pack'):
+                order = mmr_order([row['vector'] for row in rows], [1 - row['distance'] for row in rows])
+                results[i], used = pack_snippets([rows[j]['txt'] for j in order], token_budget, top_k, COMPOSE_MODEL)
+            tracing.count('style_context_tokens', used)
+            logger.info(f"Packed {len(results[i])} of {len(rows)} candidates into {used}/{token_budget} tokens")
+            if cache:
+                cache.put(keys[i], version, results[i])
+    if cache:
+        logger.info(f"Retrieval cache stats: {cache.stats()}")
+    return results
 
 def get_top_style_snippets(prompt, top_k=TOP_K):
-    logger.info(f"Retrieving top {top_k} style snippets from vector database...")
-    embedding = get_embedding(prompt)
-    conn = get_db_connection()
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            f"""
-            SELECT txt FROM {TABLE_NAME}
-            ORDER BY emb <-> %s::vector
-            LIMIT %s
-            """,
-            (embedding, top_k)
-        )
-        rows = cur.fetchall()
-    conn.close()
-    snippets = [row['txt'] for row in rows]
-    logger.info(f"Retrieved {len(snippets)} complete snippets from database")
+    snippets = get_top_style_snippets_batch([prompt], top_k)[0]
+    logger.info(f"Retrieved {len(snippets)} snippets from vector store")
     for i, snippet in enumerate(snippets, 1):
         logger.info(f"Snippet {i} (length: {len(snippet)} chars, first 150 chars): {snippet[:150]}...")
     return snippets
 
-# Get most relevant style snippets
-style_snippets = get_top_style_snippets(description)
-if not style_snippets:
-    print("Error: No style context found in vector DB. Please process and upload your writing samples first.")
-    sys.exit(1)
+def sample_style_snippets(char_limit=STYLE_SNIPPET_CHAR_LIMIT):
+    """
+    Take a random SNIPPET_MIN_LEN-char sample from each processed document, up to char_limit in total.
+    Only used when the vector store can't provide style context.
+    """
+    style_snippets = []
+    for doc in get_corpus_store().iter_documents(fields=('text',)):
+        text = doc['text'] or ''
+        if len(text) >= SNIPPET_MIN_LEN:
+            # Take a random chunk from the text
+            start = random.randint(0, max(0, len(text) - SNIPPET_MIN_LEN))
+            style_snippets.append(text[start:start+SNIPPET_MIN_LEN])
 
-style_context = '\n---\n'.join(style_snippets)
-logger.info(f"Final style context length: {len(style_context)} characters")
-logger.info(f"Style context preview (first 300 chars): {style_context[:300]}...")
+    # Shuffle and keep snippets up to char_limit
+    random.shuffle(style_snippets)
+    selected = []
+    total = 0
+    for snippet in style_snippets:
+        if total + len(snippet) > char_limit:
+            break
+        selected.append(snippet)
+        total += len(snippet)
+    return selected
 
-# Compose system prompt
-system_prompt = (
-    "You are a writing assistant that writes in the user's style. "
-    "Below are snippets of the user's writing. When given a prompt, write a new piece in their style. "
-    "Be authentic to their tone, structure, and voice.\n\n"
-    "USER'S WRITING SNIPPETS:\n" + style_context
-)
+def get_style_snippets(description):
+    """
+    Return style snippets for the prompt from the vector store, or sampled from
+    processed_corpus when the store is unreachable or empty.
+    """
+    try:
+        snippets = get_top_style_snippets(description)
+        if snippets:
+            return snippets
+        logger.warning("No style context found in vector store; sampling processed_corpus instead")
+    except Exception as e:
+        logger.warning(f"Vector store unavailable ({e}); sampling processed_corpus instead")
+    return packed_sample_snippets()
+
+def get_style_snippets_batch(descriptions):
+    """
+    get_style_snippets() for many prompts at once: one embedding request and one vector store search.
+    Prompts left without context share one sample from processed_corpus.
+    """
+    try:
+        results = get_top_style_snippets_batch(descriptions)
+    except Exception as e:
+        logger.warning(f"Vector store unavailable ({e}); sampling processed_corpus instead")
+        results = [[] for _ in descriptions]
+    missing = [i for i, snippets in enumerate(results) if not snippets]
+    if missing:
+        logger.warning(f"No style context found for {len(missing)} prompt(s); sampling processed_corpus instead")
+        sampled = packed_sample_snippets()
+        for i in missing:
+            results[i] = sampled
+    return results
 
-logger.info(f"System prompt length: {len(system_prompt)} characters")
-logger.info("Calling GPT-4o API...")
+def packed_sample_snippets():
+    snippets, used = pack_snippets(sample_style_snippets(), STYLE_TOKEN_BUDGET, model=COMPOSE_MODEL)
+    logger.info(f"Packed {len(snippets)} sampled snippets into {used}/{STYLE_TOKEN_BUDGET} tokens")
+    return snippets
 
-try:
-    response = client.chat.completions.create(
-        model="gpt-4o",
+def build_system_prompt(style_context):
+    return (
+        "You are a writing assistant that writes in the user's style. "
+        "Below are snippets of the user's writing. When given a prompt, write a new piece in their style. "
+        "Be authentic to their tone, structure, and voice.\n\n"
+        "USER'S WRITING SNIPPETS:\n" + style_context
+    )
+
+def style_system_prompt(style_snippets):
+    """
+    Build the system prompt from retrieved snippets, raising if there are none.
+    """
+    if not style_snippets:
+        raise RuntimeError("No style context found in the vector store or processed_corpus. "
+                           "Please process and upload your writing samples first.")
+    style_context = SNIPPET_SEPARATOR.join(style_snippets)
+    logger.info(f"Final style context length: {len(style_context)} characters")
+    logger.info(f"Style context preview (first 300 chars): {style_context[:300]}...")
+    return build_system_prompt(style_context)
+
+def stream_piece(description, system_prompt, timings=None):
+    """
+    Yield the piece chunk by chunk as it is generated, recording time to first token
+    ('first_token') and total generation time ('generation') in timings.
+    Closing the generator early, e.g. on Ctrl-C, closes the HTTP stream, which stops generation.
+    """
+    timings = {} if timings is None else timings
+    logger.info(f"System prompt length: {len(system_prompt)} characters")
+    logger.info(f"Calling {COMPOSE_MODEL} API (streaming)...")
+    start = time.perf_counter()
+    max_tokens = 1024
+    stream = create(
+        'chat', COMPOSE_MODEL,
+        count_tokens(system_prompt, COMPOSE_MODEL) + count_tokens(description, COMPOSE_MODEL) + max_tokens,
+        purpose='compose',
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": description}
         ],
-        max_tokens=1024,
-        temperature=0.7
+        max_tokens=max_tokens,
+        temperature=0.7,
+        stream=True,
+        # The last chunk then carries token usage, with no choices
+        stream_options={"include_usage": True}
     )
-    logger.info("GPT-4o API call successful")
-    print("\n---\nGenerated piece:\n")
-    print(response.choices[0].message.content.strip())
-except Exception as e:
-    logger.error(f"Error generating piece: {e}")
-    print(f"Error generating piece: {e}")
-    sys.exit(1) 
\ No newline at end of file
+    failed = True
+    try:
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                tracing.record_usage(COMPOSE_MODEL, chunk.usage)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if 'first_token' not in timings:
+                    timings['first_token'] = time.perf_counter() - start
+                    tracing.observe('openai.first_token', timings['first_token'], model=COMPOSE_MODEL)
+                yield delta
+        failed = False
+    finally:
+        stream.close()
+        timings['generation'] = time.perf_counter() - start
+        tracing.observe('openai.chat_stream', timings['generation'], model=COMPOSE_MODEL, purpose='compose')
+        if failed:
+            tracing.count('openai_stream_interrupted', model=COMPOSE_MODEL)
+
+def generate_piece(description, system_prompt, timings=None):
+    return ''.join(stream_piece(description, system_prompt, timings)).strip()
+
+def compose_stream(description, timings=None):
+    """
+    Retrieve style context for description, then yield the piece as it is generated.
+    Stage times in seconds ('retrieval', 'first_token', 'generation') are recorded in timings.
+    Retrieval errors are raised on the first next() call, before anything is yielded.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    style_snippets = get_style_snippets(description)
+    timings['retrieval'] = time.perf_counter() - start
+    tracing.observe('compose.retrieval', timings['retrieval'])
+    yield from stream_piece(description, style_system_prompt(style_snippets), timings)
+
+def compose_piece(description):
+    """
+    Retrieve style context for description and generate a piece.
+    Returns {'piece': str, 'timings': {stage: seconds}}. Safe to call from several threads.
+    """
+    timings = {}
+    piece = ''.join(compose_stream(description, timings)).strip()
+    return {'piece': piece, 'timings': timings}
+
+def print_stream(stream):
+    """
+    Print a compose_stream() generator as it arrives. Ctrl-C stops generation;
+    returns False if that happened, True otherwise.
+    """
+    try:
+        for i, delta in enumerate(stream):
+            if i == 0:
+                print("\n---\nGenerated piece:\n")
+                delta = delta.lstrip()
+            print(delta, end='', flush=True)
+        print()
+        return True
+    except KeyboardInterrupt:
+        stream.close()
+        print("\n[Generation cancelled]")
+        return False
+
+def main():
+    configure_logging()
+    warm_up_thread = threading.Thread(target=warm_up, daemon=True)
+    warm_up_thread.start()
+
+    # Prompt user for what they want to write
+    description = input("Describe what you want to write: ").strip()
+    if not description:
+        print("No prompt provided. Exiting.")
+        sys.exit(1)
+
+    logger.info(f"User prompt: {description}")
+    warm_up_thread.join()
+
+    timings = {}
+    try:
+        print_stream(compose_stream(description, timings))
+    except Exception as e:
+        logger.error(f"Error generating piece: {e}")
+        print(f"Error generating piece: {e}")
+        sys.exit(1)
+    logger.info(f"Timings: {timings}")
+
+if __name__ == '__main__':
+    main()
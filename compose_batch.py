@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+compose_batch.py: Compose a piece for every prompt in a directory or JSONL file in one run.
+- Each .txt or .md file in the directory (default: to_edit) is one prompt, named after the file;
+  a .jsonl file holds one {"id": "...", "prompt": "..."} object per line (id defaults to the line number).
+- All prompts are embedded in one batched request and searched in one multi-query lookup, then
+  generated concurrently, up to COMPOSE_CONCURRENCY at a time. Requests go through openai_client.py,
+  which keeps them within the account's rate limits, so the run takes about as long as the slowest piece.
+- Each piece is written to COMPOSE_OUTPUT_DIR/<id>.txt and per-item timings to COMPOSE_OUTPUT_DIR/report.json.
+  Prompts that already have an output are skipped unless --overwrite is given, so a failed run resumes.
+
+Usage:
+
+    python compose_batch.py [to_edit | prompts.jsonl] [--output composed] [--concurrency 16] [--overwrite]
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import tracing
+import compose
+
+logger = logging.getLogger(__name__)
+
+INPUT_DIR = 'to_edit'
+OUTPUT_DIR = os.getenv('COMPOSE_OUTPUT_DIR', 'composed')
+COMPOSE_CONCURRENCY = int(os.getenv('COMPOSE_CONCURRENCY', '16'))  # Pieces generated at once
+PROMPT_EXTENSIONS = ('.txt', '.md')
+REPORT_NAME = 'report.json'
+_UNSAFE_RE = re.compile(r'[^\w.-]+')
+
+def item_id_for(name):
+    """
+    A file name stem safe to write, from a prompt file name or JSONL id.
+    """
+    return _UNSAFE_RE.sub('_', str(name)).strip('._') or 'item'
+
+def load_prompts(source):
+    """
+    Return [(item_id, prompt)] from a directory of prompt files or a JSONL file, skipping empty prompts.
+    """
+    items = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if name.endswith(PROMPT_EXTENSIONS) and os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    items.append((item_id_for(os.path.splitext(name)[0]), f.read().strip()))
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if not isinstance(entry, dict) or not isinstance(entry.get('prompt'), str):
+                    raise ValueError(f"{source}:{line_number}: expected an object with a \"prompt\" string")
+                items.append((item_id_for(entry.get('id') or f"{line_number:04d}"), entry['prompt'].strip()))
+    seen = set()
+    for item_id, _ in items:
+        if item_id in seen:
+            raise ValueError(f"Two prompts in {source} would both be written to {item_id}.txt")
+        seen.add(item_id)
+    return [(item_id, prompt) for item_id, prompt in items if prompt]
+
+def write_atomically(path, text):
+    tmp_path = f"{path}.tmp-{threading.get_ident()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text + '\n')
+    os.replace(tmp_path, path)
+
+def compose_one(item_id, prompt, style_snippets, output_dir, started, retrieval):
+    """
+    Generate and write one piece. Returns its report entry; errors are recorded rather than raised.
+    Timings are seconds: 'retrieval' (shared by the whole batch), 'queued' (waiting for a free worker),
+    'first_token' and 'generation' (from compose.stream_piece), and 'total' (from the start of the run).
+    """
+    timings = {'retrieval': retrieval, 'queued': time.perf_counter() - started}
+    entry = {'id': item_id, 'timings': timings}
+    try:
+        piece = compose.generate_piece(prompt, compose.style_system_prompt(style_snippets), timings)
+        path = os.path.join(output_dir, f"{item_id}.txt")
+        write_atomically(path, piece)
+        entry.update(status='ok', output=path, chars=len(piece))
+    except Exception as e:
+        logger.error(f"Error composing {item_id}: {e}")
+        entry.update(status='error', error=str(e))
+    timings['total'] = time.perf_counter() - started + retrieval
+    return entry
+
+def compose_all(items, output_dir=OUTPUT_DIR, concurrency=COMPOSE_CONCURRENCY, overwrite=False):
+    """
+    Compose every (item_id, prompt) in items and write report.json to output_dir. Returns the report.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pending = [(item_id, prompt) for item_id, prompt in items
+               if overwrite or not os.path.exists(os.path.join(output_dir, f"{item_id}.txt"))]
+    skipped = [item_id for item_id, _ in items if item_id not in {p[0] for p in pending}]
+    if skipped:
+        logger.info(f"Skipping {len(skipped)} prompt(s) already composed in {output_dir}")
+    report = {'prompts': len(items), 'skipped': skipped, 'items': []}
+    if pending:
+        start = time.perf_counter()
+        with tracing.span('compose_batch.retrieval'):
+            contexts = compose.get_style_snippets_batch([prompt for _, prompt in pending])
+        retrieval = time.perf_counter() - start
+        logger.info(f"Retrieved style context for {len(pending)} prompt(s) in {retrieval:.2f}s")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = [pool.submit(compose_one, item_id, prompt, snippets, output_dir, started, retrieval)
+                       for (item_id, prompt), snippets in zip(pending, contexts)]
+            for done, future in enumerate(as_completed(futures), 1):
+                entry = future.result()
+                report['items'].append(entry)
+                logger.info(f"[{done}/{len(pending)}] {entry['id']}: {entry['status']} "
+                            f"in {entry['timings'].get('generation', 0):.2f}s")
+        generation = [entry['timings']['generation'] for entry in report['items'] if 'generation' in entry['timings']]
+        report.update(
+            seconds=time.perf_counter() - start,
+            retrieval_seconds=retrieval,
+            slowest_generation_seconds=max(generation, default=0),
+            total_generation_seconds=sum(generation),
+            failed=sum(entry['status'] != 'ok' for entry in report['items']),
+        )
+        report['items'].sort(key=lambda entry: entry['id'])
+    with open(os.path.join(output_dir, REPORT_NAME), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compose a piece for every prompt in a directory or JSONL file.")
+    parser.add_argument('source', nargs='?', default=INPUT_DIR, help="Directory of .txt/.md prompts, or a .jsonl file")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="Directory for the pieces and report.json")
+    parser.add_argument('--concurrency', type=int, default=COMPOSE_CONCURRENCY, help="Pieces generated at once")
+    parser.add_argument('--overwrite', action='store_true', help="Compose prompts that already have an output again")
+    args = parser.parse_args()
+
+    compose.configure_logging()
+    if not os.path.exists(args.source):
+        print(f"No prompts found: {args.source} does not exist.")
+        sys.exit(1)
+    items = load_prompts(args.source)
+    if not items:
+        print(f"No prompts found in {args.source}.")
+        sys.exit(1)
+    compose.warm_up()
+    report = compose_all(items, args.output, args.concurrency, args.overwrite)
+    if 'seconds' in report:
+        print(f"Composed {len(report['items']) - report['failed']} of {len(report['items'])} piece(s) "
+              f"in {report['seconds']:.1f}s (slowest piece {report['slowest_generation_seconds']:.1f}s, "
+              f"{report['total_generation_seconds']:.1f}s of generation in total); report in "
+              f"{os.path.join(args.output, REPORT_NAME)}")
+    if report.get('failed'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+compose_server.py: Long-running compose service.
+- Keeps one vector store (with its pooled DB connections) and one keep-alive OpenAI client warm across requests,
+  so each request only pays for embedding, search, and generation.
+- Serves the same retrieval and generation logic as compose.py over HTTP, or in a REPL loop.
+
+HTTP mode (default), one thread per request:
+
+    python compose_server.py [--host 127.0.0.1] [--port 8765]
+    curl -s localhost:8765/compose -d '{"prompt": "A short essay on gardening"}'
+    curl -sN localhost:8765/compose/stream -d '{"prompt": "A short essay on gardening"}'
+
+REPL mode:
+
+    python compose_server.py --repl
+"""
+import json
+import logging
+import argparse
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import compose
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+class ComposeHandler(BaseHTTPRequestHandler):
+    """
+    POST /compose with {"prompt": "..."} returns {"piece": "...", "timings": {...}}.
+    POST /compose/stream with the same body streams the piece as chunked text/plain as it is generated.
+    GET /health returns {"status": "ok"}.
+    """
+    protocol_version = 'HTTP/1.1'  # Needed for chunked responses
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def send_stream(self, prompt):
+        """
+        Send the piece as a chunked response. Generation stops if the client disconnects.
+        """
+        timings = {}
+        stream = compose.compose_stream(prompt, timings)
+        try:
+            first = next(stream, '')
+        except Exception as e:
+            logger.error(f"Error generating piece: {e}")
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for delta in itertools.chain([first], stream):
+                data = delta.encode('utf-8')
+                if data:
+                    self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                    self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client disconnected; stopping generation")
+            self.close_connection = True
+        except Exception as e:
+            # Headers are already sent, so all we can do is cut the response short
+            logger.error(f"Error generating piece: {e}")
+            self.close_connection = True
+        finally:
+            stream.close()
+        logger.info(f"Timings: {timings}")
+
+    def do_POST(self):
+        if self.path not in ('/compose', '/compose/stream'):
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            prompt = json.loads(self.rfile.read(length) or b'{}').get('prompt', '').strip()
+        except (ValueError, AttributeError):
+            self.send_json(400, {'error': 'Body must be JSON like {"prompt": "..."}'})
+            return
+        if not prompt:
+            self.send_json(400, {'error': 'No prompt provided'})
+            return
+        if self.path == '/compose/stream':
+            self.send_stream(prompt)
+            return
+        try:
+            self.send_json(200, compose.compose_piece(prompt))
+        except Exception as e:
+            logger.error(f"Error generating piece: {e}")
+            self.send_json(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+def warm_up():
+    """
+    Create the OpenAI client and connect to the vector store before the first request arrives.
+    """
+    try:
+        compose.get_client()
+        compose.get_store().warm_up()
+    except Exception as e:
+        logger.warning(f"Warm-up failed ({e}); requests will retry, falling back to processed_corpus")
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), ComposeHandler)
+    server.daemon_threads = True
+    logger.info(f"Compose server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def repl():
+    while True:
+        try:
+            description = input("\nDescribe what you want to write (blank to quit): ").strip()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if not description:
+            break
+        timings = {}
+        try:
+            compose.print_stream(compose.compose_stream(description, timings))
+        except Exception as e:
+            print(f"Error generating piece: {e}")
+            continue
+        logger.info(f"Timings: {timings}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running compose service.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--repl', action='store_true', help="Read prompts from stdin instead of serving HTTP")
+    args = parser.parse_args()
+
+    compose.configure_logging()
+    warm_up()
+    if args.repl:
+        repl()
+    else:
+        serve(args.host, args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+context_packing.py: Choose which retrieved passages go into the compose system prompt.
+- mmr_order() re-ranks over-fetched candidates by maximal marginal relevance, trading similarity
+  to the prompt against similarity to passages already picked, so near-duplicates don't crowd out
+  the rest of your style.
+- pack_snippets() fills a token budget greedily in that order, counting tokens with the
+  compose model's tokenizer.
+
+numpy is imported on first use, to keep importing compose.py cheap.
+"""
+import os
+from embedder import count_tokens
+
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.5'))  # 1.0 = pure relevance, 0.0 = pure diversity
+SNIPPET_SEPARATOR = '\n---\n'
+
+def mmr_order(vectors, relevance, lambda_mult=MMR_LAMBDA, limit=None):
+    """
+    Return candidate indices in maximal marginal relevance order.
+    vectors: candidate embeddings (one per row); relevance: each candidate's similarity to the query.
+    """
+    import numpy as np
+    vectors = np.asarray(vectors, dtype=np.float32)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    count = len(vectors)
+    limit = count if limit is None else min(limit, count)
+    if count == 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    vectors = vectors / norms
+    similarity = vectors @ vectors.T  # Pairwise cosine similarity, computed once
+    redundancy = np.zeros(count, dtype=np.float32)  # Max similarity to anything picked so far
+    available = np.ones(count, dtype=bool)
+    order = []
+    for _ in range(limit):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        order.append(pick)
+        available[pick] = False
+        redundancy = similarity[pick] if len(order) == 1 else np.maximum(redundancy, similarity[pick])
+    return order
+
+def pack_snippets(snippets, token_budget, max_snippets=None, model='gpt-4o'):
+    """
+    Take snippets in order while they fit in token_budget, skipping any that would overflow it.
+    Returns (selected snippets, tokens used). If even the first snippet is too large, a prefix of it is used.
+    """
+    separator_tokens = count_tokens(SNIPPET_SEPARATOR, model)
+    selected = []
+    used = 0
+    for snippet in snippets:
+        if max_snippets and len(selected) >= max_snippets:
+            break
+        tokens = count_tokens(snippet, model) + (separator_tokens if selected else 0)
+        if used + tokens <= token_budget:
+            selected.append(snippet)
+            used += tokens
+    if not selected and snippets and token_budget > 0:
+        snippet = snippets[0]
+        used = count_tokens(snippet, model)
+        while used > token_budget:
+            snippet = snippet[:len(snippet) * token_budget * 9 // (used * 10)]
+            used = count_tokens(snippet, model)
+        selected.append(snippet)
+    return selected, used
@@ -1,71 +1,141 @@
 import os
-import psycopg2
-from psycopg2.extras import execute_values
+import sys
+import time
 from dotenv import load_dotenv
-import json
-from openai import OpenAI
+import hashlib
+import tracing
+from embedder import EMBEDDING_MODEL, embed_texts
+from embedding_cache import get_cache
+from chunker import CHUNK_OVERLAP, CHUNK_SIZE, iter_chunks
+from vector_store import get_store
+import dedup
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from corpus_store import get_corpus_store
 
 # Load environment variables
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-DB_NAME = os.getenv('PGDATABASE', 'henry-pg')
-DB_USER = os.getenv('PGUSER', 'postgres')
-DB_PASSWORD = os.getenv('PGPASSWORD', 'supersecret')
-DB_HOST = os.getenv('PGHOST', 'localhost')
-DB_PORT = os.getenv('PGPORT', '5432')
+UPLOAD_BATCH_ROWS = int(os.getenv('UPLOAD_BATCH_ROWS', '2000'))  # Chunks embedded and uploaded together
 
-client = OpenAI()
+def get_embedding(text, model=EMBEDDING_MODEL):
+    with tracing.span('get_embedding', caller='ingest'):
+        return embed_texts([text], model)[0]
 
-CORPUS_DIR = 'processed_corpus'
-EMBEDDING_MODEL = 'text-embedding-3-small'
-TABLE_NAME = 'blog_style'
+def iter_documents(fields=('filename', 'source_hash')):
+    """
+    Stream processed documents from the corpus store. Add 'text' to fields to read their bodies too.
+    """
+    return get_corpus_store().iter_documents(fields)
 
-# Connect to PostgreSQL
-def get_db_connection():
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
+def get_source_hash(doc):
+    """
+    Return the source file hash written by text_to_json.py, or a hash of the text for older documents.
+    """
+    return doc.get('source_hash') or hashlib.sha256(doc['text'].encode('utf-8')).hexdigest()
 
-def get_embedding(text, model=EMBEDDING_MODEL):
-    response = client.embeddings.create(
-        input=[text],
-        model=model
-    )
-    return response.data[0].embedding
+def iter_chunk_rows(source_file, source_hash, text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Yield (txt, source_file, source_hash, chunk_index, char_start, char_end) rows for every passage in text.
+    """
+    for chunk in iter_chunks(text, size, overlap):
+        yield (chunk.text, source_file, source_hash, chunk.index, chunk.start, chunk.end)
+
+def process_and_upload(batch_rows=UPLOAD_BATCH_ROWS):
+    """
+    Bring the vector store in line with the corpus store: embed only new or changed
+    documents, replace their rows, and remove rows for documents that are gone.
+    Unchanged documents are matched by hash without reading their text.
+    Changed documents are embedded and uploaded batch_rows chunks at a time, so memory stays
+    flat as the corpus grows and an interrupted run keeps every batch already uploaded.
+    With DEDUP on, near-duplicate documents and chunks (see dedup.py) are left out before embedding.
+    """
+    store = get_store()
+    with tracing.span('vector_store.ensure_schema', backend=store.name):
+        store.ensure_schema()
+    with tracing.span('vector_store.source_hashes', backend=store.name):
+        stored_hashes = store.source_hashes()
+    corpus = get_corpus_store()
+    plan = None
+    if dedup.DEDUP:
+        with tracing.span('ingest.dedup'):
+            plan = dedup.plan_corpus(corpus, get_source_hash)
+    # Chunks dropped from each stored document, so turning DEDUP off or changing the plan re-uploads it
+    signature_cache = dedup.get_signature_cache()
+    applied = signature_cache.applied_plans()
+    seen = set()
+    rows = []
+    pending = {}  # source_file -> dedup plan digest, for documents in the current batch
+    unchanged = 0
+    duplicates = 0
+    changed = 0
+    uploaded = 0
+    upload_time = 0.0
+
+    def flush():
+        nonlocal uploaded, upload_time
+        # Embed the batch in as few requests as the API limits allow
+        with tracing.span('ingest.embed'):
+            embeddings = embed_texts([row[0] for row in rows])
+        start = time.perf_counter()
+        with tracing.span('vector_store.upsert', backend=store.name):
+            store.upsert(rows, embeddings)
+        upload_time += time.perf_counter() - start
+        tracing.count('ingest_chunks', len(rows))
+        uploaded += len(rows)
+        print(f"Upserted {uploaded} chunks ({uploaded / max(upload_time, 1e-9):,.0f} rows/s)")
+        rows.clear()
+        for source_file, digest in pending.items():
+            signature_cache.set_applied(source_file, digest)
+        pending.clear()
 
-def process_and_upload():
-    conn = get_db_connection()
-    data_to_insert = []
-    for fname in os.listdir(CORPUS_DIR):
-        if not fname.endswith('.json'):
+    for doc in iter_documents():
+        source_file = doc['filename']
+        if plan and plan.is_duplicate(source_file):
+            duplicates += 1  # Left out of seen, so any rows stored for it are removed
             continue
-        fpath = os.path.join(CORPUS_DIR, fname)
-        if not os.path.isfile(fpath):
+        if not doc['source_hash']:
+            doc = corpus.get(doc['id'])
+        source_hash = get_source_hash(doc)
+        digest = plan.digest(source_file) if plan else ''
+        if dedup.is_current(stored_hashes, applied, plan, source_file, source_hash):
+            seen.add(source_file)
+            unchanged += 1
             continue
-        with open(fpath, 'r', encoding='utf-8') as f:
-            doc = json.load(f)
-        text = doc.get('text', '')
+        text = doc.get('text') or corpus.get(doc['id'])['text']
         if not text:
-            print(f"Warning: No text found in {fname}, skipping.")
+            print(f"Warning: No text found in {source_file}, skipping.")
             continue
-        embedding = get_embedding(text)
-        data_to_insert.append((text, embedding))
-    if data_to_insert:
-        with conn.cursor() as cur:
-            execute_values(
-                cur,
-                f"INSERT INTO {TABLE_NAME} (txt, emb) VALUES %s",
-                data_to_insert
-            )
-            conn.commit()
-    conn.close()
+        with tracing.span('ingest.chunk'):
+            doc_rows = list(iter_chunk_rows(source_file, source_hash, text))
+            if plan:
+                doc_rows = plan.filter_rows(doc_rows)
+        if doc_rows:
+            seen.add(source_file)
+            changed += 1
+            pending[source_file] = digest
+            rows.extend(doc_rows)
+            if len(rows) >= batch_rows:
+                flush()
+    if rows:
+        flush()
+    removed = set(stored_hashes) - seen
+    print(f"{unchanged} unchanged, {changed} new or changed, {duplicates} near-duplicate, "
+          f"{len(removed)} removed documents")
+    tracing.count('ingest_documents', unchanged, status='unchanged')
+    tracing.count('ingest_documents', changed, status='changed')
+    tracing.count('ingest_documents', duplicates, status='duplicate')
+    tracing.count('ingest_documents', len(removed), status='removed')
+    cache = get_cache()
+    if cache:
+        print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses")
+    if removed:
+        with tracing.span('vector_store.delete_sources', backend=store.name):
+            store.delete_sources(removed)
+    store.close()
 
 if __name__ == '__main__':
-    print("Processing files and uploading embeddings to blog_style...")
-    process_and_upload()
+    print(f"Processing files and uploading embeddings to the {get_store().name} vector store...")
+    with tracing.span('ingest.process_and_upload'):
+        process_and_upload()
     print("Done.") 
\ No newline at end of file
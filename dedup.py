@@ -0,0 +1,534 @@
+"""
+dedup.py: Near-duplicate detection for documents and chunks, run before anything is embedded.
+- Each text becomes a set of DEDUP_SHINGLE_WORDS-word shingles, summarised by a MinHash signature of
+  DEDUP_NUM_PERM hashes. Banded locality-sensitive hashing finds candidate pairs in about linear time,
+  and a candidate counts as a duplicate when its estimated Jaccard similarity reaches DEDUP_THRESHOLD.
+- Documents: of each cluster of near-duplicate documents (cross-posts, revised drafts), only one is
+  embedded and stored: by DEDUP_KEEP, the most recently modified corpus file (newest, the default, so
+  a revision wins over its draft), the least recently modified (oldest), or the first by file name (name).
+- Chunks: a chunk that nearly repeats one already kept (boilerplate such as sign-offs, or a section
+  copied between posts) is dropped, and the chunks left in its document are renumbered.
+- Signatures are cached per document version in DEDUP_CACHE_PATH, so unchanged documents aren't re-read.
+  The same file records which chunks were dropped from each stored document, so a document is
+  re-uploaded when the chunks it should drop change (e.g. the post it repeated was deleted).
+- Every plan writes the clusters it collapsed to DEDUP_REPORT_PATH.
+- add_to_rag.py (both pipelines), batch_mode.py, and watch_corpus.py all build the plan before any
+  embedding request, so duplicates are never embedded by any of them.
+
+Off by default: set DEDUP=1 to turn it on. Planning needs the whole corpus, so it makes
+add_to_rag.py's pipeline run in two phases instead of overlapping every stage (see pipeline.py).
+
+Requires: numpy
+"""
+import os
+import re
+import json
+import zlib
+import heapq
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from chunker import CHUNK_OVERLAP, CHUNK_SIZE, iter_chunks
+
+DEDUP = os.getenv('DEDUP', '0') != '0'
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.8'))  # Estimated Jaccard similarity of shingle sets
+DEDUP_NUM_PERM = int(os.getenv('DEDUP_NUM_PERM', '64'))  # MinHash signature length
+DEDUP_SHINGLE_WORDS = int(os.getenv('DEDUP_SHINGLE_WORDS', '5'))
+DEDUP_CACHE_PATH = os.getenv('DEDUP_CACHE_PATH', os.path.join('.cache', 'dedup.sqlite'))
+DEDUP_REPORT_PATH = os.getenv('DEDUP_REPORT_PATH', 'dedup_report.json')
+DEDUP_KEEP = os.getenv('DEDUP_KEEP', 'newest')  # newest | oldest | name: which document of a cluster is kept
+KEEP_POLICIES = ('newest', 'oldest', 'name')
+CORPUS_DIR = 'corpus'
+PRIME = (1 << 31) - 1  # Hashes are taken mod this, so products stay within uint64
+HASH_BLOCK = 4096  # Shingles hashed at once
+
+_WORD_RE = re.compile(r"\w+")
+_permutations = {}
+
+def shingle_hashes(text, words=DEDUP_SHINGLE_WORDS):
+    """
+    CRC-32 of every distinct run of words consecutive lower-cased words in text.
+    """
+    tokens = _WORD_RE.findall(text.lower())
+    grams = {' '.join(tokens[i:i + words]) for i in range(max(1, len(tokens) - words + 1))}
+    return np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.uint64, count=len(grams))
+
+def minhash(text, num_perm=DEDUP_NUM_PERM, words=DEDUP_SHINGLE_WORDS):
+    """
+    MinHash signature of text's shingles under num_perm universal hash functions (a * x + b) mod PRIME.
+    """
+    if num_perm not in _permutations:
+        rng = np.random.default_rng(num_perm)  # Fixed, so signatures from different runs compare
+        _permutations[num_perm] = (rng.integers(1, PRIME, num_perm, dtype=np.uint64),
+                                   rng.integers(0, PRIME, num_perm, dtype=np.uint64))
+    a, b = _permutations[num_perm]
+    hashes = shingle_hashes(text, words) % PRIME
+    signature = np.full(num_perm, PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), HASH_BLOCK):
+        block = hashes[start:start + HASH_BLOCK, None]
+        np.minimum(signature, ((block * a + b) % PRIME).min(axis=0), out=signature)
+    return signature.astype(np.uint32)
+
+def lsh_bands(threshold, num_perm):
+    """
+    (bands, rows per band) whose candidate probability 1 - (1 - s^rows)^bands best separates
+    similarities s below threshold from those above it, weighing false positives and negatives equally.
+    """
+    similarities = np.linspace(0, 1, 201)
+    best = None
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        found = 1 - (1 - similarities ** rows) ** bands
+        error = found[similarities < threshold].sum() + (1 - found[similarities >= threshold]).sum()
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+class LSHIndex:
+    """
+    MinHash signatures banded into hash tables, answering "which indexed items may be this similar?".
+    Items are added and removed by key.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self.tables = [{} for _ in range(self.bands)]
+        self.signatures = {}
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def candidates(self, signature):
+        """
+        Keys sharing at least one band with signature.
+        """
+        keys = set()
+        for table, band in zip(self.tables, self._band_keys(signature)):
+            keys.update(table.get(band, ()))
+        return keys
+
+    def similarity(self, key, signature):
+        return float(np.mean(self.signatures[key] == signature))
+
+    def query(self, signature, accept=None):
+        """
+        Return (key, similarity) of the most similar indexed item at or above the threshold, or None.
+        accept(key) can rule items out; ties go to the smallest key.
+        """
+        best = None
+        for key in self.candidates(signature):
+            if accept is not None and not accept(key):
+                continue
+            similarity = self.similarity(key, signature)
+            if similarity >= self.threshold and (best is None or (-similarity, key) < (-best[1], best[0])):
+                best = (key, similarity)
+        return best
+
+    def add(self, key, signature):
+        for table, band in zip(self.tables, self._band_keys(signature)):
+            table.setdefault(band, set()).add(key)
+        self.signatures[key] = signature
+
+    def remove(self, key):
+        signature = self.signatures.pop(key)
+        for table, band in zip(self.tables, self._band_keys(signature)):
+            table[band].discard(key)
+            if not table[band]:
+                del table[band]
+
+class SignatureCache:
+    """
+    SQLite file holding document and chunk signatures per document version, and the chunk
+    plan applied to each stored document. Safe to share between threads.
+    """
+
+    def __init__(self, path=DEDUP_CACHE_PATH, num_perm=DEDUP_NUM_PERM, words=DEDUP_SHINGLE_WORDS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.num_perm = num_perm
+        # Signatures depend on these settings as well as the text
+        self.settings = f"{num_perm}:{words}:{CHUNK_SIZE}:{CHUNK_OVERLAP}".encode('ascii')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS signatures (
+                key BLOB PRIMARY KEY,
+                document BLOB NOT NULL,
+                chunks BLOB NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS applied (source_file TEXT PRIMARY KEY, plan TEXT NOT NULL)')
+
+    def key(self, source_hash):
+        return hashlib.sha256(self.settings + b'\0' + source_hash.encode('utf-8')).digest()
+
+    def get(self, source_hash):
+        """
+        Return (document signature, chunk signatures array) for a document version, or None.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT document, chunks FROM signatures WHERE key = ?',
+                                     (self.key(source_hash),)).fetchone()
+        if row is None:
+            return None
+        return (np.frombuffer(row[0], dtype=np.uint32),
+                np.frombuffer(row[1], dtype=np.uint32).reshape(-1, self.num_perm))
+
+    def put(self, source_hash, document, chunks):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO signatures VALUES (?, ?, ?)',
+                               (self.key(source_hash), document.tobytes(), chunks.tobytes()))
+
+    def retain(self, source_hashes):
+        """
+        Drop signatures of every document version not in source_hashes.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS keep (key BLOB PRIMARY KEY)')
+            self._conn.execute('DELETE FROM keep')
+            self._conn.executemany('INSERT OR IGNORE INTO keep VALUES (?)',
+                                   ((self.key(source_hash),) for source_hash in source_hashes))
+            self._conn.execute('DELETE FROM signatures WHERE key NOT IN (SELECT key FROM keep)')
+
+    def applied_plans(self):
+        with self._lock:
+            return dict(self._conn.execute('SELECT source_file, plan FROM applied'))
+
+    def set_applied(self, source_file, plan):
+        with self._lock:
+            if plan:
+                self._conn.execute('INSERT OR REPLACE INTO applied VALUES (?, ?)', (source_file, plan))
+            else:
+                self._conn.execute('DELETE FROM applied WHERE source_file = ?', (source_file,))
+
+class DedupPlan:
+    """
+    Which documents to skip and which chunks to drop, as decided by build_plan().
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, keep=DEDUP_KEEP):
+        self.threshold = threshold
+        self.keep = keep
+        self.documents = 0
+        self.chunks = 0
+        self.duplicates = {}  # source_file -> (kept source_file, similarity)
+        self.dropped = {}  # source_file -> {chunk_index: ((kept source_file, kept chunk_index), similarity)}
+
+    def is_duplicate(self, source_file):
+        return source_file in self.duplicates
+
+    def digest(self, source_file):
+        """
+        Short id of the chunks dropped from source_file: '' when none are.
+        """
+        dropped = self.dropped.get(source_file)
+        if not dropped:
+            return ''
+        return hashlib.sha256(json.dumps(sorted(dropped)).encode('ascii')).hexdigest()[:16]
+
+    def dropped_chunks(self, source_file):
+        return sorted(self.dropped.get(source_file, ()))
+
+    def filter_rows(self, rows):
+        """
+        Drop planned chunks from one document's (txt, source_file, source_hash, chunk_index, ...) rows.
+        """
+        rows = list(rows)
+        return drop_chunks(rows, self.dropped.get(rows[0][1], ()) if rows else ())
+
+    def report(self):
+        """
+        Document clusters and chunk clusters that were collapsed, by original chunk index.
+        """
+        documents, chunks = {}, {}
+        for source_file, (kept, similarity) in sorted(self.duplicates.items()):
+            documents.setdefault(kept, []).append({'source_file': source_file, 'similarity': round(similarity, 3)})
+        for source_file, dropped in sorted(self.dropped.items()):
+            for chunk_index, (kept, similarity) in sorted(dropped.items()):
+                chunks.setdefault(kept, []).append({'source_file': source_file, 'chunk_index': chunk_index,
+                                                    'similarity': round(similarity, 3)})
+        return {
+            'threshold': self.threshold,
+            'keep': self.keep,
+            'documents': self.documents,
+            'duplicate_documents': len(self.duplicates),
+            'chunks': self.chunks,
+            'duplicate_chunks': sum(len(dropped) for dropped in self.dropped.values()),
+            'document_clusters': [{'kept': kept, 'duplicates': members} for kept, members in documents.items()],
+            'chunk_clusters': [{'kept': {'source_file': kept[0], 'chunk_index': kept[1]}, 'duplicates': members}
+                               for kept, members in chunks.items()],
+        }
+
+    def write_report(self, path=DEDUP_REPORT_PATH):
+        report = self.report()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Dedup: skipping {report['duplicate_documents']} of {report['documents']} documents and "
+              f"{report['duplicate_chunks']} of {report['chunks']} chunks as near-duplicates; clusters in {path}")
+
+def drop_chunks(rows, dropped):
+    """
+    Leave out rows whose chunk_index is in dropped, renumbering the rest from 0
+    so no stale chunk index is left behind in the store.
+    """
+    if not dropped:
+        return list(rows)
+    dropped = set(dropped)
+    kept = [row for row in rows if row[3] not in dropped]
+    return [row[:3] + (index,) + row[4:] for index, row in enumerate(kept)]
+
+def is_current(stored_hashes, applied, plan, source_file, source_hash):
+    """
+    True if the vector store holds this version of source_file with the plan's chunks (none without
+    a plan) already dropped. applied is SignatureCache.applied_plans().
+    """
+    return stored_hashes.get(source_file) == source_hash \
+        and applied.get(source_file, '') == (plan.digest(source_file) if plan else '')
+
+def keep_key(doc, keep=DEDUP_KEEP, corpus_dir=CORPUS_DIR):
+    """
+    Sort key that puts the document to keep first in every cluster. Modification times come from
+    doc['mtime_ns'] or the file in corpus_dir; documents whose file is gone count as oldest.
+    """
+    if keep not in KEEP_POLICIES:
+        raise ValueError(f"Unknown DEDUP_KEEP {keep!r}; expected one of {KEEP_POLICIES}")
+    if keep == 'name':
+        return (0, doc['filename'])
+    if doc.get('mtime_ns') is None:
+        try:
+            doc['mtime_ns'] = os.stat(os.path.join(corpus_dir, doc['filename'])).st_mtime_ns
+        except OSError:
+            doc['mtime_ns'] = 0
+    sign = -1 if keep == 'newest' else 1
+    return (sign * doc['mtime_ns'], doc['filename'])
+
+def document_signatures(doc, load_text, cache=None, num_perm=DEDUP_NUM_PERM, words=DEDUP_SHINGLE_WORDS):
+    """
+    (document signature, chunk signatures array) for doc, from the cache or computed from load_text(doc).
+    """
+    signatures = cache.get(doc['source_hash']) if cache else None
+    if signatures is None:
+        text = load_text(doc) or ''
+        signatures = (minhash(text, num_perm, words),
+                      np.array([minhash(chunk.text, num_perm, words) for chunk in iter_chunks(text)],
+                               dtype=np.uint32).reshape(-1, num_perm))
+        if cache:
+            cache.put(doc['source_hash'], *signatures)
+    return signatures
+
+class DedupIndex:
+    """
+    Signatures of every document and chunk, kept with the plan they lead to, so that adding, changing,
+    or removing a few documents only re-decides the documents that may be near-duplicates of them.
+
+    Decisions are the same as one pass in keep order would make: a document is a near-duplicate if it
+    matches a kept document earlier in that order, and a kept document's chunk is dropped if it matches
+    a kept chunk earlier in the order (in another document, or earlier in its own). Documents are
+    re-decided in keep order, so everything before one is final when it is decided.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM, words=DEDUP_SHINGLE_WORDS,
+                 keep=DEDUP_KEEP):
+        self.num_perm = num_perm
+        self.words = words
+        self.plan = DedupPlan(threshold, keep)
+        self.doc_index = LSHIndex(threshold, num_perm)
+        self.chunk_index = LSHIndex(threshold, num_perm)
+        self.docs = {}  # source_file -> (keep key, source_hash, chunk count); non-empty documents only
+        self.hashes = {}  # source_file -> source_hash, including empty documents
+
+    def is_indexed(self, doc):
+        """
+        True if doc ({'filename', 'source_hash', optionally 'mtime_ns'}) is indexed at this version and position.
+        """
+        entry = self.docs.get(doc['filename'])
+        if entry is None:
+            return self.hashes.get(doc['filename']) == doc['source_hash']
+        return entry[1] == doc['source_hash'] and entry[0] == keep_key(doc, self.plan.keep)
+
+    def update(self, docs, load_text, cache=None):
+        """
+        Add docs (dicts with 'filename' and 'source_hash', optionally 'mtime_ns'), replacing earlier
+        versions. load_text(doc) is only called for documents whose signatures aren't cached.
+        Returns the source files in a new version, plus any others whose plan (skipped, or chunks dropped) changed.
+        """
+        seeds, moved, updated = set(), set(), set()
+        for doc in docs:
+            if self.is_indexed(doc):
+                continue
+            source_file = doc['filename']
+            updated.add(source_file)
+            seeds |= self._remove(source_file)
+            self.hashes[source_file] = doc['source_hash']
+            doc_signature, chunk_signatures = document_signatures(doc, load_text, cache, self.num_perm, self.words)
+            if not len(chunk_signatures):
+                continue  # Empty documents are never embedded
+            self.docs[source_file] = (keep_key(doc, self.plan.keep), doc['source_hash'], len(chunk_signatures))
+            self.doc_index.add(source_file, doc_signature)
+            for chunk_number, signature in enumerate(chunk_signatures):
+                self.chunk_index.add((source_file, chunk_number), signature)
+            self.plan.documents += 1
+            self.plan.chunks += len(chunk_signatures)
+            seeds.add(source_file)
+            moved.add(source_file)
+        return self._settle(seeds, moved) | updated
+
+    def remove(self, source_files):
+        """
+        Forget source_files. Returns the remaining source files whose plan changed.
+        """
+        seeds = set()
+        for source_file in source_files:
+            seeds |= self._remove(source_file)
+            self.hashes.pop(source_file, None)
+        return self._settle(seeds - set(source_files), set())
+
+    def _remove(self, source_file):
+        """
+        Take one document out of the index and the plan; returns the documents that may have depended on it.
+        """
+        if source_file not in self.docs:
+            return set()
+        dependents = self._dependents(source_file)
+        _, _, chunk_count = self.docs.pop(source_file)
+        self.doc_index.remove(source_file)
+        for chunk_number in range(chunk_count):
+            self.chunk_index.remove((source_file, chunk_number))
+        self.plan.duplicates.pop(source_file, None)
+        self.plan.dropped.pop(source_file, None)
+        self.plan.documents -= 1
+        self.plan.chunks -= chunk_count
+        return dependents
+
+    def _dependents(self, source_file):
+        """
+        Documents after source_file in keep order whose document or chunks may match it or its chunks.
+        """
+        key, _, chunk_count = self.docs[source_file]
+        found = self.doc_index.candidates(self.doc_index.signatures[source_file])
+        for chunk_number in range(chunk_count):
+            signature = self.chunk_index.signatures[(source_file, chunk_number)]
+            found.update(other for other, _ in self.chunk_index.candidates(signature))
+        return {other for other in found if self.docs[other][0] > key}
+
+    def _kept_chunk(self, chunk):
+        source_file, chunk_number = chunk
+        return source_file not in self.plan.duplicates and chunk_number not in self.plan.dropped.get(source_file, ())
+
+    def _decide(self, source_file):
+        """
+        Work out source_file's plan from the (final) plans of the documents before it.
+        """
+        plan = self.plan
+        key, _, chunk_count = self.docs[source_file]
+        plan.duplicates.pop(source_file, None)
+        plan.dropped.pop(source_file, None)
+        match = self.doc_index.query(self.doc_index.signatures[source_file],
+                                     lambda other: self.docs[other][0] < key and other not in plan.duplicates)
+        if match:
+            plan.duplicates[source_file] = match
+            return
+        dropped = {}
+        for chunk_number in range(chunk_count):
+            position = (key, chunk_number)
+
+            def earlier_and_kept(chunk):
+                other, other_number = chunk
+                if other == source_file:
+                    return other_number < chunk_number and other_number not in dropped
+                return (self.docs[other][0], other_number) < position and self._kept_chunk(chunk)
+
+            match = self.chunk_index.query(self.chunk_index.signatures[(source_file, chunk_number)], earlier_and_kept)
+            if match:
+                dropped[chunk_number] = match
+        if dropped:
+            plan.dropped[source_file] = dropped
+
+    def _settle(self, seeds, moved):
+        """
+        Re-decide seeds in keep order, following on to later documents whenever one's kept document or
+        kept chunks change. moved documents have new signatures, so their dependents are always re-decided.
+        """
+        heap = [(self.docs[source_file][0], source_file) for source_file in seeds if source_file in self.docs]
+        heapq.heapify(heap)
+        queued = {source_file for _, source_file in heap}
+        changed = set()
+        while heap:
+            _, source_file = heapq.heappop(heap)
+            before = (source_file in self.plan.duplicates, self.plan.dropped_chunks(source_file))
+            self._decide(source_file)
+            after = (source_file in self.plan.duplicates, self.plan.dropped_chunks(source_file))
+            if before == after and source_file not in moved:
+                continue
+            if before != after:
+                changed.add(source_file)
+            for other in self._dependents(source_file) - queued:
+                heapq.heappush(heap, (self.docs[other][0], other))
+                queued.add(other)
+        return changed
+
+def build_plan(docs, load_text, cache=None, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM,
+               words=DEDUP_SHINGLE_WORDS, keep=DEDUP_KEEP):
+    """
+    Decide which documents and chunks are near-duplicates of ones kept, for docs (dicts with 'filename'
+    and 'source_hash', optionally 'mtime_ns'). Cached signatures of documents not in docs are dropped.
+    """
+    docs = list(docs)
+    index = DedupIndex(threshold, num_perm, words, keep)
+    index.update(docs, load_text, cache)
+    if cache:
+        cache.retain({doc['source_hash'] for doc in docs})
+    return index.plan
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_signature_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SignatureCache()
+        return _cache
+
+def index_corpus(corpus, get_source_hash, pending=None):
+    """
+    Index every document in the corpus store, write the plan's report, and return the DedupIndex.
+    get_source_hash(doc) gives the hash of a full document, for ones stored without it.
+    pending maps document ids to versions not in the corpus store yet ({'filename', 'source_hash',
+    'path', 'mtime_ns'}), which replace or add to the stored ones; their text is read from 'path'.
+    """
+    pending = pending or {}
+    docs = []
+    for doc in corpus.iter_documents(fields=('filename', 'source_hash')):
+        if doc['id'] in pending:
+            continue
+        if not doc['source_hash']:
+            doc = corpus.get(doc['id'])
+            doc['source_hash'] = get_source_hash(doc)
+            del doc['text']
+        docs.append(doc)
+    docs.extend(dict(doc, id=doc_id) for doc_id, doc in pending.items())
+
+    def load_text(doc):
+        if doc.get('path'):
+            with open(doc['path'], 'r', encoding='utf-8') as f:
+                return f.read()
+        return (corpus.get(doc['id']) or {}).get('text')
+
+    cache = get_signature_cache()
+    index = DedupIndex()
+    index.update(docs, load_text, cache)
+    cache.retain({doc['source_hash'] for doc in docs})
+    index.plan.write_report()
+    return index
+
+def plan_corpus(corpus, get_source_hash, pending=None):
+    """
+    Build the plan for every document in the corpus store and write its report (see index_corpus).
+    """
+    return index_corpus(corpus, get_source_hash, pending).plan
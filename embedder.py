@@ -0,0 +1,113 @@
+"""
+embedder.py: Batched embedding helper shared by create_embeddings_and_upload.py and compose.py.
+- Packs many texts into each embeddings.create call, up to the per-request input and token limits.
+- Returns vectors in the same order as the input texts.
+- Serves repeated texts from the on-disk cache in embedding_cache.py and only sends the misses.
+- Requests go through openai_client.py, which shares the rate limits with every other caller.
+- EMBEDDING_DIMENSIONS below the model's native size asks the API for shortened embeddings
+  (text-embedding-3 models), which are cached separately from full-size ones.
+
+Requires: openai>=1.0.0, tiktoken (optional, for exact token counts)
+"""
+import os
+import tracing
+from embedding_cache import get_cache
+from openai_client import create
+
+# Load environment variables from .env if present
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+EMBEDDING_MODEL = 'text-embedding-3-small'
+NATIVE_DIMENSIONS = {'text-embedding-3-small': 1536, 'text-embedding-3-large': 3072, 'text-embedding-ada-002': 1536}
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', str(NATIVE_DIMENSIONS[EMBEDDING_MODEL])))
+MAX_INPUTS_PER_REQUEST = int(os.getenv('EMBED_MAX_INPUTS', '2048'))  # API limit on inputs per request
+MAX_TOKENS_PER_REQUEST = int(os.getenv('EMBED_MAX_TOKENS', '300000'))  # API limit on total tokens per request
+
+_encodings = {}
+
+def count_tokens(text: str, model: str = EMBEDDING_MODEL) -> int:
+    """
+    Count tokens with tiktoken when available, otherwise overestimate from the character count.
+    """
+    if model not in _encodings:
+        try:
+            import tiktoken
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except Exception:
+            _encodings[model] = None
+    encoding = _encodings[model]
+    if encoding is None:
+        # ~4 chars per token for English; divide by 3 so batches stay under the limit
+        return len(text) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def iter_batches(texts, model=EMBEDDING_MODEL,
+                 max_inputs=MAX_INPUTS_PER_REQUEST, max_tokens=MAX_TOKENS_PER_REQUEST):
+    """
+    Yield (indices into texts, total tokens) for batches small enough for a single embeddings request.
+    """
+    batch = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text, model)
+        if batch and (len(batch) >= max_inputs or batch_tokens + tokens > max_tokens):
+            yield batch, batch_tokens
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch, batch_tokens
+
+def dimensions_params(model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Extra embeddings request parameters for dimensions: none at the model's native size.
+    """
+    if not dimensions or dimensions == NATIVE_DIMENSIONS.get(model):
+        return {}
+    return {'dimensions': dimensions}
+
+def cache_model(model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    The model name embeddings are cached under; shortened embeddings get their own entries.
+    """
+    params = dimensions_params(model, dimensions)
+    return f"{model}:{params['dimensions']}" if params else model
+
+def embed_texts(texts, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Embed a list of texts using as few requests as the API limits allow.
+    Cached texts and repeats within the list are only sent once, if at all.
+    Returns one embedding per input text, in input order.
+    """
+    texts = list(texts)
+    cache = get_cache()
+    cache_key = cache_model(model, dimensions)
+    embeddings = cache.get_many(texts, cache_key) if cache else [None] * len(texts)
+    missing = {}  # text -> positions in texts still waiting for an embedding
+    for i, (text, embedding) in enumerate(zip(texts, embeddings)):
+        if embedding is None:
+            missing.setdefault(text, []).append(i)
+    pending = list(missing)
+    tracing.count('embedding_cache', len(texts) - sum(len(positions) for positions in missing.values()), result='hit')
+    tracing.count('embedding_cache', len(pending), result='miss')
+    for batch, batch_tokens in iter_batches(pending, model):
+        response = create('embeddings', model, batch_tokens, input=[pending[i] for i in batch],
+                          **dimensions_params(model, dimensions))
+        # Each result carries the index of its input within the request
+        batch_vectors = [None] * len(batch)
+        for item in response.data:
+            batch_vectors[item.index] = item.embedding
+            for position in missing[pending[batch[item.index]]]:
+                embeddings[position] = item.embedding
+        if cache:
+            cache.put_many([pending[i] for i in batch], cache_key, batch_vectors)
+    return embeddings
+
+def get_embedding(text, model=EMBEDDING_MODEL):
+    with tracing.span('get_embedding', caller='embedder'):
+        return embed_texts([text], model)[0]
@@ -0,0 +1,142 @@
+"""
+embedding_cache.py: On-disk embedding cache shared by create_embeddings_and_upload.py and compose.py.
+- Keyed by (model, SHA-256 of the text), stored in a single SQLite file.
+- Vectors are stored as packed float32 blobs.
+- Least recently used entries are evicted once the cache holds more than EMBEDDING_CACHE_MAX_ENTRIES.
+"""
+import os
+import array
+import atexit
+import hashlib
+import sqlite3
+import threading
+import time
+
+CACHE_ENABLED = os.getenv('EMBEDDING_CACHE', '1') != '0'
+CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join('.cache', 'embeddings.sqlite'))
+MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '500000'))
+SQLITE_MAX_PARAMS = 900  # Stay under SQLite's bound-parameter limit
+
+def cache_key(text: str, model: str) -> bytes:
+    return hashlib.sha256(model.encode('utf-8') + b'\0' + text.encode('utf-8')).digest()
+
+def pack_vector(vector) -> bytes:
+    return array.array('f', vector).tobytes()
+
+def unpack_vector(blob: bytes) -> list:
+    vector = array.array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+class EmbeddingCache:
+    """
+    SQLite-backed LRU cache of embeddings. Safe to share between threads.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Recency updates are buffered and written with the next put or on exit,
+        # so a lookup is a single indexed read
+        self._touched = {}
+        # Entries in the file: counted on the first put, then kept up to date here. Writes by other
+        # processes sharing the file are only seen by the next process to open it.
+        self._count = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vec BLOB NOT NULL,
+                last_used INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+
+    def get_many(self, texts, model):
+        """
+        Return a list with the cached embedding for each text, or None where it isn't cached.
+        """
+        keys = [cache_key(text, model) for text in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), SQLITE_MAX_PARAMS):
+                batch = keys[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(batch))
+                found.update(self._conn.execute(
+                    f'SELECT key, vec FROM embeddings WHERE key IN ({placeholders})', batch
+                ))
+            now = time.time_ns()
+            for key in found:
+                self._touched[key] = now
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return [unpack_vector(found[key]) if key in found else None for key in keys]
+
+    def put_many(self, texts, model, vectors):
+        """
+        Store embeddings for texts, then evict the least recently used entries over the size limit.
+        """
+        now = time.time_ns()
+        rows = [(cache_key(text, model), pack_vector(vector), now) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._flush_touched()
+            if self._count is None:
+                (self._count,) = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()
+            changes = self._conn.total_changes
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO embeddings (key, vec, last_used) VALUES (?, ?, ?)', rows
+            )
+            added = self._conn.total_changes - changes
+            if added < len(rows):
+                # Some were cached already (e.g. embedded twice at once); refresh them instead
+                self._conn.executemany('UPDATE embeddings SET vec = ?, last_used = ? WHERE key = ?',
+                                       [(vec, used, key) for key, vec, used in rows])
+            self._count += added
+            if self._count > self.max_entries:
+                evicted = self._conn.execute(
+                    'DELETE FROM embeddings WHERE key IN '
+                    '(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (self._count - self.max_entries,)
+                ).rowcount
+                self._count -= evicted
+            self._conn.execute('COMMIT')
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                'UPDATE embeddings SET last_used = ? WHERE key = ?',
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.close()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Return the shared cache, or None when EMBEDDING_CACHE=0.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None and CACHE_ENABLED:
+            _cache = EmbeddingCache()
+            atexit.register(_cache.close)
+        return _cache
@@ -0,0 +1,382 @@
+"""
+local_vector_store.py: In-process vector store on local disk, selected with VECTOR_BACKEND=local.
+- Vectors live in a memory-mapped float32 matrix (vectors.f32), L2-normalised on write
+  so cosine similarity is a plain dot product.
+- Passage text lives in a sidecar file (texts.bin); rows.jsonl holds each row's metadata
+  and its byte offset into texts.bin.
+- Writes only append: replaced or deleted rows are tombstoned in rows.jsonl and dropped by compact(),
+  run with `python local_vector_store.py compact` while nothing else has the store open. Ingest never
+  compacts on its own, since a search running in another process would see the files swapped under it.
+- A reader picks up rows appended by another process (e.g. a running ingest) on its next search.
+- With VECTOR_STORAGE=halfvec|int8|binary, compact codes (codes-<tier>.bin, see quantization.py) are
+  scanned instead of the full vectors, and the best top_k * RERANK_FACTOR are re-ranked exactly.
+  Only the codes and the shortlisted rows are read, so far less of the store has to stay in memory.
+
+Usage:
+
+    python local_vector_store.py compact
+
+Requires: numpy
+"""
+import os
+import json
+import argparse
+import threading
+import numpy as np
+from quantization import STORAGE_TIERS, approximate_scores, code_size, encode
+from vector_store import EMBEDDING_DIMENSIONS, RERANK_FACTOR, VECTOR_STORAGE, VectorStore
+
+LOCAL_STORE_DIR = os.getenv('LOCAL_STORE_DIR', 'vector_store')
+SEARCH_BLOCK_ROWS = 65536  # Rows scored per matrix multiply, to bound memory on large stores
+COMPACT_DEAD_FRACTION = 0.5  # Suggest compacting on ensure_schema() once this share of rows is dead
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store backed by a directory of append-only files. Safe to share between threads;
+    assumes a single writing process at a time.
+    """
+    name = 'local'
+
+    def __init__(self, path=LOCAL_STORE_DIR, storage=VECTOR_STORAGE, rerank_factor=RERANK_FACTOR,
+                 dimensions=EMBEDDING_DIMENSIONS):
+        if storage not in STORAGE_TIERS:
+            raise ValueError(f"Unknown VECTOR_STORAGE {storage!r}; expected one of {STORAGE_TIERS}")
+        self.path = path
+        self.storage = storage
+        self.rerank_factor = max(1, rerank_factor)
+        self.dimensions = dimensions
+        self.meta_path = os.path.join(path, 'meta.json')
+        self.vectors_path = os.path.join(path, 'vectors.f32')
+        self.texts_path = os.path.join(path, 'texts.bin')
+        self.rows_path = os.path.join(path, 'rows.jsonl')
+        self.codes_path = os.path.join(path, f'codes-{storage}.bin') if storage != 'float32' else None
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.dim = None
+        self._rows = []  # Row metadata; position is the row id and the row in vectors.f32
+        self._alive = bytearray()  # 1 for live rows, 0 for tombstoned ones
+        self._by_source = {}  # source_file -> ids of its live rows
+        self._rows_read = 0  # Bytes of rows.jsonl already applied
+        self._rows_inode = None
+        self._matrix = None
+        self._codes = None
+
+    def _refresh(self):
+        """
+        Apply rows.jsonl lines written since the last call, reloading from scratch if the file was replaced.
+        """
+        try:
+            stat = os.stat(self.rows_path)
+        except FileNotFoundError:
+            if self._rows:
+                self._reset()
+            return
+        if stat.st_ino != self._rows_inode or stat.st_size < self._rows_read:
+            self._reset()
+            self._rows_inode = stat.st_ino
+        if stat.st_size == self._rows_read:
+            return
+        if self.dim is None:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        with open(self.rows_path, 'rb') as f:
+            f.seek(self._rows_read)
+            data = f.read(stat.st_size - self._rows_read)
+        # Only whole lines count; a partial last line is still being written
+        data = data[:data.rfind(b'\n') + 1]
+        for line in data.splitlines():
+            entry = json.loads(line)
+            if 'delete' in entry:
+                for row_id in entry['delete']:
+                    if self._alive[row_id]:
+                        self._alive[row_id] = 0
+                        self._by_source[self._rows[row_id]['source_file']].discard(row_id)
+            else:
+                self._by_source.setdefault(entry['source_file'], set()).add(len(self._rows))
+                self._rows.append(entry)
+                self._alive.append(1)
+        self._rows_read += len(data)
+        self._matrix = None
+        self._codes = None
+
+    def _get_matrix(self):
+        if self._matrix is None or len(self._matrix) != len(self._rows):
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                     shape=(len(self._rows), self.dim))
+        return self._matrix
+
+    def _get_codes(self):
+        """
+        Memory-map the codes written so far; rows past its end (not yet backfilled) are encoded on the fly.
+        """
+        if self._codes is None:
+            size = code_size(self.storage, self.dim)
+            try:
+                count = min(os.path.getsize(self.codes_path) // size, len(self._rows))
+            except FileNotFoundError:
+                count = 0
+            self._codes = np.memmap(self.codes_path, dtype=np.uint8, mode='r', shape=(count, size)) \
+                if count else np.empty((0, size), dtype=np.uint8)
+        return self._codes
+
+    def _code_block(self, codes, matrix, start, end):
+        if end <= len(codes):
+            return codes[start:end]
+        missing = encode(self.storage, matrix[max(start, len(codes)):end])
+        return np.concatenate([codes[start:len(codes)], missing]) if start < len(codes) else missing
+
+    def _write_codes(self, vectors=None):
+        """
+        Bring the codes file level with vectors.f32, encoding any rows it lacks (e.g. after switching
+        VECTOR_STORAGE), then append codes for vectors. Writer only.
+        """
+        if self.codes_path is None or self.dim is None:
+            return
+        size = code_size(self.storage, self.dim)
+        with open(self.codes_path, 'ab') as f:
+            have = min(f.tell() // size, len(self._rows))
+            f.truncate(have * size)  # Drop codes left behind by a crashed write
+            if have < len(self._rows):
+                matrix = self._get_matrix()
+                for start in range(have, len(self._rows), SEARCH_BLOCK_ROWS):
+                    f.write(encode(self.storage, matrix[start:start + SEARCH_BLOCK_ROWS]).tobytes())
+            if vectors is not None and len(vectors):
+                f.write(encode(self.storage, vectors).tobytes())
+        self._codes = None
+
+    def _check_dimensions(self):
+        if self.dim and self.dimensions and self.dim != self.dimensions:
+            raise ValueError(f"{self.path} holds {self.dim}-dimension embeddings but EMBEDDING_DIMENSIONS is "
+                             f"{self.dimensions}; delete {self.path} and run the ingest again to re-embed.")
+
+    def warm_up(self):
+        with self._lock:
+            self._refresh()
+
+    def ensure_schema(self):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            self._refresh()
+            self._check_dimensions()
+            if self._rows:
+                self._write_codes()
+                dead = len(self._rows) - sum(self._alive)
+                if dead / len(self._rows) >= COMPACT_DEAD_FRACTION:
+                    print(f"{dead} of {len(self._rows)} rows in {self.path} are replaced or deleted; run "
+                          f"`python local_vector_store.py compact` while nothing else is using the store to reclaim them.")
+
+    def source_hashes(self):
+        with self._lock:
+            self._refresh()
+            return {
+                source_file: self._rows[next(iter(ids))]['source_hash']
+                for source_file, ids in self._by_source.items() if ids
+            }
+
+    def version(self):
+        """
+        rows.jsonl's inode and applied length: every write appends to it, and compaction replaces it.
+        """
+        with self._lock:
+            self._refresh()
+            return (self._rows_inode, self._rows_read)
+
+    def _append(self, rows, vectors, deleted_ids):
+        """
+        Append vectors, texts, and row lines. The rows.jsonl write comes last and is what makes the rows visible.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'dim': self.dim}, f)
+        elif vectors is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} doesn't match the store's {self.dim}")
+
+        lines = []
+        if deleted_ids:
+            lines.append(json.dumps({'delete': sorted(deleted_ids)}))
+        if rows:
+            with open(self.vectors_path, 'ab') as f:
+                # Drop vectors left behind by a write that crashed before its rows.jsonl line
+                f.truncate(len(self._rows) * self.dim * 4)
+                f.write(vectors.tobytes())
+            self._write_codes(vectors)
+            with open(self.texts_path, 'ab') as f:
+                offset = f.tell()
+                for txt, source_file, source_hash, chunk_index, char_start, char_end in rows:
+                    encoded = txt.encode('utf-8')
+                    f.write(encoded)
+                    lines.append(json.dumps({
+                        'source_file': source_file,
+                        'source_hash': source_hash,
+                        'chunk_index': chunk_index,
+                        'char_start': char_start,
+                        'char_end': char_end,
+                        'offset': offset,
+                        'length': len(encoded),
+                    }, ensure_ascii=False))
+                    offset += len(encoded)
+        if lines:
+            with open(self.rows_path, 'ab') as f:
+                f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        self._refresh()
+
+    def upsert(self, rows, embeddings):
+        rows = list(rows)
+        with self._lock:
+            self._refresh()
+            replaced = set()
+            for source_file in {row[1] for row in rows}:
+                replaced |= self._by_source.get(source_file, set())
+            if rows:
+                self._append(rows, normalize(embeddings), replaced)
+
+    def delete_sources(self, source_files):
+        with self._lock:
+            self._refresh()
+            deleted = set()
+            for source_file in source_files:
+                deleted |= self._by_source.get(source_file, set())
+            if deleted:
+                self._append([], None, deleted)
+
+    def search(self, embeddings, top_k, with_vectors=False):
+        """
+        Score every query against the whole store block by block, keeping the best per query with argpartition.
+        With a compact storage tier the scan runs over the codes and keeps top_k * rerank_factor
+        candidates, which are then re-ranked exactly against their full vectors.
+        """
+        embeddings = list(embeddings)
+        with self._lock:
+            self._refresh()
+            if not self._rows or not any(self._alive):
+                return [[] for _ in embeddings]
+            self._check_dimensions()
+            matrix = self._get_matrix()
+            codes = self._get_codes() if self.codes_path else None
+            alive = np.frombuffer(bytes(self._alive), dtype=np.uint8).astype(bool)
+            rows = self._rows
+        queries = normalize(embeddings)
+        exact = codes is None
+        keep_count = top_k if exact else top_k * self.rerank_factor
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, len(rows))
+            if exact:
+                scores = queries @ matrix[start:end].T
+            else:
+                scores = approximate_scores(self.storage, queries, self._code_block(codes, matrix, start, end))
+            scores[:, ~alive[start:end]] = -np.inf
+            scores = np.concatenate([best_scores, scores], axis=1)
+            ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, end), (len(queries), end - start))], axis=1)
+            k = min(keep_count, scores.shape[1])
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_ids = np.take_along_axis(ids, keep, axis=1)
+        if not exact:
+            best_scores, best_ids = self._rerank(queries, best_scores, best_ids, matrix, top_k)
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+
+        results = []
+        with open(self.texts_path, 'rb') as texts:
+            for query_scores, query_ids in zip(best_scores, best_ids):
+                matches = []
+                for score, row_id in zip(query_scores, query_ids):
+                    if score == -np.inf:
+                        break
+                    row = rows[row_id]
+                    texts.seek(row['offset'])
+                    match = {
+                        'txt': texts.read(row['length']).decode('utf-8'),
+                        'source_file': row['source_file'],
+                        'chunk_index': row['chunk_index'],
+                        'distance': 1.0 - float(score),
+                    }
+                    if with_vectors:
+                        match['vector'] = np.array(matrix[row_id])
+                    matches.append(match)
+                results.append(matches)
+        return results
+
+    def _rerank(self, queries, shortlist_scores, shortlist_ids, matrix, top_k):
+        """
+        Replace each query's shortlist scores with exact cosine similarities and keep the top_k.
+        """
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        ids = np.zeros((len(queries), top_k), dtype=np.int64)
+        for i, query in enumerate(queries):
+            candidates = np.sort(shortlist_ids[i][np.isfinite(shortlist_scores[i])])  # Sorted for sequential reads
+            exact = matrix[candidates] @ query
+            k = min(top_k, len(candidates))
+            if k:
+                keep = np.argpartition(-exact, k - 1)[:k]
+                scores[i, :k] = exact[keep]
+                ids[i, :k] = candidates[keep]
+        return scores, ids
+
+    def compact(self):
+        """
+        Rewrite the store without tombstoned rows. Run while no other process is using the store.
+        """
+        with self._lock:
+            self._refresh()
+            if not self._rows:
+                return
+            live_ids = [i for i, alive in enumerate(self._alive) if alive]
+            matrix = self._get_matrix()
+            with open(self.texts_path, 'rb') as texts:
+                live_rows = []
+                for row_id in live_ids:
+                    row = self._rows[row_id]
+                    texts.seek(row['offset'])
+                    live_rows.append((texts.read(row['length']).decode('utf-8'), row['source_file'],
+                                      row['source_hash'], row['chunk_index'], row['char_start'], row['char_end']))
+            vectors = np.array(matrix[live_ids]) if live_ids else np.empty((0, self.dim), dtype=np.float32)
+            print(f"Compacting local vector store: keeping {len(live_ids)} of {len(self._rows)} rows")
+            tmp = LocalVectorStore(self.path + '.compact', self.storage, self.rerank_factor, self.dimensions)
+            os.makedirs(tmp.path, exist_ok=True)
+            for path in (tmp.vectors_path, tmp.texts_path, tmp.rows_path):
+                open(path, 'wb').close()
+            with open(tmp.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'dim': self.dim}, f)
+            tmp.dim = self.dim
+            tmp._append(live_rows, vectors, set())
+            # Row ids change, so codes for other storage tiers no longer line up
+            for name in os.listdir(self.path):
+                if name.startswith('codes-') and name.endswith('.bin'):
+                    os.remove(os.path.join(self.path, name))
+            names = ['vectors.f32', 'texts.bin', 'rows.jsonl']
+            if self.codes_path and live_rows:
+                names.append(os.path.basename(self.codes_path))
+            for name in names:
+                os.replace(os.path.join(tmp.path, name), os.path.join(self.path, name))
+            os.remove(tmp.meta_path)
+            os.rmdir(tmp.path)
+            self._reset()
+            self._refresh()
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the local vector store.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('compact', help="Rewrite the store without replaced or deleted rows; stop readers first")
+    parser.parse_args()
+
+    LocalVectorStore().compact()
+    print("Done.")
+
+if __name__ == '__main__':
+    main()
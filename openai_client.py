@@ -0,0 +1,260 @@
+"""
+openai_client.py: The one OpenAI client every script shares, with rate limiting and retries.
+- create() sends a request through a per-model limiter: an AIMD concurrency limit (raised by one
+  slot per window of successes, halved on a 429) plus requests-per-minute and tokens-per-minute
+  token buckets, so threads share the quota instead of racing for it.
+- The buckets start from OPENAI_RPM / OPENAI_TPM (0 = unknown) and follow the x-ratelimit-* headers
+  of each response, so they settle on the account's real limits without configuration. When a
+  header reports the quota used up, requests wait for its reset time instead of drawing 429s.
+- Rate limits, timeouts, connection errors and 5xx responses are retried with jittered exponential
+  backoff (honouring Retry-After), up to OPENAI_MAX_RETRIES times. Other errors are raised at once.
+
+Requires: openai>=1.40.0
+"""
+import os
+import re
+import time
+import random
+import logging
+import threading
+import tracing
+
+# Load environment variables from .env if present
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '8'))
+OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', '0.5'))  # Seconds before the first retry
+OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', '60'))  # Longest single wait
+OPENAI_CONCURRENCY = float(os.getenv('OPENAI_CONCURRENCY', '4'))  # Starting requests in flight per model
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '32'))
+OPENAI_RPM = int(os.getenv('OPENAI_RPM', '0'))  # Requests per minute per model until headers say otherwise
+OPENAI_TPM = int(os.getenv('OPENAI_TPM', '0'))  # Tokens per minute per model until headers say otherwise
+HEADROOM = 0.1  # Stop raising concurrency once less than this fraction of the quota remains
+
+logger = logging.getLogger(__name__)
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+_client = None
+_client_lock = threading.Lock()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_client():
+    """
+    Return the shared OpenAI client, creating it on first use.
+    The client keeps its HTTP connections alive and is safe to use from several threads.
+    Its own retries are off; create() retries instead, so every attempt passes through the limiter.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI(max_retries=0)
+    return _client
+
+class TokenBucket:
+    """
+    Refills at limit per minute, holding at most a minute's worth. A limit of 0 means unlimited.
+    """
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.level = float(limit)
+        self.updated = time.monotonic()
+        self.hold_until = 0.0  # Set when the server says the quota is used up until its reset
+
+    def refill(self, now):
+        if self.limit:
+            self.level = min(self.limit, self.level + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Seconds until amount is available, or 0 if it is now. Amounts above the limit wait for a full bucket.
+        """
+        held = max(0.0, self.hold_until - self.updated)
+        if not self.limit:
+            return held
+        amount = min(amount, self.limit)
+        return max(held, 0.0 if self.level >= amount else (amount - self.level) * 60 / self.limit)
+
+    def set_limit(self, limit, remaining=None, reset=None):
+        if limit and limit != self.limit:
+            self.level = min(self.level, limit) if self.limit else float(limit)
+            self.limit = limit
+        if remaining is not None and self.limit:
+            self.level = min(self.level, remaining)
+        if remaining == 0 and reset:
+            self.hold_until = max(self.hold_until, time.monotonic() + reset)
+
+def parse_duration(text):
+    """
+    Seconds in an x-ratelimit-reset-* value such as '20ms', '1.5s' or '6m0s', or None.
+    """
+    parts = _DURATION_RE.findall(text or '')
+    if not parts:
+        return None
+    return sum(float(value) * _DURATION_UNITS[unit] for value, unit in parts)
+
+class RateLimiter:
+    """
+    Concurrency limit plus request and token buckets for one model.
+    """
+
+    def __init__(self, concurrency=OPENAI_CONCURRENCY, max_concurrency=OPENAI_MAX_CONCURRENCY,
+                 rpm=OPENAI_RPM, tpm=OPENAI_TPM):
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.near_limit = False
+        self.condition = threading.Condition()
+
+    def acquire(self, tokens):
+        """
+        Block until a slot, a request, and tokens are all available, then take them.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if self.in_flight < int(self.concurrency) and wait == 0:
+                    self.in_flight += 1
+                    self.requests.level -= 1
+                    self.tokens.level -= min(tokens, self.tokens.limit) if self.tokens.limit else 0
+                    return
+                # Woken early when a request finishes or the limits change
+                self.condition.wait(wait or None)
+
+    def release(self, outcome, used_tokens=None, reserved_tokens=0, headers=None):
+        """
+        Give the slot back. outcome is 'ok', 'throttled' (a 429), or 'error'.
+        used_tokens, when known, replaces the estimate taken in acquire().
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if used_tokens is not None and self.tokens.limit:
+                self.tokens.level += min(reserved_tokens, self.tokens.limit) - used_tokens
+            if headers is not None:
+                self.update_from_headers(headers)
+            if outcome == 'throttled':
+                # Multiplicative decrease
+                self.concurrency = max(1.0, self.concurrency / 2)
+            elif outcome == 'ok' and not self.near_limit:
+                # Additive increase: about one more slot per concurrency-many successes
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self.condition.notify_all()
+
+    def update_from_headers(self, headers):
+        def number(name):
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+        limit_requests, remaining_requests = number('x-ratelimit-limit-requests'), number('x-ratelimit-remaining-requests')
+        limit_tokens, remaining_tokens = number('x-ratelimit-limit-tokens'), number('x-ratelimit-remaining-tokens')
+        self.requests.set_limit(limit_requests, remaining_requests,
+                                parse_duration(headers.get('x-ratelimit-reset-requests')))
+        self.tokens.set_limit(limit_tokens, remaining_tokens,
+                              parse_duration(headers.get('x-ratelimit-reset-tokens')))
+        self.near_limit = any(limit and remaining is not None and remaining < limit * HEADROOM
+                              for limit, remaining in ((limit_requests, remaining_requests),
+                                                       (limit_tokens, remaining_tokens)))
+
+def get_limiter(model):
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = _limiters[model] = RateLimiter()
+        return limiter
+
+def backoff(attempt, retry_after=None):
+    """
+    Seconds to wait before retry number attempt (0-based): full jitter over an exponential ceiling,
+    but never less than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+def _retry_after(headers):
+    if headers is None:
+        return None
+    for name, scale in (('retry-after-ms', 1000), ('retry-after', 1)):
+        try:
+            return min(OPENAI_BACKOFF_MAX, float(headers.get(name)) / scale)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def _classify(error):
+    """
+    Return 'throttled' or 'retry' for errors worth retrying, or None for errors that won't go away.
+    """
+    import openai
+    if isinstance(error, openai.RateLimitError):
+        # Running out of credit is also a 429, but waiting won't fix it
+        return None if getattr(error, 'code', None) == 'insufficient_quota' else 'throttled'
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):  # Includes timeouts
+        return 'retry'
+    if isinstance(error, openai.APIStatusError) and error.status_code in (408, 409):
+        return 'retry'
+    return None
+
+def _resource(endpoint):
+    client = get_client()
+    if endpoint == 'embeddings':
+        return client.embeddings
+    if endpoint == 'chat':
+        return client.chat.completions
+    raise ValueError(f"Unknown OpenAI endpoint: {endpoint}")
+
+def create(endpoint, model, tokens=0, purpose=None, **params):
+    """
+    Call endpoint ('embeddings' or 'chat') for model, waiting for the model's rate limits and
+    retrying transient failures. tokens is an estimate of the request's total tokens, for the TPM budget.
+    Returns the parsed response. With stream=True that is a Stream, whose concurrency slot is given back
+    once the response starts and whose usage the caller records.
+    """
+    limiter = get_limiter(model)
+    extra = {'purpose': purpose} if purpose else {}
+    labels = dict(endpoint=endpoint, **extra)
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        start = time.perf_counter()
+        limiter.acquire(tokens)
+        tracing.observe('openai.wait', time.perf_counter() - start, model=model)
+        try:
+            with tracing.span(f'openai.{endpoint}', model=model, **extra):
+                raw = _resource(endpoint).with_raw_response.create(model=model, **params)
+                response = raw.parse()
+        except Exception as e:
+            kind = _classify(e)
+            headers = getattr(getattr(e, 'response', None), 'headers', None)
+            limiter.release('throttled' if kind == 'throttled' else 'error', 0, tokens, headers)
+            if kind is None or attempt == OPENAI_MAX_RETRIES:
+                tracing.count('openai_errors', **labels)
+                raise
+            delay = backoff(attempt, _retry_after(headers))
+            tracing.count('openai_retries', **labels)
+            if kind == 'throttled':
+                tracing.count('openai_throttled', model=model)
+            logger.warning(f"OpenAI {endpoint} request for {model} failed ({type(e).__name__}); "
+                           f"retrying in {delay:.1f}s [{attempt + 1}/{OPENAI_MAX_RETRIES}]")
+            time.sleep(delay)
+            continue
+        usage = None if params.get('stream') else getattr(response, 'usage', None)
+        used = None
+        if usage is not None:
+            used = getattr(usage, 'total_tokens', None) or \
+                (getattr(usage, 'prompt_tokens', 0) or 0) + (getattr(usage, 'completion_tokens', 0) or 0)
+            tracing.record_usage(model, usage)
+        limiter.release('ok', used, tokens, raw.headers)
+        tracing.count('openai_requests', **labels)
+        return response
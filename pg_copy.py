@@ -0,0 +1,103 @@
+"""
+pg_copy.py: COPY payloads for bulk loading chunk rows into Postgres.
+- Binary format (default) sends each vector as packed float4s, with no text rendering or parsing on either side.
+- Text format sends vectors as '[x,y,...]' literals with 9 significant digits, enough to round-trip
+  float4 exactly, for servers or poolers where binary COPY is unavailable.
+
+Rows are (txt, source_file, source_hash, chunk_index, char_start, char_end) tuples, as in vector_store.py;
+COPY_COLUMNS gives the column order of the payload.
+"""
+import os
+import io
+import sys
+import struct
+from array import array
+
+COPY_FORMAT = os.getenv('PG_COPY_FORMAT', 'binary')  # binary | text
+COPY_FORMATS = ('binary', 'text')
+COPY_COLUMNS = ('txt', 'source_file', 'source_hash', 'chunk_index', 'char_start', 'char_end', 'emb')
+
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_TRAILER = struct.pack('!h', -1)
+_FIELD_COUNT = struct.pack('!h', len(COPY_COLUMNS))
+_NULL = struct.pack('!i', -1)
+_INT_FIELD = struct.Struct('!ii')  # Length (4) followed by an int4
+_VECTOR_FORMATS = {}
+_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+def _text_field(value):
+    if value is None:
+        return _NULL
+    data = value.encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+def encode_vector(embedding):
+    """
+    pgvector's binary representation: int16 dimensions, int16 unused, then big-endian float4s.
+    """
+    floats = array('f', embedding)
+    if sys.byteorder == 'little':
+        floats.byteswap()
+    return struct.pack('!hh', len(floats), 0) + floats.tobytes()
+
+def binary_payload(rows, embeddings):
+    """
+    Return a file-like object holding rows and their embeddings in binary COPY format.
+    """
+    out = io.BytesIO()
+    out.write(BINARY_HEADER)
+    for (txt, source_file, source_hash, chunk_index, char_start, char_end), embedding in zip(rows, embeddings):
+        vector = encode_vector(embedding)
+        out.write(b''.join((
+            _FIELD_COUNT,
+            _text_field(txt),
+            _text_field(source_file),
+            _text_field(source_hash),
+            _INT_FIELD.pack(4, chunk_index),
+            _INT_FIELD.pack(4, char_start),
+            _INT_FIELD.pack(4, char_end),
+            struct.pack('!i', len(vector)),
+            vector,
+        )))
+    out.write(BINARY_TRAILER)
+    out.seek(0)
+    return out
+
+def format_vector(embedding):
+    """
+    pgvector's text representation, formatted in one pass with a per-dimension format string.
+    """
+    fmt = _VECTOR_FORMATS.get(len(embedding))
+    if fmt is None:
+        fmt = _VECTOR_FORMATS[len(embedding)] = '[' + ','.join(['%.9g'] * len(embedding)) + ']'
+    return fmt % tuple(embedding)
+
+def text_payload(rows, embeddings):
+    """
+    Return a file-like object holding rows and their embeddings in text COPY format.
+    """
+    out = io.StringIO()
+    for (txt, source_file, source_hash, chunk_index, char_start, char_end), embedding in zip(rows, embeddings):
+        fields = [
+            txt.translate(_TEXT_ESCAPES),
+            source_file.translate(_TEXT_ESCAPES),
+            source_hash.translate(_TEXT_ESCAPES) if source_hash is not None else '\\N',
+            str(chunk_index),
+            str(char_start),
+            str(char_end),
+            format_vector(embedding),
+        ]
+        out.write('\t'.join(fields))
+        out.write('\n')
+    out.seek(0)
+    return out
+
+def copy_payload(rows, embeddings, copy_format=COPY_FORMAT):
+    """
+    Return (payload, options) for COPY ... FROM STDIN WITH (options).
+    """
+    if copy_format == 'binary':
+        return binary_payload(rows, embeddings), 'FORMAT binary'
+    if copy_format == 'text':
+        return text_payload(rows, embeddings), 'FORMAT text'
+    raise ValueError(f"Unknown PG_COPY_FORMAT {copy_format!r}; expected one of {', '.join(COPY_FORMATS)}")
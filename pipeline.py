@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+pipeline.py: Single-process streaming ingest, used by add_to_rag.py.
+
+    discover -> hash -> title -> chunk -> embed -> upload
+
+Each stage runs on its own worker threads and hands documents to the next stage through a
+bounded queue, so all stages overlap and a slow stage holds back its producers instead of
+letting work pile up in memory. Total time approaches that of the slowest stage.
+
+- discover: walks corpus/ and skips files whose stat matches the manifest and whose stored
+  hash already matches the vector store, without opening them.
+- hash: reads each remaining file once for its text and hash; unchanged contents skip the title stage.
+- title: generates a title and writes the document to the corpus store.
+- chunk / embed / upload: split into passages, embed in batches, and upsert into the vector store.
+
+With DEDUP=1 (off by default), near-duplicate detection (dedup.py) needs the whole corpus, so the run
+has two phases: discover -> hash -> title brings the corpus store up to date, then the dedup plan is built
+and only documents that aren't near-duplicates go through chunk -> embed -> upload, minus dropped chunks.
+
+Worker counts, queue size, and batch sizes are configurable through the PIPELINE_* variables below.
+"""
+import os
+import sys
+import time
+import queue
+import threading
+import tracing
+import dedup
+from embedder import embed_texts
+from vector_store import get_store
+from create_embeddings_and_upload import get_source_hash, iter_chunk_rows
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from manifest import Manifest, read_and_hash
+from corpus_store import doc_id_for, get_corpus_store
+
+CORPUS_DIR = 'corpus'
+QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '64'))  # Documents waiting between two stages
+HASH_WORKERS = int(os.getenv('PIPELINE_HASH_WORKERS', str(os.cpu_count() or 4)))
+TITLE_WORKERS = int(os.getenv('PIPELINE_TITLE_WORKERS', os.getenv('TITLE_CONCURRENCY', '8')))
+CHUNK_WORKERS = int(os.getenv('PIPELINE_CHUNK_WORKERS', '1'))
+EMBED_WORKERS = int(os.getenv('PIPELINE_EMBED_WORKERS', '2'))
+UPLOAD_WORKERS = int(os.getenv('PIPELINE_UPLOAD_WORKERS', '1'))
+EMBED_BATCH_ROWS = int(os.getenv('PIPELINE_EMBED_BATCH_ROWS', '512'))  # Chunks per embedding call
+UPLOAD_BATCH_ROWS = int(os.getenv('PIPELINE_UPLOAD_BATCH_ROWS', '1000'))  # Chunks per upsert
+BATCH_WAIT = 0.5  # Seconds a batching stage waits for more work before sending a partial batch
+
+STOP = object()
+
+class Stage:
+    """
+    A pipeline step. handler(item) returns the items to pass on; with batch_rows set,
+    handler(items) gets a list of documents holding up to about batch_rows chunks.
+    """
+
+    def __init__(self, name, handler, workers=1, batch_rows=None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch_rows = batch_rows
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def take(self, inbox):
+        """
+        Return the next unit of work (an item or a batch), and whether STOP was seen.
+        """
+        item = inbox.get()
+        if item is STOP:
+            return None, True
+        if not self.batch_rows:
+            return item, False
+        batch = [item]
+        rows = len(item['rows'])
+        deadline = time.monotonic() + BATCH_WAIT
+        while rows < self.batch_rows:
+            try:
+                item = inbox.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is STOP:
+                return batch, True
+            batch.append(item)
+            rows += len(item['rows'])
+        return batch, False
+
+def run_stages(source, stages, queue_size=QUEUE_SIZE):
+    """
+    Feed items from source through stages, each on its own threads, connected by bounded queues.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages] + [None]
+    threads = []
+    for i, stage in enumerate(stages):
+        next_stage = stages[i + 1] if i + 1 < len(stages) else None
+        remaining = [stage.workers]
+
+        def work(stage=stage, inbox=queues[i], outbox=queues[i + 1], next_stage=next_stage, remaining=remaining):
+            stopped = False
+            while not stopped:
+                unit, stopped = stage.take(inbox)
+                if unit is None:
+                    continue
+                start = time.perf_counter()
+                try:
+                    with tracing.span(f'pipeline.{stage.name}'):
+                        outputs = list(stage.handler(unit))
+                except Exception as e:
+                    names = [doc['filename'] for doc in unit] if isinstance(unit, list) else [unit['filename']]
+                    print(f"Error in {stage.name} stage for {', '.join(names)}: {e}")
+                    outputs = []
+                    with stage.lock:
+                        stage.errors += 1
+                with stage.lock:
+                    stage.busy += time.perf_counter() - start
+                    stage.processed += len(unit) if isinstance(unit, list) else 1
+                if outbox is not None:
+                    for output in outputs:
+                        outbox.put(output)
+            with stage.lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                for _ in range(next_stage.workers):
+                    outbox.put(STOP)
+
+        for _ in range(stage.workers):
+            thread = threading.Thread(target=work, name=f"{stage.name}-worker", daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    for item in source:
+        queues[0].put(item)
+    for _ in range(stages[0].workers):
+        queues[0].put(STOP)
+    for thread in threads:
+        thread.join()
+
+def run_pipeline(corpus_dir=CORPUS_DIR):
+    """
+    Process, embed, and upload every new or changed corpus file in one pass.
+    """
+    from text_to_json import generate_title
+
+    start_time = time.perf_counter()
+    manifest = Manifest()
+    corpus = get_corpus_store()
+    store = get_store()
+    store.ensure_schema()
+    corpus_hashes = {doc['id']: doc['source_hash'] for doc in corpus.iter_documents(fields=('source_hash',))}
+    stored_hashes = store.source_hashes()
+    counts = {'unchanged': 0, 'embedded': 0, 'duplicate': 0}
+    counts_lock = threading.Lock()
+    plan = None
+    # Chunks dropped from each stored document, so turning DEDUP off or changing the plan re-uploads it
+    applied = dedup.get_signature_cache().applied_plans()
+
+    def is_uploaded(filename, source_hash):
+        # Before the dedup plan exists, only the corpus store is brought up to date
+        if dedup.DEDUP and plan is None:
+            return True
+        return dedup.is_current(stored_hashes, applied, plan, filename, source_hash)
+
+    def discover():
+        present = set()
+        with os.scandir(corpus_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.txt') or not entry.is_file():
+                    continue
+                present.add(entry.name)
+                doc_id = doc_id_for(entry.name)
+                stored_hash = corpus_hashes.get(doc_id)
+                if manifest.is_unchanged(entry.name, entry.stat()) and stored_hash \
+                        and is_uploaded(entry.name, stored_hash):
+                    if not dedup.DEDUP:
+                        with counts_lock:
+                            counts['unchanged'] += 1
+                    continue
+                yield {'id': doc_id, 'filename': entry.name, 'path': entry.path}
+        # Files deleted since they were processed; their rows are removed at the end of the run
+        for filename in set(manifest.entries) - present:
+            manifest.remove(filename)
+            corpus.delete(doc_id_for(filename))
+        if dedup.DEDUP:
+            return
+        # Processed documents that were never seen in corpus/ (so not in the manifest) are still
+        # uploaded, as create_embeddings_and_upload.py does
+        for doc in corpus.iter_documents(fields=('filename', 'source_hash')):
+            if doc['filename'] not in present and not is_uploaded(doc['filename'], doc['source_hash']):
+                doc = corpus.get(doc['id'])
+                doc['source_hash'] = get_source_hash(doc)
+                if is_uploaded(doc['filename'], doc['source_hash']):
+                    continue
+                doc['skip_title'] = True
+                yield doc
+
+    def hash_file(doc):
+        if doc.get('skip_title'):
+            yield doc
+            return
+        doc['text'], doc['source_hash'], doc['stat'] = read_and_hash(doc['path'])
+        if corpus_hashes.get(doc['id']) == doc['source_hash']:
+            manifest.update(doc['filename'], doc['stat'], doc['source_hash'])
+            if is_uploaded(doc['filename'], doc['source_hash']):
+                if not dedup.DEDUP:
+                    with counts_lock:
+                        counts['unchanged'] += 1
+                return
+            doc['skip_title'] = True
+        yield doc
+
+    def title(doc):
+        if not doc.get('skip_title'):
+            doc['title'] = generate_title(doc['filename'], doc['text'])
+            corpus.put(doc)
+            manifest.update(doc['filename'], doc['stat'], doc['source_hash'])
+            print(f"Processed {doc['filename']} -> {doc['title']}")
+        yield doc
+
+    def discover_uploads():
+        # Second phase with DEDUP: every stored document that isn't a near-duplicate and isn't uploaded as planned
+        for doc in corpus.iter_documents(fields=('filename', 'source_hash')):
+            if plan.is_duplicate(doc['filename']):
+                with counts_lock:
+                    counts['duplicate'] += 1
+                continue
+            if not doc['source_hash']:
+                doc = corpus.get(doc['id'])
+                doc['source_hash'] = get_source_hash(doc)
+            if is_uploaded(doc['filename'], doc['source_hash']):
+                with counts_lock:
+                    counts['unchanged'] += 1
+                continue
+            if not doc.get('text'):
+                doc['text'] = corpus.get(doc['id'])['text']
+            yield doc
+
+    def chunk(doc):
+        doc['rows'] = list(iter_chunk_rows(doc['filename'], doc['source_hash'], doc['text']))
+        if plan:
+            doc['rows'] = plan.filter_rows(doc['rows'])
+        doc.pop('text')  # Only the chunks are needed from here on
+        if doc['rows']:
+            yield doc
+
+    def embed(docs):
+        embeddings = iter(embed_texts([row[0] for doc in docs for row in doc['rows']]))
+        for doc in docs:
+            doc['embeddings'] = [next(embeddings) for _ in doc['rows']]
+            yield doc
+
+    def upload(docs):
+        rows = [row for doc in docs for row in doc['rows']]
+        start = time.perf_counter()
+        store.upsert(rows, [embedding for doc in docs for embedding in doc['embeddings']])
+        for doc in docs:
+            dedup.get_signature_cache().set_applied(doc['filename'], plan.digest(doc['filename']) if plan else '')
+        rate = len(rows) / max(time.perf_counter() - start, 1e-9)
+        with counts_lock:
+            counts['embedded'] += len(docs)
+        print(f"Uploaded {len(rows)} chunks ({rate:,.0f} rows/s) from {', '.join(doc['filename'] for doc in docs)}")
+        return []
+
+    stages = [
+        Stage('hash', hash_file, HASH_WORKERS),
+        Stage('title', title, TITLE_WORKERS),
+        Stage('chunk', chunk, CHUNK_WORKERS),
+        Stage('embed', embed, EMBED_WORKERS, batch_rows=EMBED_BATCH_ROWS),
+        Stage('upload', upload, UPLOAD_WORKERS, batch_rows=UPLOAD_BATCH_ROWS),
+    ]
+    try:
+        if dedup.DEDUP:
+            run_stages(discover(), stages[:2])
+            manifest.save()
+            with tracing.span('pipeline.dedup'):
+                plan = dedup.plan_corpus(corpus, get_source_hash)
+            run_stages(discover_uploads(), stages[2:])
+        else:
+            run_stages(discover(), stages)
+    finally:
+        manifest.save()
+
+    # Remove rows for documents no longer in the corpus store, as create_embeddings_and_upload.py does,
+    # and for documents that turned out to be near-duplicates
+    known_files = {doc['filename'] for doc in corpus.iter_documents(fields=('filename',))}
+    if plan:
+        known_files -= set(plan.duplicates)
+    removed = set(store.source_hashes()) - known_files
+    if removed:
+        store.delete_sources(removed)
+    store.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\n{counts['unchanged']} unchanged, {counts['embedded']} embedded and uploaded, "
+          f"{counts['duplicate']} near-duplicate, {len(removed)} removed documents in {elapsed:.1f}s")
+    for stage in stages:
+        print(f"  {stage.name:7s} {stage.processed:6d} documents  {stage.busy:8.1f}s busy  "
+              f"{stage.workers} workers  {stage.errors} errors")
+    return all(stage.errors == 0 for stage in stages)
+
+if __name__ == '__main__':
+    run_pipeline()
@@ -0,0 +1,67 @@
+"""
+quantization.py: Compact codes for unit-length embeddings, used to shortlist candidates cheaply
+before they are re-ranked exactly against the full float32 vectors.
+- float32: no codes; search scans the full vectors (exact)
+- halfvec: float16 components, 2 bytes per dimension
+- int8: one signed byte per dimension plus a float32 scale per vector
+- binary: one sign bit per dimension, compared by Hamming distance
+
+Requires: numpy
+"""
+import numpy as np
+
+STORAGE_TIERS = ('float32', 'halfvec', 'int8', 'binary')
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def code_size(storage, dim):
+    """
+    Bytes per vector searched by the given tier.
+    """
+    if storage == 'float32':
+        return 4 * dim
+    if storage == 'halfvec':
+        return 2 * dim
+    if storage == 'int8':
+        return dim + 4
+    if storage == 'binary':
+        return (dim + 7) // 8
+    raise ValueError(f"Unknown storage tier {storage!r}; expected one of {STORAGE_TIERS}")
+
+def encode(storage, vectors):
+    """
+    Encode unit-length float32 vectors (one per row) as a uint8 array of shape (rows, code_size).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if storage == 'halfvec':
+        return vectors.astype('<f2').view(np.uint8)
+    if storage == 'int8':
+        scales = np.abs(vectors).max(axis=1, keepdims=True) / 127
+        scales[scales == 0] = 1
+        codes = np.rint(vectors / scales).astype(np.int8)
+        return np.concatenate([scales.astype('<f4').view(np.uint8), codes.view(np.uint8)], axis=1)
+    if storage == 'binary':
+        return np.packbits(vectors > 0, axis=1)
+    raise ValueError(f"No codes for storage tier {storage!r}")
+
+def approximate_scores(storage, queries, codes):
+    """
+    Score unit-length queries against encoded rows; higher is closer. Returns (queries, rows) float32.
+    Scores from different tiers aren't comparable, only their order is meaningful.
+    """
+    codes = np.asarray(codes)
+    if storage == 'halfvec':
+        return queries @ codes.view('<f2').astype(np.float32).T
+    if storage == 'int8':
+        scales = np.ascontiguousarray(codes[:, :4]).view('<f4').ravel()
+        return (queries @ codes[:, 4:].view(np.int8).astype(np.float32).T) * scales
+    if storage == 'binary':
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        # One query at a time, so the XOR intermediate stays rows x code_size
+        for i, query_bits in enumerate(np.packbits(np.asarray(queries) > 0, axis=1)):
+            differing = np.bitwise_xor(codes, query_bits)
+            if hasattr(np, 'bitwise_count'):
+                scores[i] = -np.bitwise_count(differing).sum(axis=1, dtype=np.int32)
+            else:
+                scores[i] = -_POPCOUNT[differing].sum(axis=1, dtype=np.int32)
+        return scores
+    raise ValueError(f"No codes for storage tier {storage!r}")
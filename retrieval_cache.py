@@ -0,0 +1,83 @@
+"""
+retrieval_cache.py: In-memory LRU cache of prompt -> top-k search results for compose.
+- Entries expire after RETRIEVAL_CACHE_TTL seconds.
+- Each entry remembers the vector store version (VectorStore.version()) it was computed under,
+  and is ignored once the store has changed, so re-ingesting never serves stale snippets.
+- Backends that can't report a version are not cached.
+
+Set RETRIEVAL_CACHE_SIZE=0 to disable.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '256'))  # Entries kept
+RETRIEVAL_CACHE_TTL = float(os.getenv('RETRIEVAL_CACHE_TTL', '600'))  # Seconds
+
+def cache_key(prompt, *options):
+    """
+    Key for prompt under the given retrieval options. Prompts that differ only in whitespace share an entry.
+    """
+    return (' '.join(prompt.split()),) + options
+
+class RetrievalCache:
+    """
+    Thread-safe LRU of key -> (version, stored_at, results).
+    """
+
+    def __init__(self, max_entries=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        """
+        Return cached results for key if they were stored under version and haven't expired, else None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or version is None or entry[0] != version \
+                    or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, version, results):
+        if version is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_retrieval_cache():
+    """
+    Return the shared cache, or None if RETRIEVAL_CACHE_SIZE is 0.
+    """
+    global _cache
+    if RETRIEVAL_CACHE_SIZE <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = RetrievalCache()
+        return _cache
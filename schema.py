@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+schema.py: Creates and migrates the blog_style table and its approximate nearest-neighbour index.
+- Embeddings are compared with cosine distance (the <=> operator), so the index uses vector_cosine_ops.
+- HNSW is the default index; IVFFlat is available for very large tables where build time matters more.
+- Per-query search knobs (hnsw.ef_search, ivfflat.probes) are applied with set_search_params().
+- Ingest only creates an index when blog_style has none; dropping or switching one (including
+  `--index none`) is left to `python schema.py migrate`, since rebuilding is slow on large tables.
+- Triggers bump blog_style_version on every write that changes rows, so readers can tell cheaply whether cached results are stale.
+- VECTOR_STORAGE=halfvec|binary indexes a compact expression of emb (halfvec, or binary_quantize
+  with Hamming distance) instead of emb itself; search shortlists with it and re-ranks on the full vectors.
+  emb keeps the full float32 vectors either way. (int8 is local-backend only; pgvector has no int8 type.)
+- emb is declared vector(EMBEDDING_DIMENSIONS). Changing the dimensions needs --reset, which empties
+  the table so the next ingest re-embeds everything at the new size.
+
+Usage:
+
+    python schema.py migrate [--index hnsw|ivfflat|none] [--m 16] [--ef-construction 64] [--lists N] [--rebuild]
+                             [--storage float32|halfvec|binary] [--dimensions N --reset]
+
+Requires: psycopg2, a Postgres database with the pgvector extension
+(0.5.0 or newer for HNSW, 0.7.0 or newer for the halfvec and binary storage tiers)
+"""
+import os
+import math
+import argparse
+from embedder import EMBEDDING_DIMENSIONS
+
+# Load environment variables from .env if present
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+DB_NAME = os.getenv('PGDATABASE', 'henry-pg')
+DB_USER = os.getenv('PGUSER', 'postgres')
+DB_PASSWORD = os.getenv('PGPASSWORD', 'supersecret')
+DB_HOST = os.getenv('PGHOST', 'localhost')
+DB_PORT = os.getenv('PGPORT', '5432')
+
+TABLE_NAME = 'blog_style'
+VERSION_TABLE = f'{TABLE_NAME}_version'
+DISTANCE_OPERATOR = '<=>'  # Cosine distance; must match the index operator class below
+OPERATOR_CLASS = 'vector_cosine_ops'
+INDEX_METHODS = ('hnsw', 'ivfflat')
+PG_STORAGE_TIERS = ('float32', 'halfvec', 'binary')
+
+# Index build settings
+INDEX_METHOD = os.getenv('VECTOR_INDEX', 'hnsw')
+VECTOR_STORAGE = os.getenv('VECTOR_STORAGE', 'float32')  # float32 | halfvec | int8 (local only) | binary
+HNSW_M = int(os.getenv('HNSW_M', '16'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '64'))
+IVFFLAT_LISTS = int(os.getenv('IVFFLAT_LISTS', '0'))  # 0 = pick from the row count
+
+# Per-query search settings (unset = pgvector defaults: ef_search 40, probes 1)
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '0')) or None
+IVFFLAT_PROBES = int(os.getenv('IVFFLAT_PROBES', '0')) or None
+
+# Columns added to tables created before chunk metadata was tracked
+CHUNK_COLUMNS = {'source_file': 'TEXT', 'source_hash': 'TEXT', 'chunk_index': 'INTEGER',
+                 'char_start': 'INTEGER', 'char_end': 'INTEGER'}
+
+NO_INDEX_COMMENT = 'index: none'  # Set on emb by `migrate --index none`
+
+def get_db_connection():
+    import psycopg2
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+def index_name(method, storage='float32'):
+    if storage == 'float32':
+        return f"{TABLE_NAME}_emb_{method}_idx"
+    return f"{TABLE_NAME}_emb_{storage}_{method}_idx"
+
+def storage_index(storage, dimensions=EMBEDDING_DIMENSIONS, column='emb'):
+    """
+    Return (expression, operator class, distance operator) searched for a storage tier.
+    Queries must repeat the expression exactly for the planner to use its index.
+    """
+    if storage == 'float32':
+        return column, OPERATOR_CLASS, DISTANCE_OPERATOR
+    if storage == 'halfvec':
+        return f"({column}::halfvec({int(dimensions)}))", 'halfvec_cosine_ops', '<=>'
+    if storage == 'binary':
+        return f"(binary_quantize({column})::bit({int(dimensions)}))", 'bit_hamming_ops', '<~>'
+    if storage == 'int8':
+        raise ValueError("VECTOR_STORAGE=int8 is only supported by the local backend; "
+                         "use halfvec or binary with pgvector")
+    raise ValueError(f"Unknown VECTOR_STORAGE {storage!r}; expected one of {PG_STORAGE_TIERS}")
+
+def check_storage_support(cur, storage):
+    """
+    halfvec and bit indexes arrived in pgvector 0.7.0; fail clearly on older installs.
+    """
+    if storage == 'float32':
+        return
+    cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    version = cur.fetchone()[0]
+    if tuple(int(part) for part in version.split('.')[:2]) < (0, 7):
+        raise RuntimeError(f"VECTOR_STORAGE={storage} needs pgvector 0.7.0 or newer (installed: {version}). "
+                           f"Upgrade the extension (ALTER EXTENSION vector UPDATE) or use VECTOR_STORAGE=float32.")
+
+def column_dimensions(cur):
+    """
+    The declared dimension of emb, or None for a bare vector column.
+    """
+    cur.execute(
+        """
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attname = 'emb'
+        """,
+        (TABLE_NAME,)
+    )
+    typmod = cur.fetchone()[0]
+    return typmod if typmod > 0 else None
+
+def ensure_schema(conn, dimensions=EMBEDDING_DIMENSIONS, reset=False):
+    """
+    Create blog_style if needed, and bring an existing table up to date:
+    chunk metadata columns, a fixed-dimension emb column, and the (source_file, chunk_index) key.
+    A table declared with other dimensions is an error unless reset is set, which empties it
+    and redeclares emb so the next ingest re-embeds every source.
+    """
+    with conn.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                txt TEXT NOT NULL,
+                emb vector({dimensions}) NOT NULL
+            )
+            """
+        )
+        cur.execute("SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 "
+                    "AND NOT attisdropped", (TABLE_NAME,))
+        columns = {row[0] for row in cur.fetchall()}
+        missing = [column for column in CHUNK_COLUMNS if column not in columns]
+        if missing:
+            cur.execute(f"ALTER TABLE {TABLE_NAME} "
+                        + ', '.join(f"ADD COLUMN {column} {CHUNK_COLUMNS[column]}" for column in missing))
+        if 'source_hash' in missing:
+            # Rows written before source hashes were tracked can't be matched to a
+            # version of their source file; drop them so the next ingest re-embeds them once.
+            cur.execute(f"DELETE FROM {TABLE_NAME} WHERE source_hash IS NULL")
+        cur.execute(
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS {TABLE_NAME}_source_chunk_idx
+            ON {TABLE_NAME} (source_file, chunk_index)
+            """
+        )
+        # Vector indexes need a declared dimension; older tables used a bare vector column
+        declared = column_dimensions(cur)
+        if declared is None:
+            cur.execute(f"ALTER TABLE {TABLE_NAME} ALTER COLUMN emb TYPE vector({dimensions})")
+        elif declared != dimensions:
+            if not reset:
+                raise RuntimeError(f"{TABLE_NAME}.emb holds {declared}-dimension embeddings but EMBEDDING_DIMENSIONS "
+                                   f"is {dimensions}. Run `python schema.py migrate --dimensions {dimensions} --reset` "
+                                   f"to empty the table, then ingest again.")
+            print(f"Resetting {TABLE_NAME}: {declared} -> {dimensions} dimensions")
+            # Indexes on emb (and expressions of it) can't survive the type change
+            for method in INDEX_METHODS:
+                for storage in PG_STORAGE_TIERS:
+                    cur.execute(f"DROP INDEX IF EXISTS {index_name(method, storage)}")
+            cur.execute(f"TRUNCATE {TABLE_NAME}")
+            cur.execute(f"ALTER TABLE {TABLE_NAME} ALTER COLUMN emb TYPE vector({dimensions})")
+        ensure_version_counter(cur)
+    conn.commit()
+
+# Trigger name -> (event, transition table). Transition tables allow one event per trigger.
+VERSION_TRIGGERS = {
+    f'{VERSION_TABLE}_insert': ('INSERT', 'NEW TABLE'),
+    f'{VERSION_TABLE}_update': ('UPDATE', 'NEW TABLE'),
+    f'{VERSION_TABLE}_delete': ('DELETE', 'OLD TABLE'),
+    f'{VERSION_TABLE}_truncate': ('TRUNCATE', None),
+}
+
+def ensure_version_counter(cur):
+    """
+    Keep a one-row counter that every INSERT, UPDATE, or DELETE that changes rows in blog_style
+    (and every TRUNCATE) increments. The bump commits with the write itself, so a reader never sees
+    new rows under an old version. Triggers are only created when missing: CREATE and DROP TRIGGER
+    lock the table against readers.
+    """
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL
+        )
+        """
+    )
+    cur.execute(f"INSERT INTO {VERSION_TABLE} (id, version) VALUES (TRUE, 0) ON CONFLICT DO NOTHING")
+    cur.execute("SELECT tgname FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal", (TABLE_NAME,))
+    existing = {row[0] for row in cur.fetchall()}
+    missing = [name for name in VERSION_TRIGGERS if name not in existing]
+    if not missing:
+        return
+    # Statement triggers fire even when no row matched, so row writes only bump if rows changed
+    cur.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION {VERSION_TABLE}_bump_rows() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM changed) THEN
+                UPDATE {VERSION_TABLE} SET version = version + 1;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION {VERSION_TABLE}_bump() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE {VERSION_TABLE} SET version = version + 1;
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    if f'{VERSION_TABLE}_trigger' in existing:
+        # Replaced by the per-event triggers below
+        cur.execute(f"DROP TRIGGER {VERSION_TABLE}_trigger ON {TABLE_NAME}")
+    for name in missing:
+        event, transition = VERSION_TRIGGERS[name]
+        referencing = f"REFERENCING {transition} AS changed" if transition else ""
+        function = f"{VERSION_TABLE}_bump_rows" if transition else f"{VERSION_TABLE}_bump"
+        cur.execute(
+            f"""
+            CREATE TRIGGER {name} AFTER {event} ON {TABLE_NAME} {referencing}
+            FOR EACH STATEMENT EXECUTE FUNCTION {function}()
+            """
+        )
+
+def default_ivfflat_lists(row_count):
+    """
+    pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond that.
+    """
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+def create_index(conn, method=INDEX_METHOD, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION,
+                 lists=IVFFLAT_LISTS, rebuild=False, storage=VECTOR_STORAGE, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Create the index for the storage tier on emb and drop indexes built with another method or tier.
+    Existing indexes are kept unless rebuild is set, since building is slow on large tables.
+    """
+    if method not in INDEX_METHODS + ('none',):
+        raise ValueError(f"Unknown index method {method!r}; expected one of {INDEX_METHODS + ('none',)}")
+    expression, operator_class, _ = storage_index(storage, dimensions)
+    with conn.cursor() as cur:
+        check_storage_support(cur, storage)
+        for other in INDEX_METHODS:
+            for other_storage in PG_STORAGE_TIERS:
+                if other != method or other_storage != storage or rebuild:
+                    cur.execute(f"DROP INDEX IF EXISTS {index_name(other, other_storage)}")
+        # Remembered so ingest doesn't build an index the user chose not to have
+        cur.execute(f"COMMENT ON COLUMN {TABLE_NAME}.emb IS %s", (NO_INDEX_COMMENT if method == 'none' else None,))
+        if method == 'hnsw':
+            print(f"Creating {storage} HNSW index (m={m}, ef_construction={ef_construction}) if missing...")
+            cur.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS {index_name(method, storage)} ON {TABLE_NAME}
+                USING hnsw ({expression} {operator_class}) WITH (m = {int(m)}, ef_construction = {int(ef_construction)})
+                """
+            )
+        elif method == 'ivfflat':
+            # IVFFlat picks its list centroids from the rows present at build time
+            cur.execute(f"SELECT count(*) FROM {TABLE_NAME}")
+            row_count = cur.fetchone()[0]
+            if row_count == 0:
+                print("Skipping IVFFlat index: table is empty. Run migrate again after ingesting.")
+            else:
+                lists = lists or default_ivfflat_lists(row_count)
+                print(f"Creating {storage} IVFFlat index (lists={lists}) if missing...")
+                cur.execute(
+                    f"""
+                    CREATE INDEX IF NOT EXISTS {index_name(method, storage)} ON {TABLE_NAME}
+                    USING ivfflat ({expression} {operator_class}) WITH (lists = {int(lists)})
+                    """
+                )
+    conn.commit()
+
+def vector_indexes(cur):
+    """
+    Names of the vector indexes that exist on blog_style.
+    """
+    names = [index_name(method, storage) for method in INDEX_METHODS for storage in PG_STORAGE_TIERS]
+    cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname = ANY(%s)", (TABLE_NAME, names))
+    return [row[0] for row in cur.fetchall()]
+
+def ensure_index(conn, method=INDEX_METHOD, storage=VECTOR_STORAGE, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Create the default index only when blog_style has no vector index and `migrate --index none` wasn't run.
+    An existing index is never dropped or replaced here, whatever its method or storage tier.
+    """
+    with conn.cursor() as cur:
+        existing = vector_indexes(cur)
+        cur.execute("SELECT col_description(%s::regclass, attnum) FROM pg_attribute "
+                    "WHERE attrelid = %s::regclass AND attname = 'emb'", (TABLE_NAME, TABLE_NAME))
+        no_index = cur.fetchone()[0] == NO_INDEX_COMMENT
+    if existing:
+        if index_name(method, storage) not in existing and storage != 'float32':
+            print(f"Note: {TABLE_NAME} is indexed by {', '.join(existing)}; run "
+                  f"`python schema.py migrate --storage {storage}` to index the {storage} tier.")
+        return
+    if not no_index:
+        create_index(conn, method, storage=storage, dimensions=dimensions)
+
+def migrate(conn, method=INDEX_METHOD, storage=VECTOR_STORAGE, dimensions=EMBEDDING_DIMENSIONS, reset=False,
+            **index_options):
+    ensure_schema(conn, dimensions, reset)
+    create_index(conn, method, storage=storage, dimensions=dimensions, **index_options)
+
+def set_search_params(cur, ef_search=HNSW_EF_SEARCH, probes=IVFFLAT_PROBES):
+    """
+    Apply per-query index settings for the current transaction only.
+    """
+    if ef_search:
+        cur.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+    if probes:
+        cur.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or migrate the blog_style table and vector index.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="Create the table and index if missing")
+    migrate_parser.add_argument('--index', choices=INDEX_METHODS + ('none',), default=INDEX_METHOD)
+    migrate_parser.add_argument('--m', type=int, default=HNSW_M, help="HNSW: links per node")
+    migrate_parser.add_argument('--ef-construction', type=int, default=HNSW_EF_CONSTRUCTION,
+                                help="HNSW: candidate list size while building")
+    migrate_parser.add_argument('--lists', type=int, default=IVFFLAT_LISTS,
+                                help="IVFFlat: number of lists (0 = pick from row count)")
+    migrate_parser.add_argument('--rebuild', action='store_true', help="Drop and rebuild an existing index")
+    migrate_parser.add_argument('--storage', choices=PG_STORAGE_TIERS, default=VECTOR_STORAGE,
+                                help="Representation the index searches; emb always keeps full vectors")
+    migrate_parser.add_argument('--dimensions', type=int, default=EMBEDDING_DIMENSIONS,
+                                help="Declared size of emb (must match EMBEDDING_DIMENSIONS at ingest)")
+    migrate_parser.add_argument('--reset', action='store_true',
+                                help="Empty the table if its dimensions differ, so everything is re-embedded")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        migrate(conn, args.index, args.storage, args.dimensions, args.reset, m=args.m,
+                ef_construction=args.ef_construction, lists=args.lists, rebuild=args.rebuild)
+    finally:
+        conn.close()
+    print("Done.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+tracing.py: Lightweight per-run timing, token, and cost instrumentation.
+- span(name, **labels) times a block (an API call, a DB query, a file stage).
+- count(name, value, **labels) bumps a counter (requests, cache hits, retries, ...).
+- record_usage(model, usage) counts an OpenAI response's tokens and estimated cost.
+
+Off unless TRACING=1. When off, span() hands back a shared no-op context manager and count()
+returns at once, so the instrumented code pays one function call per site.
+When on, a summary is written at exit as JSON (TRACE_DIR/<script>-<timestamp>.json) and as a
+Prometheus textfile (TRACE_PROM, default TRACE_DIR/<script>.prom) for node_exporter's textfile collector.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import tempfile
+import threading
+
+TRACING = os.getenv('TRACING', '0').lower() not in ('', '0', 'false', 'no')
+TRACE_DIR = os.getenv('TRACE_DIR', 'traces')
+TRACE_PROM = os.getenv('TRACE_PROM')
+METRIC_PREFIX = 'blog_style'
+
+# USD per 1M tokens as (input, output); used for cost estimates only
+PRICES = {
+    'text-embedding-3-small': (0.02, 0.0),
+    'text-embedding-3-large': (0.13, 0.0),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-3.5-turbo': (0.50, 1.50),
+}
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class Tracer:
+    """
+    Aggregates spans and counters for one run. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.spans = {}  # (name, labels) -> [count, total seconds, max seconds, errors]
+        self.counters = {}  # (name, labels) -> value
+
+    def add_span(self, key, elapsed, failed):
+        with self._lock:
+            entry = self.spans.get(key)
+            if entry is None:
+                entry = self.spans[key] = [0, 0.0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+            entry[3] += failed
+
+    def add(self, key, value):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self):
+        with self._lock:
+            spans = sorted(self.spans.items())
+            counters = sorted(self.counters.items())
+        return {
+            'script': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python',
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started)),
+            'wall_seconds': time.time() - self.started,
+            'spans': [
+                {'name': name, 'labels': dict(labels), 'count': count, 'total_s': total,
+                 'mean_s': total / count, 'max_s': longest, 'errors': errors}
+                for (name, labels), (count, total, longest, errors) in spans
+            ],
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in counters],
+        }
+
+class _Span:
+    __slots__ = ('key', 'start')
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _tracer.add_span(self.key, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+_tracer = Tracer() if TRACING else None
+
+def _key(name, labels):
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+def span(name, **labels):
+    """
+    Time the enclosed block under name and labels. Exceptions are counted as errors and re-raised.
+    """
+    if _tracer is None:
+        return _NOOP_SPAN
+    return _Span(_key(name, labels))
+
+def observe(name, seconds, **labels):
+    """
+    Record a duration measured elsewhere (e.g. time to first token) as a span.
+    """
+    if _tracer is None:
+        return
+    _tracer.add_span(_key(name, labels), seconds, False)
+
+def count(name, value=1, **labels):
+    if _tracer is None or not value:
+        return
+    _tracer.add(_key(name, labels), value)
+
+def record_usage(model, usage):
+    """
+    Count prompt/completion tokens and estimated cost from an OpenAI usage object (or dict).
+    """
+    if _tracer is None or usage is None:
+        return
+    if isinstance(usage, dict):
+        prompt = usage.get('prompt_tokens') or 0
+        completion = usage.get('completion_tokens') or 0
+    else:
+        prompt = getattr(usage, 'prompt_tokens', 0) or 0
+        completion = getattr(usage, 'completion_tokens', 0) or 0
+    count('openai_tokens', prompt, model=model, kind='prompt')
+    count('openai_tokens', completion, model=model, kind='completion')
+    input_price, output_price = PRICES.get(model, (0.0, 0.0))
+    count('openai_cost_usd', (prompt * input_price + completion * output_price) / 1e6, model=model)
+
+def summary():
+    return _tracer.summary() if _tracer else None
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + '}'
+
+def prometheus_text(data):
+    """
+    Render a summary() in the Prometheus text exposition format.
+    """
+    script = {'script': data['script']}
+    lines = [
+        f"# TYPE {METRIC_PREFIX}_run_seconds gauge",
+        f"{METRIC_PREFIX}_run_seconds{_prometheus_labels(script)} {data['wall_seconds']:.6f}",
+    ]
+    metrics = (('span_seconds_total', 'total_s'), ('span_count_total', 'count'),
+               ('span_max_seconds', 'max_s'), ('span_errors_total', 'errors'))
+    for suffix, field in metrics:
+        lines.append(f"# TYPE {METRIC_PREFIX}_{suffix} {'gauge' if suffix.endswith('max_seconds') else 'counter'}")
+        for entry in data['spans']:
+            labels = dict(script, span=entry['name'], **entry['labels'])
+            lines.append(f"{METRIC_PREFIX}_{suffix}{_prometheus_labels(labels)} {entry[field]}")
+    names = sorted({entry['name'] for entry in data['counters']})
+    for name in names:
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+        for entry in data['counters']:
+            if entry['name'] == name:
+                labels = dict(script, **entry['labels'])
+                lines.append(f"{METRIC_PREFIX}_{name}_total{_prometheus_labels(labels)} {entry['value']}")
+    return '\n'.join(lines) + '\n'
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def export(json_path=None, prom_path=TRACE_PROM):
+    """
+    Write the run summary as JSON and as a Prometheus textfile. Returns the JSON path, or None when tracing is off.
+    """
+    data = summary()
+    if data is None:
+        return None
+    name = os.path.splitext(data['script'])[0]
+    json_path = json_path or os.path.join(TRACE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    _write_atomic(json_path, json.dumps(data, indent=2))
+    _write_atomic(prom_path or os.path.join(TRACE_DIR, f"{name}.prom"), prometheus_text(data))
+    return json_path
+
+def _export_at_exit():
+    try:
+        path = export()
+        print(f"Trace summary written to {path}", file=sys.stderr)
+    except Exception as e:
+        print(f"Could not write trace summary: {e}", file=sys.stderr)
+
+if TRACING:
+    atexit.register(_export_at_exit)
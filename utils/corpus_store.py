@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Single-file store for processed documents, replacing one pretty-printed JSON file per post.
+Documents live in a SQLite table keyed by document id (the source filename without .txt),
+so they can be fetched individually or streamed without loading the whole corpus.
+
+To convert an existing processed_corpus/*.json layout, run from the project root:
+
+    python utils/corpus_store.py convert [--remove]
+
+This also happens automatically the first time an empty store is opened next to legacy JSON files.
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from typing import Iterator, Optional
+
+OUTPUT_DIR = 'processed_corpus'
+CORPUS_STORE_PATH = os.getenv('CORPUS_STORE_PATH', os.path.join(OUTPUT_DIR, 'corpus.sqlite'))
+FIELDS = ('id', 'filename', 'title', 'text', 'source_hash')
+
+def doc_id_for(filename: str) -> str:
+    return os.path.splitext(filename)[0]
+
+class CorpusStore:
+    """
+    SQLite-backed document store. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = CORPUS_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                title TEXT,
+                text TEXT NOT NULL,
+                source_hash TEXT
+            )
+            """
+        )
+        self._conn.commit()
+
+    def put(self, doc: dict) -> None:
+        """
+        Insert or replace a document. doc needs 'filename' and 'text'; 'id' defaults from the filename.
+        """
+        row = (doc.get('id') or doc_id_for(doc['filename']), doc['filename'], doc.get('title'),
+               doc['text'], doc.get('source_hash'))
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO documents (id, filename, title, text, source_hash) VALUES (?, ?, ?, ?, ?)',
+                row
+            )
+
+    def put_many(self, docs) -> None:
+        rows = [(doc.get('id') or doc_id_for(doc['filename']), doc['filename'], doc.get('title'),
+                 doc['text'], doc.get('source_hash')) for doc in docs]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO documents (id, filename, title, text, source_hash) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def get(self, doc_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {", ".join(FIELDS)} FROM documents WHERE id = ?', (doc_id,)
+            ).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    def get_source_hash(self, doc_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute('SELECT source_hash FROM documents WHERE id = ?', (doc_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, doc_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+
+    def ids(self) -> set:
+        with self._lock:
+            return {row[0] for row in self._conn.execute('SELECT id FROM documents')}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def iter_documents(self, fields=FIELDS, batch_size: int = 256) -> Iterator[dict]:
+        """
+        Stream documents in id order, holding at most batch_size of them in memory.
+        Leave 'text' out of fields to scan metadata without reading document bodies.
+        """
+        last_id = ''
+        columns = list(dict.fromkeys(('id',) + tuple(fields)))
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f'SELECT {", ".join(columns)} FROM documents WHERE id > ? ORDER BY id LIMIT ?',
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(columns, row))
+            last_id = rows[-1][0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+def convert_directory(json_dir: str, store: CorpusStore, remove: bool = False) -> int:
+    """
+    Load every *.json document in json_dir into store. Returns the number converted.
+    """
+    docs = []
+    converted = 0
+    imported_files = []
+    for filename in sorted(os.listdir(json_dir)):
+        if not filename.endswith('.json'):
+            continue
+        json_path = os.path.join(json_dir, filename)
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                doc = json.load(f)
+        except Exception as e:
+            print(f"Error reading {filename}: {e}")
+            continue
+        doc['id'] = doc_id_for(filename)
+        doc.setdefault('filename', doc['id'] + '.txt')
+        doc.setdefault('text', '')
+        docs.append(doc)
+        imported_files.append(json_path)
+        if len(docs) >= 500:
+            store.put_many(docs)
+            converted += len(docs)
+            docs = []
+    store.put_many(docs)
+    converted += len(docs)
+    if remove:
+        for json_path in imported_files:
+            os.remove(json_path)
+    return converted
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_corpus_store() -> CorpusStore:
+    """
+    Return the shared store, importing legacy processed_corpus/*.json files the first time it is empty.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CorpusStore()
+            if len(_store) == 0 and os.path.isdir(OUTPUT_DIR) and \
+                    any(f.endswith('.json') for f in os.listdir(OUTPUT_DIR)):
+                converted = convert_directory(OUTPUT_DIR, _store)
+                print(f"Imported {converted} processed documents from {OUTPUT_DIR}/*.json into {_store.path}")
+    return _store
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the processed corpus store.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help="Import processed_corpus/*.json into the store")
+    convert_parser.add_argument('--dir', default=OUTPUT_DIR, help="Directory of processed JSON files")
+    convert_parser.add_argument('--remove', action='store_true', help="Delete the JSON files after importing")
+    args = parser.parse_args()
+
+    store = CorpusStore()
+    converted = convert_directory(args.dir, store, args.remove)
+    print(f"Converted {converted} documents into {store.path} ({len(store)} total)")
+    store.close()
+
+if __name__ == '__main__':
+    main()
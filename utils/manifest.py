@@ -0,0 +1,80 @@
+"""
+Stat-based change manifest for the corpus.
+Records each source file's size, mtime_ns, and SHA-256 in one JSON file, so a file
+whose size and mtime haven't changed can be skipped without reading it.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+OUTPUT_DIR = 'processed_corpus'
+# No .json extension, so it isn't mistaken for a processed document
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, '.manifest')
+
+def read_and_hash(filepath: str) -> Tuple[str, str, os.stat_result]:
+    """
+    Read a file once and return its text, its SHA-256, and the stat it was read under.
+    """
+    with open(filepath, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    # hashlib releases the GIL on large buffers, so this runs in parallel across threads
+    return data.decode('utf-8'), hashlib.sha256(data).hexdigest(), stat
+
+class Manifest:
+    """
+    Maps source filename -> {'size', 'mtime_ns', 'hash'}. Safe to update from several threads.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def is_unchanged(self, filename: str, stat: os.stat_result) -> bool:
+        """
+        True if the file has the size and mtime recorded when it was last processed.
+        """
+        entry = self.entries.get(filename)
+        return bool(entry) and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+    def get_hash(self, filename: str) -> Optional[str]:
+        entry = self.entries.get(filename)
+        return entry['hash'] if entry else None
+
+    def update(self, filename: str, stat: os.stat_result, source_hash: str) -> None:
+        with self._lock:
+            self.entries[filename] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'hash': source_hash
+            }
+
+    def remove(self, filename: str) -> None:
+        with self._lock:
+            self.entries.pop(filename, None)
+
+    def save(self) -> None:
+        """
+        Write the manifest atomically.
+        """
+        with self._lock:
+            entries = dict(self.entries)
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+End-to-end test for batch_mode.py against benchmarks/fake_openai.py, with injected request failures.
+Runs prepare, submit, poll and merge in a scratch directory, resuming until the run completes, and checks
+that the vector store ends up holding exactly the documents in the corpus store.
+"""
+
+import os
+import sys
+import re
+import random
+import shutil
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'utils'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from fake_openai import start_server
+from corpus_store import CorpusStore
+from local_vector_store import LocalVectorStore
+
+MAX_RUNS = 20
+
+def write_corpus(corpus_dir, rng, names):
+    for name in names:
+        paragraphs = [' '.join(rng.choice(['alpha', 'beta', 'gamma', 'delta', 'omega', 'sigma'])
+                               for _ in range(rng.randint(40, 120))) + '.' for _ in range(rng.randint(1, 6))]
+        with open(os.path.join(corpus_dir, name), 'w', encoding='utf-8') as f:
+            f.write('\n\n'.join(paragraphs))
+
+def run_until_complete(workdir, env, removed=0):
+    """
+    Rerun batch_mode.py until a run finishes with nothing left undone. The first run doesn't wait,
+    so the next one resumes from the saved state. Exactly removed documents may be deleted from the
+    vector store along the way; nothing is uploaded only to be deleted again.
+    """
+    script = os.path.join(ROOT, 'batch_mode.py')
+    for run in range(MAX_RUNS):
+        args = [sys.executable, script] + (['--no-wait'] if run == 0 else [])
+        result = subprocess.run(args, cwd=workdir, env=env, capture_output=True, text=True)
+        assert 'Traceback' not in result.stderr, result.stderr
+        removed -= sum(int(count) for count in re.findall(r"Removed (\d+) documents", result.stdout))
+        assert removed >= 0, result.stdout
+        if result.returncode == 0 and not os.path.exists(os.path.join(workdir, 'batch_work', 'state.json')):
+            assert removed == 0, f"{removed} deleted documents left in the vector store"
+            return
+    assert False, f"Batch run still unfinished after {MAX_RUNS} reruns"
+
+def check_stores(workdir):
+    corpus = CorpusStore(os.path.join(workdir, 'processed_corpus', 'corpus.sqlite'))
+    store = LocalVectorStore(os.path.join(workdir, 'vector_store'))
+    try:
+        expected = {doc['filename']: doc['source_hash'] for doc in corpus.iter_documents()}
+        assert expected and all(doc['title'] for doc in corpus.iter_documents())
+        assert store.source_hashes() == expected
+        files = {name for name in os.listdir(os.path.join(workdir, 'corpus'))}
+        assert set(expected) == files
+    finally:
+        store.close()
+        corpus.close()
+
+def test_batch_run_with_failures_matches_corpus():
+    server, base_url = start_server(batch_latency=0.05, batch_failure=0.3, seed=1)
+    workdir = tempfile.mkdtemp(prefix='test_batch_mode_')
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY='fake', VECTOR_BACKEND='local',
+               BATCH_POLL_SECONDS='0.05', BATCH_MAX_REQUESTS='4',
+               # A cache too small to hold a run's embeddings, so the upload can't lean on it
+               EMBEDDING_CACHE_MAX_ENTRIES='2')
+    try:
+        rng = random.Random(0)
+        corpus_dir = os.path.join(workdir, 'corpus')
+        os.makedirs(corpus_dir)
+        write_corpus(corpus_dir, rng, [f"post_{i:02d}.txt" for i in range(12)])
+        run_until_complete(workdir, env)
+        check_stores(workdir)
+
+        # A second load: one new, one edited and one deleted file
+        write_corpus(corpus_dir, rng, ['post_00.txt', 'post_new.txt'])
+        os.remove(os.path.join(corpus_dir, 'post_05.txt'))
+        run_until_complete(workdir, env, removed=1)
+        check_stores(workdir)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_batch_run_with_failures_matches_corpus()
+    print("All batch mode tests passed.")
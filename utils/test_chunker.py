@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests that chunker.py keeps chunks within CHUNK_SIZE, repeats at most CHUNK_OVERLAP characters,
+and covers all of the text, including paragraphs that have to be hard split.
+"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunker import iter_chunks
+
+def sentence(rng):
+    return ' '.join(rng.choice(['alpha', 'beta', 'gamma', 'delta', 'epsilon']) for _ in range(rng.randint(4, 30))) + '.'
+
+def prose(rng, paragraphs=30):
+    return '\n\n'.join(' '.join(sentence(rng) for _ in range(rng.randint(1, 12))) for _ in range(paragraphs))
+
+def check_chunks(text, size, overlap):
+    chunks = list(iter_chunks(text, size, overlap))
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+    covered = [False] * len(text)
+    for previous, chunk in zip([None] + chunks, chunks):
+        assert chunk.text == text[chunk.start:chunk.end]
+        assert 0 < len(chunk.text) <= size
+        assert chunk.text == chunk.text.strip()
+        if previous is not None:
+            assert chunk.start > previous.start
+            assert chunk.start >= previous.end - overlap  # Repeats at most overlap characters
+        for i in range(chunk.start, chunk.end):
+            covered[i] = True
+    assert all(covered[i] for i, char in enumerate(text) if not char.isspace())
+    return chunks
+
+def test_sizes_and_overlap_within_limits():
+    rng = random.Random(0)
+    text = prose(rng)
+    for size, overlap in ((1500, 200), (400, 100), (200, 0)):
+        chunks = check_chunks(text, size, overlap)
+        assert len(chunks) > 1
+
+def test_overlap_repeats_trailing_text():
+    rng = random.Random(1)
+    text = '\n\n'.join(sentence(rng) for _ in range(60))
+    chunks = check_chunks(text, 300, 100)
+    assert any(chunk.start < previous.end for previous, chunk in zip(chunks, chunks[1:]))
+
+def test_hard_split_long_sentence():
+    """
+    A paragraph with no sentence breaks is cut at whitespace near the limit.
+    """
+    text = ' '.join(['word'] * 1000)
+    chunks = check_chunks(text, 500, 50)
+    assert all(chunk.text.startswith('word') and chunk.text.endswith('word') for chunk in chunks)
+
+def test_hard_split_without_whitespace():
+    """
+    Text with no whitespace at all is cut at exactly the limit.
+    """
+    text = 'x' * 1234
+    chunks = check_chunks(text, 500, 50)
+    assert [len(chunk.text) for chunk in chunks] == [500, 500, 234]
+
+def test_empty_text():
+    assert list(iter_chunks('')) == []
+    assert list(iter_chunks(' \n\n \t')) == []
+
+if __name__ == '__main__':
+    test_sizes_and_overlap_within_limits()
+    test_overlap_repeats_trailing_text()
+    test_hard_split_long_sentence()
+    test_hard_split_without_whitespace()
+    test_empty_text()
+    print("All chunker tests passed.")
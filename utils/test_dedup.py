@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Tests for near-duplicate detection in dedup.py, on generated texts with no cache or corpus store.
+"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunker import iter_chunks
+from dedup import DedupIndex, build_plan, minhash, drop_chunks
+
+VOCABULARY = [f"w{i}" for i in range(2000)]
+
+def paragraph(rng, words=250):
+    """
+    About 1300 characters, so each paragraph is a chunk of its own.
+    """
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(words)) + '.'
+
+def document(rng, paragraphs=3):
+    return '\n\n'.join(paragraph(rng) for _ in range(paragraphs))
+
+def edit(text, rng, changes):
+    words = text.split(' ')
+    for i in rng.sample(range(len(words)), changes):
+        words[i] = 'edited'
+    return ' '.join(words)
+
+def plan_for(texts, keep='name', mtimes=None, threshold=0.8):
+    docs = [{'filename': name, 'source_hash': name, 'text': text, 'mtime_ns': (mtimes or {}).get(name, 0)}
+            for name, text in texts.items()]
+    return build_plan(docs, lambda doc: doc['text'], threshold=threshold, keep=keep)
+
+def test_minhash_estimates_similarity():
+    rng = random.Random(0)
+    text = document(rng)
+    assert (minhash(text) == minhash(text)).all()
+    assert (minhash(text) == minhash(edit(text, rng, 5))).mean() > 0.8
+    assert (minhash(text) == minhash(document(rng))).mean() < 0.2
+
+def test_near_copy_collapsed_but_unrelated_kept():
+    rng = random.Random(1)
+    original = document(rng)
+    texts = {'a.txt': original, 'b_copy.txt': edit(original, rng, 5), 'c.txt': document(rng)}
+    plan = plan_for(texts)
+    assert plan.documents == 3
+    assert set(plan.duplicates) == {'b_copy.txt'}
+    kept, similarity = plan.duplicates['b_copy.txt']
+    assert kept == 'a.txt' and 0.8 <= similarity <= 1.0
+    assert not plan.is_duplicate('c.txt')
+    report = plan.report()
+    assert report['duplicate_documents'] == 1
+    assert report['document_clusters'][0]['kept'] == 'a.txt'
+
+def test_threshold_controls_collapse():
+    rng = random.Random(2)
+    original = document(rng)
+    texts = {'a.txt': original, 'b.txt': edit(original, rng, 60)}
+    assert not plan_for(texts, threshold=0.95).duplicates
+    assert plan_for(texts, threshold=0.3).duplicates
+
+def test_keep_policy():
+    rng = random.Random(3)
+    draft = document(rng)
+    texts = {'a_draft.txt': draft, 'b_final.txt': edit(draft, rng, 5)}
+    mtimes = {'a_draft.txt': 1, 'b_final.txt': 2}
+    assert set(plan_for(texts, 'newest', mtimes).duplicates) == {'a_draft.txt'}
+    assert set(plan_for(texts, 'oldest', mtimes).duplicates) == {'b_final.txt'}
+    assert set(plan_for(texts, 'name', mtimes).duplicates) == {'b_final.txt'}
+
+def test_repeated_chunk_dropped_and_rest_renumbered():
+    rng = random.Random(4)
+    shared = paragraph(rng)
+    texts = {'a.txt': '\n\n'.join([paragraph(rng), shared]),
+             'b.txt': '\n\n'.join([paragraph(rng), shared, paragraph(rng), paragraph(rng)])}
+    plan = plan_for(texts)
+    assert not plan.duplicates
+    assert plan.dropped_chunks('b.txt') == [1]
+    assert plan.dropped['b.txt'][1][0] == ('a.txt', 1)
+    assert plan.digest('b.txt') and plan.digest('a.txt') == ''
+
+    rows = [(chunk.text, 'b.txt', 'hash', chunk.index, chunk.start, chunk.end)
+            for chunk in iter_chunks(texts['b.txt'])]
+    assert len(rows) == 4
+    kept = plan.filter_rows(rows)
+    assert [row[3] for row in kept] == [0, 1, 2]
+    assert [row[0] for row in kept] == [rows[0][0], rows[2][0], rows[3][0]]
+    assert kept[1][4:] == rows[2][4:]  # Character offsets still point into the source
+    assert drop_chunks(rows, []) == rows
+
+def plan_state(plan):
+    return ({name: kept for name, (kept, _) in plan.duplicates.items()},
+            {name: sorted(dropped) for name, dropped in plan.dropped.items()}, plan.documents, plan.chunks)
+
+def test_incremental_index_matches_full_plan():
+    """
+    Random adds, edits, copies, and deletes applied to one DedupIndex give the same plan as planning from scratch.
+    """
+    rng = random.Random(5)
+    shared = [paragraph(rng) for _ in range(6)]
+    for keep in ('name', 'newest', 'oldest'):
+        index, docs = DedupIndex(keep=keep), {}
+        for step in range(30):
+            before = {name: (index.plan.is_duplicate(name), index.plan.dropped_chunks(name)) for name in docs}
+            if docs and rng.random() < 0.2:
+                gone = rng.sample(sorted(docs), min(2, len(docs)))
+                for name in gone:
+                    del docs[name]
+                changed = index.remove(gone)
+            else:
+                batch = []
+                for _ in range(rng.randint(1, 3)):
+                    name = f"d{rng.randint(0, 10)}.txt"
+                    if docs and rng.random() < 0.3:
+                        text = edit(rng.choice(list(docs.values()))['text'], rng, 3)
+                    else:
+                        text = '\n\n'.join(rng.choice(shared) if rng.random() < 0.5 else paragraph(rng)
+                                            for _ in range(rng.randint(1, 4)))
+                    docs[name] = {'filename': name, 'source_hash': str(hash(text)), 'text': text,
+                                  'mtime_ns': step * 10 + len(batch)}
+                    batch.append(dict(docs[name]))
+                changed = index.update(batch, lambda doc: doc['text'])
+            full = build_plan([dict(doc) for doc in docs.values()], lambda doc: doc['text'], keep=keep)
+            assert plan_state(index.plan) == plan_state(full), (keep, step)
+            for name in docs:
+                if (index.plan.is_duplicate(name), index.plan.dropped_chunks(name)) != before.get(name, (False, [])):
+                    assert name in changed, (keep, step, name)
+
+if __name__ == '__main__':
+    test_minhash_estimates_similarity()
+    test_near_copy_collapsed_but_unrelated_kept()
+    test_threshold_controls_collapse()
+    test_keep_policy()
+    test_repeated_chunk_dropped_and_rest_renumbered()
+    test_incremental_index_matches_full_plan()
+    print("All dedup tests passed.")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for the binary COPY payload in pg_copy.py, checked byte for byte against the documented
+PGCOPY layout and pgvector's binary vector format, so no database is needed.
+"""
+
+import os
+import sys
+import struct
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pg_copy import COPY_COLUMNS, binary_payload, encode_vector
+
+VECTOR = [1.0, -2.5, 0.1, 3.0e-8]
+
+def test_encode_vector_layout():
+    """
+    int16 dimensions, int16 unused (0), then big-endian float4s.
+    """
+    data = encode_vector(VECTOR)
+    assert len(data) == 4 + 4 * len(VECTOR)
+    assert data[:4] == b'\x00\x04\x00\x00'
+    assert data[4:8] == b'\x3f\x80\x00\x00'  # 1.0 as a big-endian float4
+    assert struct.unpack('!4f', data[4:]) == struct.unpack('4f', struct.pack('4f', *VECTOR))
+
+def test_binary_payload_round_trip():
+    """
+    Header, one tuple of 7 fields, and trailer, parsed back with the layout from the PostgreSQL docs.
+    """
+    row = ('some text é', 'post.txt', 'abc123', 2, 10, 250)
+    data = binary_payload([row], [VECTOR]).read()
+
+    assert data[:11] == b'PGCOPY\n\xff\r\n\x00'
+    flags, extension = struct.unpack('!ii', data[11:19])
+    assert (flags, extension) == (0, 0)
+    offset = 19
+
+    (fields,) = struct.unpack_from('!h', data, offset)
+    assert fields == len(COPY_COLUMNS) == 7
+    offset += 2
+    values = []
+    for _ in range(fields):
+        (length,) = struct.unpack_from('!i', data, offset)
+        offset += 4
+        values.append(data[offset:offset + length])
+        offset += length
+
+    assert [value.decode('utf-8') for value in values[:3]] == list(row[:3])
+    assert [struct.unpack('!i', value)[0] for value in values[3:6]] == list(row[3:6])
+    assert values[6] == encode_vector(VECTOR)
+    assert data[offset:] == b'\xff\xff'  # Trailer: field count -1
+
+def test_binary_payload_null_field():
+    data = binary_payload([(None, 'post.txt', 'abc123', 0, 0, 1)], [VECTOR]).read()
+    assert struct.unpack_from('!hi', data, 19) == (7, -1)
+
+if __name__ == '__main__':
+    test_encode_vector_layout()
+    test_binary_payload_round_trip()
+    test_binary_payload_null_field()
+    print("All pg_copy tests passed.")
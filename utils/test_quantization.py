@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests that the compact storage tiers in quantization.py rank rows like exact cosine similarity.
+Queries are noisy copies of known rows, so each has a clear nearest neighbour.
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from quantization import approximate_scores, code_size, encode
+
+ROWS = 2000
+DIM = 256
+QUERIES = 20
+
+def unit(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def make_data(seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = unit(rng.standard_normal((ROWS, DIM)))
+    targets = rng.choice(ROWS, QUERIES, replace=False)
+    queries = unit(vectors[targets] + 0.05 * rng.standard_normal((QUERIES, DIM)))
+    return vectors, queries, targets
+
+def ranks(scores):
+    return np.argsort(np.argsort(-scores))
+
+def test_code_sizes():
+    vectors, _, _ = make_data()
+    for storage in ('halfvec', 'int8', 'binary'):
+        codes = encode(storage, vectors)
+        assert codes.dtype == np.uint8
+        assert codes.shape == (ROWS, code_size(storage, DIM))
+
+def test_int8_and_halfvec_ranks_match_exact():
+    vectors, queries, targets = make_data()
+    exact = queries @ vectors.T
+    for storage in ('halfvec', 'int8'):
+        approx = approximate_scores(storage, queries, encode(storage, vectors))
+        assert approx.shape == exact.shape
+        assert (approx.argmax(axis=1) == targets).all()
+        for query_exact, query_approx in zip(exact, approx):
+            # Spearman rank correlation over every row
+            correlation = np.corrcoef(ranks(query_exact), ranks(query_approx))[0, 1]
+            assert correlation > 0.99, (storage, correlation)
+
+def test_binary_shortlist_contains_exact_neighbours():
+    vectors, queries, targets = make_data()
+    exact = queries @ vectors.T
+    approx = approximate_scores('binary', queries, encode('binary', vectors))
+    assert (approx.argmax(axis=1) == targets).all()
+    # Coarser than int8: only the shortlist that gets re-ranked exactly has to agree
+    exact_top = np.argsort(-exact, axis=1)[:, :5]
+    shortlist = np.argsort(-approx, axis=1, kind='stable')[:, :200]
+    recall = np.mean([len(set(top) & set(row)) / 5 for top, row in zip(exact_top, shortlist)])
+    assert recall >= 0.8, recall  # A random shortlist of 200 would recall 0.1
+
+def test_unknown_tier():
+    try:
+        encode('float32', np.zeros((1, DIM), dtype=np.float32))
+    except ValueError:
+        return
+    assert False, "float32 has no codes"
+
+if __name__ == '__main__':
+    test_code_sizes()
+    test_int8_and_halfvec_ranks_match_exact()
+    test_binary_shortlist_contains_exact_neighbours()
+    test_unknown_tier()
+    print("All quantization tests passed.")
@@ -1,8 +1,15 @@
 import os
-import json
+import sys
 import openai
-import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
+from manifest import Manifest, read_and_hash
+from corpus_store import CorpusStore, doc_id_for, get_corpus_store
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tracing
+from embedder import count_tokens
+from openai_client import create
 
 # Load environment variables from .env if present
 try:
@@ -11,110 +18,131 @@ try:
 except ImportError:
     pass
 
-from openai import OpenAI
-client = OpenAI()
-
 CORPUS_DIR = 'corpus'
 OUTPUT_DIR = 'processed_corpus'
-
-# Set up OpenAI API key (no longer needed with OpenAI() if env is set)
-# openai.api_key = os.getenv('OPENAI_API_KEY')
+TITLE_MODEL = 'gpt-3.5-turbo'
+TITLE_CONCURRENCY = int(os.getenv('TITLE_CONCURRENCY', '8'))  # Title requests in flight at once
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def get_file_hash(filepath: str) -> str:
+def title_request(filename: str, content: str) -> dict:
     """
-    Calculate SHA-256 hash of a file for change detection.
+    Chat completion parameters asking for a title for the document; shared with batch_mode.py.
     """
-    hash_sha256 = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_sha256.update(chunk)
-    return hash_sha256.hexdigest()
+    prompt = f'''Given this filename: "{filename}" and the following content, generate a concise, descriptive title (max 10 words) that captures the main topic or theme:\n\nContent:\n{content[:1000]}...\n\nPlease provide only the title, nothing else.'''
+    return {
+        'model': TITLE_MODEL,
+        'messages': [
+            {"role": "system", "content": "You are a helpful assistant that generates concise, descriptive titles for documents."},
+            {"role": "user", "content": prompt}
+        ],
+        'max_tokens': 50,
+        'temperature': 0.3
+    }
 
-def is_file_unchanged(txt_path: str, json_path: str) -> bool:
+def clean_title(title: Optional[str], filename: str) -> str:
     """
-    Check if the source file has changed by comparing hashes stored in the JSON.
+    Strip whitespace and quotes from a generated title, falling back to the filename if nothing is left.
     """
-    if not os.path.exists(json_path):
-        return False
-    
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
-        
-        # Check if hash is stored in the JSON
-        if 'source_hash' not in json_data:
-            return False
-        
-        # Calculate current hash of source file
-        current_hash = get_file_hash(txt_path)
-        
-        # Compare with stored hash
-        return json_data['source_hash'] == current_hash
-    
-    except (json.JSONDecodeError, KeyError):
-        return False
+    title = (title or '').strip().strip('"').strip("'")
+    return title or os.path.splitext(filename)[0]
 
 def generate_title(filename: str, content: str) -> Optional[str]:
     """
     Generate a title for the document using OpenAI API (new v1.x syntax).
     Uses both the filename and content to create a meaningful title.
+    Rate limits and transient errors are retried by openai_client; if they persist the error is raised,
+    so the file is retried on the next run instead of keeping a fallback title.
+    Requests the API rejects outright fall back to the filename.
     """
+    params = title_request(filename, content)
     try:
-        prompt = f'''Given this filename: "{filename}" and the following content, generate a concise, descriptive title (max 10 words) that captures the main topic or theme:\n\nContent:\n{content[:1000]}...\n\nPlease provide only the title, nothing else.'''
-
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that generates concise, descriptive titles for documents."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=50,
-            temperature=0.3
+        response = create(
+            'chat', params.pop('model'), count_tokens(params['messages'][1]['content'], TITLE_MODEL) + 80,
+            purpose='title',
+            **params
         )
-        title = response.choices[0].message.content.strip()
-        title = title.strip('"').strip("'")
-        return title
-    except Exception as e:
+    except openai.BadRequestError as e:
         print(f"Error generating title for {filename}: {e}")
-        return os.path.splitext(filename)[0]
+        return clean_title(None, filename)
+    return clean_title(response.choices[0].message.content, filename)
+
+def process_txt_file(filename: str, manifest: Manifest, store: CorpusStore) -> Optional[str]:
+    """
+    Generate a title for one corpus file and store the processed document.
+    The file is read once, producing both its text and its hash.
+    Returns the title, or None if the contents are unchanged since the last run.
+    """
+    txt_path = os.path.join(CORPUS_DIR, filename)
+    doc_id = doc_id_for(filename)
 
-def process_txt_files():
-    for filename in os.listdir(CORPUS_DIR):
-        if filename.endswith('.txt'):
-            txt_path = os.path.join(CORPUS_DIR, filename)
-            json_filename = os.path.splitext(filename)[0] + '.json'
-            json_path = os.path.join(OUTPUT_DIR, json_filename)
-            
-            # Check if processed file already exists and source hasn't changed
-            if os.path.exists(json_path) and is_file_unchanged(txt_path, json_path):
-                print(f"Skipping {filename} - already processed and unchanged")
+    with tracing.span('file.read_hash'):
+        text, source_hash, stat = read_and_hash(txt_path)
+
+    # The stat changed (or was never recorded), but the contents may not have
+    if store.get_source_hash(doc_id) == source_hash:
+        manifest.update(filename, stat, source_hash)
+        return None
+
+    # Generate title using OpenAI
+    title = generate_title(filename, text)
+
+    # Store title, text, filename, and source hash; the write is a single transaction
+    with tracing.span('corpus_store.put'):
+        store.put({
+            'id': doc_id,
+            'title': title,
+            'text': text,
+            'filename': filename,
+            'source_hash': source_hash
+        })
+    manifest.update(filename, stat, source_hash)
+    return title
+
+def process_txt_files(concurrency: int = TITLE_CONCURRENCY):
+    """
+    Process every new or changed .txt file in CORPUS_DIR, with up to concurrency files in flight.
+    Files whose size and mtime match the manifest are skipped without being opened.
+    """
+    manifest = Manifest()
+    store = get_corpus_store()
+    stored_ids = store.ids()
+    filenames = []
+    present = set()
+    skipped = 0
+    with os.scandir(CORPUS_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.txt') or not entry.is_file():
                 continue
-            
-            print(f"Processing {filename}...")
-            
-            with open(txt_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-            
-            # Generate title using OpenAI
-            title = generate_title(filename, text)
-            
-            # Calculate hash of source file for future change detection
-            source_hash = get_file_hash(txt_path)
-            
-            # Create JSON object with title, text, filename, and source hash
-            json_obj = {
-                'title': title,
-                'text': text,
-                'filename': filename,
-                'source_hash': source_hash
-            }
-            
-            with open(json_path, 'w', encoding='utf-8') as jf:
-                json.dump(json_obj, jf, ensure_ascii=False, indent=2)
-            
-            print(f"Processed {filename} -> {title}")
+            present.add(entry.name)
+            if manifest.is_unchanged(entry.name, entry.stat()) and doc_id_for(entry.name) in stored_ids:
+                skipped += 1
+            else:
+                filenames.append(entry.name)
+    # Files deleted since they were processed; their rows go at the next upload
+    for filename in set(manifest.entries) - present:
+        manifest.remove(filename)
+        store.delete(doc_id_for(filename))
+    print(f"Skipping {skipped} unchanged files; checking {len(filenames)}")
+
+    filenames.sort()
+    total = len(filenames)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = {pool.submit(process_txt_file, filename, manifest, store): filename for filename in filenames}
+            for done, future in enumerate(as_completed(futures), 1):
+                filename = futures[future]
+                try:
+                    title = future.result()
+                except Exception as e:
+                    print(f"[{done}/{total}] Error processing {filename}: {e}")
+                    continue
+                if title is None:
+                    print(f"[{done}/{total}] Skipping {filename} - already processed and unchanged")
+                else:
+                    print(f"[{done}/{total}] Processed {filename} -> {title}")
+    finally:
+        manifest.save()
 
 if __name__ == '__main__':
-    process_txt_files() 
\ No newline at end of file
+    process_txt_files()
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 """
-Script to update existing JSON files with source hashes for memoization.
+Script to update existing JSON files with source hashes for memoization,
+then import them into the corpus store and record them in the stat-based
+manifest used by text_to_json.py.
 """
 
 import os
 import json
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from manifest import Manifest, read_and_hash
+from corpus_store import get_corpus_store
 
 CORPUS_DIR = 'corpus'
 OUTPUT_DIR = 'processed_corpus'
@@ -64,5 +69,49 @@ def update_existing_files():
     
     print(f"\nUpdated {updated_count} files with source hashes")
 
+def migrate_to_manifest():
+    """
+    Record every processed document whose source still matches its stored hash in the manifest,
+    so the next text_to_json.py run can skip it from its stat alone. Documents with no stored
+    hash get the current one, as update_existing_files() does. Hashing runs in parallel.
+    """
+    manifest = Manifest()
+    store = get_corpus_store()
+    pending = []
+    for doc in store.iter_documents(fields=('filename', 'source_hash')):
+        txt_path = os.path.join(CORPUS_DIR, doc['filename'])
+        if os.path.exists(txt_path):
+            pending.append((doc, txt_path))
+
+    def check(item):
+        doc, txt_path = item
+        try:
+            _, current_hash, stat = read_and_hash(txt_path)
+        except (OSError, UnicodeDecodeError) as e:
+            # Left out of the manifest, so text_to_json.py reads it again next run
+            print(f"Error checking {doc['filename']}: {e}")
+            return doc, None, None
+        return doc, stat, current_hash
+
+    recorded_count = unreadable_count = 0
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as pool:
+        for doc, stat, current_hash in pool.map(check, pending):
+            if stat is None:
+                unreadable_count += 1
+                continue
+            if doc['source_hash'] is None:
+                full_doc = store.get(doc['id'])
+                full_doc['source_hash'] = current_hash
+                store.put(full_doc)
+            elif doc['source_hash'] != current_hash:
+                print(f"Not recording {doc['filename']} - source changed since it was processed")
+                continue
+            manifest.update(doc['filename'], stat, current_hash)
+            recorded_count += 1
+    manifest.save()
+    print(f"Recorded {recorded_count} files in {manifest.path}"
+          + (f"; skipped {unreadable_count} that couldn't be read" if unreadable_count else ""))
+
 if __name__ == '__main__':
-    update_existing_files() 
\ No newline at end of file
+    update_existing_files()
+    migrate_to_manifest() 
\ No newline at end of file
@@ -0,0 +1,373 @@
+"""
+vector_store.py: Pluggable storage and retrieval backends for embedded passages.
+- PgVectorStore: the blog_style table in Postgres with pgvector (default).
+- LocalVectorStore (local_vector_store.py): an in-process NumPy store on disk, for laptops and CI.
+
+Pick one with VECTOR_BACKEND=pgvector|local. Both ingest (create_embeddings_and_upload.py)
+and compose (compose.py) go through get_store(), so they always agree on the backend.
+
+VECTOR_STORAGE=halfvec|int8|binary searches a compact copy of the embeddings (int8 is local only),
+keeping the top_k * RERANK_FACTOR candidates and re-ranking them exactly on the full float32 vectors.
+EMBEDDING_DIMENSIONS (embedder.py) sets the size both backends expect.
+
+Rows are (txt, source_file, source_hash, chunk_index, char_start, char_end) tuples.
+Search results are dicts with txt, source_file, chunk_index and distance (cosine distance),
+plus the stored embedding as vector when search() is called with with_vectors=True.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from schema import (DISTANCE_OPERATOR, EMBEDDING_DIMENSIONS, HNSW_EF_SEARCH, TABLE_NAME, VECTOR_STORAGE,
+                    VERSION_TABLE, ensure_index, ensure_schema, set_search_params, storage_index)
+from pg_copy import COPY_COLUMNS, COPY_FORMAT, copy_payload, format_vector
+
+# Load environment variables from .env if present
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'pgvector')
+
+DB_NAME = os.getenv('PGDATABASE', 'henry-pg')
+DB_USER = os.getenv('PGUSER', 'postgres')
+DB_PASSWORD = os.getenv('PGPASSWORD', 'supersecret')
+DB_HOST = os.getenv('PGHOST', 'localhost')
+DB_PORT = os.getenv('PGPORT', '5432')
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+PG_UPLOAD_METHOD = os.getenv('PG_UPLOAD_METHOD', 'copy')  # copy | values (INSERT ... VALUES, the old path)
+PG_UPLOAD_BATCH_ROWS = int(os.getenv('PG_UPLOAD_BATCH_ROWS', '5000'))  # Rows per committed batch
+RERANK_FACTOR = int(os.getenv('RERANK_FACTOR', '4'))  # Candidates per result kept for exact re-ranking
+STAGING_TABLE = f'{TABLE_NAME}_staging'
+
+def iter_source_batches(rows, embeddings, batch_rows):
+    """
+    Split rows and embeddings into batches of about batch_rows, never dividing a source file between batches.
+    Rows of the same source must be adjacent, as every caller produces them.
+    """
+    batch, batch_embeddings = [], []
+    for row, embedding in zip(rows, embeddings):
+        if len(batch) >= batch_rows and row[1] != batch[-1][1]:
+            yield batch, batch_embeddings
+            batch, batch_embeddings = [], []
+        batch.append(row)
+        batch_embeddings.append(embedding)
+    if batch:
+        yield batch, batch_embeddings
+
+class VectorStore:
+    """
+    Interface shared by the storage backends.
+    """
+    name = None
+
+    def warm_up(self):
+        """
+        Open connections or load files ahead of the first query.
+        """
+
+    def ensure_schema(self):
+        """
+        Create whatever tables or files the backend needs.
+        """
+
+    def source_hashes(self):
+        """
+        Return {source_file: source_hash} for every source currently stored.
+        """
+        raise NotImplementedError
+
+    def upsert(self, rows, embeddings):
+        """
+        Store rows with their embeddings, replacing every stored chunk of the sources they belong to.
+        """
+        raise NotImplementedError
+
+    def delete_sources(self, source_files):
+        """
+        Remove every row belonging to the given source files.
+        """
+        raise NotImplementedError
+
+    def search(self, embeddings, top_k, with_vectors=False):
+        """
+        Return, for each query embedding, the top_k nearest rows by cosine distance.
+        """
+        raise NotImplementedError
+
+    def version(self):
+        """
+        Return a token that changes whenever stored rows change, or None if the backend can't tell.
+        Results cached under one version are valid for as long as version() returns it.
+        """
+        return None
+
+    def close(self):
+        pass
+
+class PgVectorStore(VectorStore):
+    """
+    blog_style in Postgres, accessed through a thread-safe connection pool.
+    """
+    name = 'pgvector'
+
+    def __init__(self, pool_min=DB_POOL_MIN, pool_max=DB_POOL_MAX, upload_method=PG_UPLOAD_METHOD,
+                 copy_format=COPY_FORMAT, batch_rows=PG_UPLOAD_BATCH_ROWS, storage=VECTOR_STORAGE,
+                 rerank_factor=RERANK_FACTOR, dimensions=EMBEDDING_DIMENSIONS):
+        if upload_method not in ('copy', 'values'):
+            raise ValueError(f"Unknown PG_UPLOAD_METHOD {upload_method!r}; expected 'copy' or 'values'")
+        storage_index(storage, dimensions)  # Rejects tiers pgvector can't index
+        self.storage = storage
+        self.rerank_factor = max(1, rerank_factor)
+        self.dimensions = dimensions
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.upload_method = upload_method
+        self.copy_format = copy_format
+        self.batch_rows = batch_rows
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_slots = threading.BoundedSemaphore(pool_max)
+
+    def get_pool(self):
+        """
+        Return the connection pool, creating it on first use.
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+                self._pool = ThreadedConnectionPool(
+                    self.pool_min,
+                    self.pool_max,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    host=DB_HOST,
+                    port=DB_PORT
+                )
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection, waiting for a free one if all pool_max are in use.
+        Connections that fail mid-use are closed rather than returned to the pool.
+        """
+        import psycopg2
+        with self._pool_slots:
+            pool = self.get_pool()
+            conn = pool.getconn()
+            broken = False
+            try:
+                yield conn
+                conn.rollback()  # Leave no transaction open on a pooled connection
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                pool.putconn(conn, close=broken or conn.closed)
+
+    def warm_up(self):
+        self.get_pool()
+
+    def ensure_schema(self):
+        with self.connection() as conn:
+            ensure_schema(conn, self.dimensions)
+            ensure_index(conn, storage=self.storage, dimensions=self.dimensions)
+
+    def source_hashes(self):
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT DISTINCT source_file, source_hash FROM {TABLE_NAME}")
+                return dict(cur.fetchall())
+
+    def copy_rows(self, cur, rows, embeddings):
+        """
+        Stream rows into the session's staging table with COPY, then merge them into blog_style.
+        """
+        cur.execute(
+            f"""
+            CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+                txt TEXT,
+                source_file TEXT,
+                source_hash TEXT,
+                chunk_index INTEGER,
+                char_start INTEGER,
+                char_end INTEGER,
+                emb vector
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+        payload, options = copy_payload(rows, embeddings, self.copy_format)
+        cur.copy_expert(f"COPY {STAGING_TABLE} ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH ({options})", payload)
+        cur.execute(
+            f"""
+            INSERT INTO {TABLE_NAME} ({', '.join(COPY_COLUMNS)})
+            SELECT {', '.join(COPY_COLUMNS)} FROM {STAGING_TABLE}
+            ON CONFLICT (source_file, chunk_index) DO UPDATE SET
+                txt = EXCLUDED.txt,
+                emb = EXCLUDED.emb,
+                source_hash = EXCLUDED.source_hash,
+                char_start = EXCLUDED.char_start,
+                char_end = EXCLUDED.char_end
+            """
+        )
+
+    def insert_values(self, cur, rows, embeddings):
+        """
+        Insert rows with a multi-row INSERT ... VALUES, rendering each vector as a list literal.
+        """
+        from psycopg2.extras import execute_values
+        data = [
+            (txt, embedding, source_file, source_hash, chunk_index, char_start, char_end)
+            for (txt, source_file, source_hash, chunk_index, char_start, char_end), embedding in zip(rows, embeddings)
+        ]
+        execute_values(
+            cur,
+            f"""
+            INSERT INTO {TABLE_NAME} (txt, emb, source_file, source_hash, chunk_index, char_start, char_end)
+            VALUES %s
+            ON CONFLICT (source_file, chunk_index) DO UPDATE SET
+                txt = EXCLUDED.txt,
+                emb = EXCLUDED.emb,
+                source_hash = EXCLUDED.source_hash,
+                char_start = EXCLUDED.char_start,
+                char_end = EXCLUDED.char_end
+            """,
+            data
+        )
+
+    def upsert(self, rows, embeddings):
+        """
+        Insert or replace chunk rows, then drop chunks past the new end of each re-chunked source.
+        Rows go in batches of whole sources, each committed on its own: if an upload fails part way,
+        the committed sources already carry their new hash and the next run only redoes the rest.
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                for batch, batch_embeddings in iter_source_batches(rows, embeddings, self.batch_rows):
+                    if self.upload_method == 'copy':
+                        self.copy_rows(cur, batch, batch_embeddings)
+                    else:
+                        self.insert_values(cur, batch, batch_embeddings)
+                    chunk_counts = {}
+                    for row in batch:
+                        chunk_counts[row[1]] = max(chunk_counts.get(row[1], 0), row[3] + 1)
+                    cur.execute(
+                        f"""
+                        DELETE FROM {TABLE_NAME} t
+                        USING unnest(%s::text[], %s::int[]) AS n(source_file, chunk_count)
+                        WHERE t.source_file = n.source_file AND t.chunk_index >= n.chunk_count
+                        """,
+                        (list(chunk_counts), list(chunk_counts.values()))
+                    )
+                    conn.commit()
+
+    def delete_sources(self, source_files):
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"DELETE FROM {TABLE_NAME} WHERE source_file = ANY(%s)",
+                    (list(source_files),)
+                )
+            conn.commit()
+
+    def search_query(self, with_vectors):
+        """
+        SQL taking (query vectors, top_k) or, for a compact tier, (query vectors, candidates, top_k).
+        """
+        if self.storage == 'float32':
+            vector_column = ', t.emb::real[] AS vector' if with_vectors else ''
+            return f"""
+                SELECT q.ord AS query, r.*
+                FROM unnest(%s::vector[]) WITH ORDINALITY AS q(emb, ord)
+                CROSS JOIN LATERAL (
+                    SELECT txt, source_file, chunk_index, t.emb {DISTANCE_OPERATOR} q.emb AS distance{vector_column}
+                    FROM {TABLE_NAME} t
+                    ORDER BY t.emb {DISTANCE_OPERATOR} q.emb
+                    LIMIT %s
+                ) r
+                ORDER BY q.ord, r.distance
+                """
+        # The inner scan uses the index on the compact expression; the outer sort re-ranks exactly
+        row_expression, _, operator = storage_index(self.storage, self.dimensions, 't.emb')
+        query_expression, _, _ = storage_index(self.storage, self.dimensions, 'q.emb')
+        vector_column = ', c.emb::real[] AS vector' if with_vectors else ''
+        return f"""
+            SELECT q.ord AS query, r.*
+            FROM unnest(%s::vector[]) WITH ORDINALITY AS q(emb, ord)
+            CROSS JOIN LATERAL (
+                SELECT c.txt, c.source_file, c.chunk_index, c.emb {DISTANCE_OPERATOR} q.emb AS distance{vector_column}
+                FROM (
+                    SELECT txt, source_file, chunk_index, emb
+                    FROM {TABLE_NAME} t
+                    ORDER BY {row_expression} {operator} {query_expression}
+                    LIMIT %s
+                ) c
+                ORDER BY c.emb {DISTANCE_OPERATOR} q.emb
+                LIMIT %s
+            ) r
+            ORDER BY q.ord, r.distance
+            """
+
+    def search(self, embeddings, top_k, with_vectors=False):
+        """
+        Search for every query in one round trip: each query vector is joined LATERAL to its own index scan.
+        """
+        from psycopg2.extras import RealDictCursor
+        results = [[] for _ in range(len(embeddings))]
+        if not results:
+            return results
+        vectors = [format_vector(embedding) for embedding in embeddings]
+        if self.storage == 'float32':
+            params, ef_search = (vectors, top_k), HNSW_EF_SEARCH
+        else:
+            candidates = top_k * self.rerank_factor
+            # HNSW returns at most ef_search rows per scan
+            params, ef_search = (vectors, candidates, top_k), max(HNSW_EF_SEARCH or 0, candidates)
+        with self.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                set_search_params(cur, ef_search)
+                cur.execute(self.search_query(with_vectors), params)
+                for row in cur.fetchall():
+                    row = dict(row)
+                    results[row.pop('query') - 1].append(row)
+        return results
+
+    def version(self):
+        import psycopg2
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                try:
+                    cur.execute(f"SELECT version FROM {VERSION_TABLE}")
+                except psycopg2.errors.UndefinedTable:
+                    return None  # Created by the next ingest's ensure_schema()
+                row = cur.fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(backend=None):
+    """
+    Return the shared store for backend (default: VECTOR_BACKEND).
+    """
+    backend = backend or VECTOR_BACKEND
+    with _stores_lock:
+        if backend not in _stores:
+            if backend == 'pgvector':
+                _stores[backend] = PgVectorStore()
+            elif backend == 'local':
+                from local_vector_store import LocalVectorStore
+                _stores[backend] = LocalVectorStore()
+            else:
+                raise ValueError(f"Unknown VECTOR_BACKEND {backend!r}; expected 'pgvector' or 'local'")
+        return _stores[backend]
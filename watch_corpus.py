@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+watch_corpus.py: Keep the corpus store and vector store in step with corpus/ as files change.
+- Watches corpus/ with inotify (Linux, through ctypes), or where that isn't available by comparing
+  file stats every WATCH_POLL_SECONDS. Either way, no file is read unless it changed.
+- Bursts of events (an editor saving, a copy of many files) are debounced: a batch is processed once
+  WATCH_DEBOUNCE_SECONDS pass without a new event, or WATCH_MAX_DELAY_SECONDS after its first event.
+- Created or modified .txt files are re-titled, chunked, embedded, and replace their rows in the
+  vector store; deleted or moved-away files are removed from the corpus store and the vector store.
+- With DEDUP on, the dedup index (dedup.py) is built once at startup and each batch updates it with just
+  the changed documents before embedding, so near-duplicates aren't embedded, and documents the batch
+  affects (a copy whose original was deleted, or a post that now repeats a new one) are re-uploaded or
+  removed to match. The dedup report is written at startup and after a rescan, not per batch.
+- Starts with one normal pipeline pass (pipeline.py) to catch up on changes made while it wasn't
+  running, and runs another if the kernel's event queue overflows; --no-initial-scan skips the first.
+  That pass also removes documents whose files were deleted while it wasn't running.
+
+Usage:
+
+    python watch_corpus.py [--poll] [--no-initial-scan]
+"""
+import os
+import sys
+import time
+import errno
+import select
+import signal
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+import dedup
+from embedder import embed_texts
+from vector_store import get_store
+from create_embeddings_and_upload import get_source_hash, iter_chunk_rows
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from manifest import Manifest, read_and_hash
+from corpus_store import doc_id_for, get_corpus_store
+
+# Load environment variables from .env if present
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+CORPUS_DIR = 'corpus'
+WATCH_DEBOUNCE_SECONDS = float(os.getenv('WATCH_DEBOUNCE_SECONDS', '1.0'))  # Quiet time that ends a burst
+WATCH_MAX_DELAY_SECONDS = float(os.getenv('WATCH_MAX_DELAY_SECONDS', '10'))  # Longest a change waits
+WATCH_POLL_SECONDS = float(os.getenv('WATCH_POLL_SECONDS', '2'))  # Stat interval without inotify
+TITLE_WORKERS = int(os.getenv('TITLE_CONCURRENCY', '8'))
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len; the name follows
+
+class InotifyWatcher:
+    """
+    Reports names in one directory that were created, written, moved, or deleted, using inotify.
+    """
+
+    def __init__(self, path):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {path}")
+        self.path = path
+
+    def changes(self, timeout=None):
+        """
+        Wait up to timeout seconds (None: until something happens) and return (names, overflowed).
+        overflowed means events were lost and the directory needs a full rescan.
+        """
+        names, overflowed = set(), False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return names, overflowed
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    raise RuntimeError(f"{self.path} was removed or moved; stopping")
+                if name:
+                    names.add(os.fsdecode(name))
+        return names, overflowed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """
+    Reports .txt files whose size, mtime, or inode changed, or that appeared or vanished, since the last scan.
+    """
+
+    def __init__(self, path, interval=WATCH_POLL_SECONDS):
+        self.path = path
+        self.interval = interval
+        self.snapshot = self.scan()
+        self.next_scan = time.monotonic() + interval
+
+    def scan(self):
+        snapshot = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.endswith('.txt') and entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return snapshot
+
+    def changes(self, timeout=None):
+        wait = self.next_scan - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(max(0.0, timeout))
+            return set(), False
+        time.sleep(max(0.0, wait))
+        self.next_scan = time.monotonic() + self.interval
+        snapshot = self.scan()
+        names = {name for name in snapshot.keys() | self.snapshot.keys()
+                 if snapshot.get(name) != self.snapshot.get(name)}
+        self.snapshot = snapshot
+        return names, False
+
+    def close(self):
+        pass
+
+def get_watcher(corpus_dir=CORPUS_DIR, poll=False):
+    if not poll:
+        try:
+            return InotifyWatcher(corpus_dir)
+        except OSError as e:
+            print(f"inotify unavailable ({e}); polling every {WATCH_POLL_SECONDS:g}s instead")
+    return PollingWatcher(corpus_dir)
+
+class CorpusUpdater:
+    """
+    Applies a batch of changed corpus file names to the manifest, corpus store, and vector store.
+    The vector store's source hashes are read once and then kept up to date here, so a batch
+    costs work proportional to its own files rather than to the corpus.
+    """
+
+    def __init__(self, corpus_dir=CORPUS_DIR):
+        self.corpus_dir = corpus_dir
+        self.corpus = get_corpus_store()
+        self.store = get_store()
+        self.store.ensure_schema()
+        self.reload()
+
+    def reload(self):
+        """
+        Re-read the manifest and the stored source hashes, and rebuild the dedup index (when DEDUP is on),
+        e.g. after a full pipeline pass wrote them.
+        """
+        self.manifest = Manifest()
+        self.stored_hashes = self.store.source_hashes()
+        self.applied = dedup.get_signature_cache().applied_plans()
+        self.dedup_index = dedup.index_corpus(self.corpus, get_source_hash) if dedup.DEDUP else None
+
+    def prepare(self, filename):
+        """
+        Read a changed file and, if its text is new, title it and store it in the corpus store.
+        Returns the document to embed, or None if the vector store already has this version.
+        """
+        doc_id = doc_id_for(filename)
+        text, source_hash, stat = read_and_hash(os.path.join(self.corpus_dir, filename))
+        if self.corpus.get_source_hash(doc_id) != source_hash:
+            from text_to_json import generate_title
+            title = generate_title(filename, text)
+            self.corpus.put({'id': doc_id, 'title': title, 'text': text, 'filename': filename,
+                             'source_hash': source_hash})
+            print(f"Processed {filename} -> {title}")
+        self.manifest.update(filename, stat, source_hash)
+        doc = {'filename': filename, 'text': text, 'source_hash': source_hash, 'mtime_ns': stat.st_mtime_ns}
+        if self.stored_hashes.get(filename) == source_hash \
+                and (self.dedup_index is None or self.dedup_index.is_indexed(doc)):
+            return None
+        return doc
+
+    def prepare_all(self, filenames):
+        docs = []
+        with ThreadPoolExecutor(max_workers=max(1, TITLE_WORKERS)) as pool:
+            futures = {filename: pool.submit(self.prepare, filename) for filename in filenames}
+            for filename, future in futures.items():
+                try:
+                    doc = future.result()
+                except FileNotFoundError:
+                    continue  # Gone again; its delete event is on the way
+                except Exception as e:
+                    # Left out of the manifest, so the next change or startup scan retries it
+                    print(f"Error processing {filename}: {e}")
+                    continue
+                if doc is not None:
+                    docs.append(doc)
+        return docs
+
+    def plan_uploads(self, docs, deleted):
+        """
+        Update the dedup index with the changed and deleted documents, remove stored near-duplicates,
+        and return every document to upload: the changed docs that aren't near-duplicates, plus stored
+        documents whose planned chunks changed. Costs work proportional to the documents the batch
+        may affect, not to the corpus.
+        """
+        affected = self.dedup_index.remove(deleted)
+        affected |= self.dedup_index.update(docs, lambda doc: doc['text'], dedup.get_signature_cache())
+        plan = self.dedup_index.plan
+        changed = {doc['filename']: doc for doc in docs}
+        uploads, duplicates = [], []
+        for filename in sorted(affected):
+            if plan.is_duplicate(filename):
+                if filename in self.stored_hashes:
+                    duplicates.append(filename)
+                continue
+            doc = changed.get(filename)
+            if doc is None:
+                doc = self.corpus.get(doc_id_for(filename))
+                if doc is None:
+                    continue
+                doc['source_hash'] = doc['source_hash'] or get_source_hash(doc)
+            if dedup.is_current(self.stored_hashes, self.applied, plan, filename, doc['source_hash']):
+                continue
+            uploads.append(dict(doc, dropped=plan.dropped_chunks(filename), digest=plan.digest(filename)))
+        if duplicates:
+            self.store.delete_sources(duplicates)
+            for filename in duplicates:
+                del self.stored_hashes[filename]
+                if self.applied.pop(filename, None) is not None:
+                    dedup.get_signature_cache().set_applied(filename, '')
+            print(f"Removed near-duplicates {', '.join(sorted(duplicates))}")
+        return uploads
+
+    def upload(self, docs):
+        rows = [row for doc in docs
+                for row in dedup.drop_chunks(list(iter_chunk_rows(doc['filename'], doc['source_hash'], doc['text'])),
+                                             doc.get('dropped'))]
+        if rows:
+            with tracing.span('vector_store.upsert', backend=self.store.name):
+                self.store.upsert(rows, embed_texts([row[0] for row in rows]))
+        # Sources that now have no chunks (empty files) keep no stale rows
+        uploaded = {row[1] for row in rows}
+        empty = [doc['filename'] for doc in docs if doc['filename'] not in uploaded]
+        if empty:
+            self.store.delete_sources(empty)
+        for doc in docs:
+            self.stored_hashes[doc['filename']] = doc['source_hash']
+            self.applied[doc['filename']] = doc.get('digest', '')
+            dedup.get_signature_cache().set_applied(doc['filename'], doc.get('digest', ''))
+        print(f"Uploaded {len(rows)} chunks from {', '.join(doc['filename'] for doc in docs)}")
+
+    def delete(self, filenames):
+        for filename in filenames:
+            self.corpus.delete(doc_id_for(filename))
+            self.manifest.remove(filename)
+        stored = [filename for filename in filenames if filename in self.stored_hashes]
+        if stored:
+            self.store.delete_sources(stored)
+            for filename in stored:
+                del self.stored_hashes[filename]
+        for filename in filenames:
+            if self.applied.pop(filename, None) is not None:
+                dedup.get_signature_cache().set_applied(filename, '')
+        print(f"Removed {', '.join(sorted(filenames))}")
+
+    def apply(self, filenames):
+        start = time.perf_counter()
+        present = [name for name in sorted(filenames) if os.path.isfile(os.path.join(self.corpus_dir, name))]
+        deleted = sorted(set(filenames) - set(present))
+        with tracing.span('watch.apply'):
+            try:
+                if deleted:
+                    self.delete(deleted)
+                docs = self.prepare_all(present)
+                if self.dedup_index is not None and (docs or deleted):
+                    with tracing.span('watch.dedup'):
+                        docs = self.plan_uploads(docs, deleted)
+                if docs:
+                    self.upload(docs)
+            finally:
+                self.manifest.save()
+        print(f"Applied {len(present)} changed and {len(deleted)} deleted files in {time.perf_counter() - start:.1f}s")
+
+def watch(updater, watcher, debounce=WATCH_DEBOUNCE_SECONDS, max_delay=WATCH_MAX_DELAY_SECONDS):
+    """
+    Feed debounced batches of changed .txt names from watcher to updater, until interrupted.
+    """
+    from pipeline import run_pipeline
+    pending, rescan = set(), False
+    first = last = None
+    while True:
+        if pending or rescan:
+            timeout = max(0.0, min(last + debounce, first + max_delay) - time.monotonic())
+        else:
+            timeout = None
+        names, overflowed = watcher.changes(timeout)
+        names = {name for name in names if name.endswith('.txt')}
+        now = time.monotonic()
+        if names or overflowed:
+            if not pending and not rescan:
+                first = now
+            last = now
+            pending |= names
+            rescan = rescan or overflowed
+        if not (pending or rescan) or (now < last + debounce and now < first + max_delay):
+            continue
+        try:
+            if rescan:
+                print("Missed some file events; rescanning the corpus")
+                run_pipeline(updater.corpus_dir)
+                updater.reload()
+            else:
+                updater.apply(pending)
+        except Exception as e:
+            # Errors are per batch; keep watching, and the next change to these files retries them
+            print(f"Error applying changes: {e}")
+        pending, rescan = set(), False
+
+def run_watch(corpus_dir=CORPUS_DIR, poll=False, initial_scan=True):
+    # Stop cleanly (saving the manifest) when run as a service
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # Watch before the catch-up pass, so changes made during it aren't missed
+    watcher = get_watcher(corpus_dir, poll)
+    try:
+        if initial_scan:
+            from pipeline import run_pipeline
+            run_pipeline(corpus_dir)
+        updater = CorpusUpdater(corpus_dir)
+        print(f"Watching {corpus_dir}/ for changes ({type(watcher).__name__}); Ctrl-C to stop")
+        watch(updater, watcher)
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+    finally:
+        watcher.close()
+        get_store().close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest corpus changes as they happen.")
+    parser.add_argument('--poll', action='store_true', help="Poll file stats instead of using inotify")
+    parser.add_argument('--no-initial-scan', action='store_true', help="Don't catch up on changes made before starting")
+    args = parser.parse_args()
+    run_watch(poll=args.poll, initial_scan=not args.no_initial_scan)
+
+if __name__ == '__main__':
+    main()